@@ -0,0 +1,3 @@
+"""
+Benchmarks for the CLI and library hot paths.
+"""
@@ -0,0 +1,173 @@
+"""
+Run the benchmark scenarios, record the results and compare them
+against a stored baseline.
+
+Usage: ``python -m benchmarks [-k PATTERN] [-r REPEAT] [-o OUTPUT] [--save-baseline]``
+
+Each of ``REPEAT`` runs of a scenario is timed relative to a fixed
+calibration workload run right before it, and the median of these relative
+timings is compared to the baseline. This evens out the speed and load of
+the machine and single outliers, but not all differences between machines,
+so the baseline is best saved on the machine that runs the comparison.
+"""
+
+import argparse
+import fnmatch
+import gc
+import json
+import logging
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from .scenarios import SCENARIOS, TOLERANCES, calibration
+
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+CALIBRATION_RUNS = 3
+MIN_REPEAT = 3
+
+
+def run(names, repeat):
+    """
+    Time the named scenarios. Setup is excluded from the measurement.
+    Each repetition is preceded by a few runs of the calibration workload.
+    """
+    results = {}
+    reference = calibration()
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in names:
+            timings = []
+            calibrations = []
+            # Warm up caches of the interpreter and the OS, so even a
+            # single repetition is not dominated by a cold start.
+            SCENARIOS[name](Path(tmp))()
+            for _ in range(repeat):
+                calibrations.append(
+                    min(_time(reference) for _ in range(CALIBRATION_RUNS))
+                )
+                timings.append(_time(SCENARIOS[name](Path(tmp))))
+            results[name] = {
+                "min": min(timings),
+                "median": statistics.median(timings),
+                "repeat": repeat,
+                "calibration": min(calibrations),
+                "relative": statistics.median(
+                    timing / calibrated
+                    for timing, calibrated in zip(timings, calibrations)
+                ),
+            }
+            print(
+                f"{name:<20} min {results[name]['min'] * 1000:10.2f} ms"
+                f"  median {results[name]['median'] * 1000:10.2f} ms",
+                file=sys.stderr,
+            )
+    return results
+
+
+def _time(func):
+    # Like timeit, keep garbage collection from adding noise.
+    gc.collect()
+    gc.disable()
+    try:
+        start = time.perf_counter()
+        func()
+        return time.perf_counter() - start
+    finally:
+        gc.enable()
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare the median timings relative to the calibration workload against
+    a baseline, so differences in the speed and load of the machine cancel
+    out. Returns the names of the scenarios that regressed by more than
+    ``threshold`` or their own tolerance, whichever is larger.
+    """
+    regressed = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        if "relative" in baseline[name]:
+            ratio = result["relative"] / baseline[name]["relative"]
+        else:
+            ratio = result["min"] / baseline[name]["min"]
+        allowed = max(threshold, TOLERANCES.get(name, 0))
+        status = "REGRESSED" if ratio > 1 + allowed else "ok"
+        print(f"{name:<20} {ratio:6.2f}x baseline  {status}", file=sys.stderr)
+        if ratio > 1 + allowed:
+            regressed.append(name)
+    return regressed
+
+
+def main():
+    """
+    Parse arguments and run the benchmarks.
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument(
+        "-k", dest="pattern", default="*", help="Only run matching scenarios."
+    )
+    parser.add_argument(
+        "-r", "--repeat", type=int, default=5, help="Repetitions per scenario."
+    )
+    parser.add_argument("-o", "--output", help="Write the results to this file.")
+    parser.add_argument(
+        "--baseline", default=str(BASELINE), help="Baseline to compare against."
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.25,
+        help="Allowed slowdown relative to the baseline (default 0.25).",
+    )
+    parser.add_argument(
+        "--save-baseline",
+        action="store_true",
+        help="Store the results as the new baseline instead of comparing.",
+    )
+    args = parser.parse_args()
+    # Progress of the scenarios would drown the report.
+    logging.getLogger("dooti").setLevel(logging.WARNING)
+
+    names = [name for name in SCENARIOS if fnmatch.fnmatch(name, args.pattern)]
+    results = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+        },
+        "results": run(names, args.repeat),
+    }
+
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+            f.write("\n")
+        return 0
+
+    try:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+    except FileNotFoundError:
+        print(f"No baseline found in {args.baseline}.", file=sys.stderr)
+        return 0
+    regressed = compare(results["results"], baseline, args.threshold)
+    if regressed and args.repeat < MIN_REPEAT:
+        print(
+            f"Timings of fewer than {MIN_REPEAT} repetitions are too noisy "
+            "to fail on regressions.",
+            file=sys.stderr,
+        )
+        return 0
+    return int(bool(regressed))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
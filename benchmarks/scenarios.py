@@ -0,0 +1,166 @@
+# pylint: disable=missing-function-docstring
+"""
+Benchmark scenarios. Each scenario is a factory that receives a temporary
+directory, performs its (untimed) setup and returns the callable to time.
+"""
+
+import contextlib
+import io
+
+import yaml
+
+from dooti.cli import DootiCLI
+from dooti.state import HandlerState
+
+from .sim import generate
+
+SCENARIOS = {}
+TOLERANCES = {}
+
+
+def scenario(name, tolerance=None):
+    """
+    Register a scenario factory under a name. Scenarios whose timings vary
+    a lot between runs can allow a larger slowdown than the threshold.
+    """
+
+    def wrapper(func):
+        SCENARIOS[name] = func
+        if tolerance is not None:
+            TOLERANCES[name] = tolerance
+        return func
+
+    return wrapper
+
+
+def calibration():
+    """
+    Returns a fixed workload that does not depend on dooti. Scenarios are
+    timed relative to it, so the speed and load of the machine cancel out.
+    """
+    items = [f"org.example.type{num}" for num in range(50_000)]
+
+    def run():
+        index = {}
+        for item in items:
+            index.setdefault(item.rpartition(".")[0], []).append(item.upper())
+        sorted(items, key=len)
+
+    return run
+
+
+def _apply(tmp, size, stream=False):
+    dooti, config = generate(size)
+    file = tmp / f"config-{size}.yaml"
+    if not file.exists():
+        with open(file, "w", encoding="utf-8") as f:
+            yaml.safe_dump(config, f)
+    cli = DootiCLI(assume_yes=True, dooti=dooti)
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            _, diff = cli.apply_(file=file, stream=stream)
+        cli._apply_diff(diff)  # pylint: disable=protected-access
+
+    return run
+
+
+@scenario("apply-10")
+def apply_10(tmp):
+    return _apply(tmp, 10)
+
+
+@scenario("apply-1k")
+def apply_1k(tmp):
+    return _apply(tmp, 1_000)
+
+
+# Large applies allocate a lot and vary most between runs.
+@scenario("apply-10k", tolerance=0.5)
+def apply_10k(tmp):
+    return _apply(tmp, 10_000)
+
+
+@scenario("apply-stream-10k", tolerance=0.5)
+def apply_stream_10k(tmp):
+    return _apply(tmp, 10_000, stream=True)
+
+
+def _lookup(scope, size):
+    dooti, _ = generate(size)
+    cli = DootiCLI(dooti=dooti)
+    targets = {
+        "ext": [f"ext{num}" for num in range(size)],
+        "scheme": [f"scheme{num}" for num in range(size)],
+        "uti": [f"org.example.type{num}" for num in range(size)],
+    }[scope]
+    return lambda: getattr(cli, scope)(targets)
+
+
+@scenario("lookup-ext-5k")
+def lookup_ext(_):
+    return _lookup("ext", 5_000)
+
+
+@scenario("lookup-scheme-5k")
+def lookup_scheme(_):
+    return _lookup("scheme", 5_000)
+
+
+@scenario("lookup-uti-5k")
+def lookup_uti(_):
+    return _lookup("uti", 5_000)
+
+
+@scenario("lookup-handler-5k")
+def lookup_handler(_):
+    dooti, _ = generate(10)
+    cli = DootiCLI(dooti=dooti)
+    refs = [
+        ref
+        for num in range(8)
+        for ref in (
+            f"App {num}",
+            f"org.example.app{num}",
+            f"/Applications/App {num}.app",
+        )
+    ] * 200
+
+    def run():
+        cli.handlers.clear()
+        for ref in refs:
+            cli._lookup_handler(ref)  # pylint: disable=protected-access
+
+    return run
+
+
+def _output(fmt, size):
+    cli = DootiCLI(fmt=fmt, dooti=generate(10)[0])
+    cli.changes = HandlerState.compare(
+        "utis",
+        (
+            (
+                f"org.example.type{num}",
+                f"/Applications/App {num % 8}.app",
+                f"/Applications/App {(num + 1) % 8}.app",
+            )
+            for num in range(size)
+        ),
+        lambda current, wanted: current == wanted,
+    )
+
+    def run():
+        with contextlib.redirect_stdout(io.StringIO()):
+            cli._output()  # pylint: disable=protected-access
+
+    return run
+
+
+@scenario("output-yaml-10k")
+def output_yaml(_):
+    return _output("yaml", 10_000)
+
+
+@scenario("output-json-10k")
+def output_json(_):
+    return _output("json", 10_000)
@@ -0,0 +1,70 @@
+"""
+Simulated system for running dooti without LaunchServices.
+
+The simulation is built on the stand-ins of the test suite, which keep the
+handler state in memory and replace all methods of ``Dooti`` that would call
+into the ObjC bridge, so it works on any platform. Everything above that
+layer (catalog, CLI planning and output) runs unmodified.
+"""
+
+import random
+
+from dooti.catalog import Catalog
+from tests.helpers import FakeWorkspace, StubDooti
+
+
+def generate(size, apps=8, seed=0):  # pylint: disable=too-many-locals
+    """
+    Generate a reproducible system and a configuration of ``size`` entries.
+    Roughly half of the configured targets already point to the requested handler.
+
+    Returns a tuple of ``(StubDooti, config dict)``.
+
+    :param int size: number of entries in the configuration
+    :param int apps: number of installed applications
+    :param int seed: seed for the random generator
+    """
+    rnd = random.Random(seed)
+    names = [f"App {num}" for num in range(apps)]
+    paths = {name: f"/Applications/{name}.app" for name in names}
+    installed = dict(paths)
+    installed.update(
+        {f"org.example.app{num}": paths[name] for num, name in enumerate(names)}
+    )
+
+    catalog = Catalog(
+        extensions=(f"ext{num}" for num in range(size)),
+        utis=(f"org.example.type{num}" for num in range(size)),
+        schemes=(f"scheme{num}" for num in range(size)),
+        parents={f"org.example.type{num}": ["public.data"] for num in range(size)},
+        tags={
+            f"org.example.type{num}": {"ext": [f"ext{num}"], "mime": []}
+            for num in range(size)
+        },
+        exported=(f"org.example.type{num}" for num in range(size)),
+    )
+
+    handlers = {}
+    config = {"ext": {}, "scheme": {}, "uti": {}, "app": {}}
+    for num in range(size):
+        target = rnd.choice(names)
+        current = target if rnd.random() < 0.5 else rnd.choice(names)
+        ref = rnd.choice((target, f"org.example.app{names.index(target)}"))
+        kind = rnd.random()
+        if kind < 0.5:
+            config["ext"][f"ext{num}"] = ref
+            handlers[f"org.example.type{num}"] = paths[current]
+        elif kind < 0.7:
+            config["uti"][f"org.example.type{num}"] = ref
+            handlers[f"org.example.type{num}"] = paths[current]
+        elif kind < 0.8:
+            config["scheme"][f"scheme{num}"] = ref
+            handlers[f"scheme{num}"] = paths[current]
+        else:
+            config["app"].setdefault(target, {}).setdefault("ext", []).append(
+                f"ext{num}"
+            )
+            handlers[f"org.example.type{num}"] = paths[current]
+
+    workspace = FakeWorkspace(installed, handlers)
+    return StubDooti(workspace=workspace, catalog=catalog), config
@@ -68,6 +68,30 @@ def docs_dev(session):
     session.run("sphinx-autobuild", *args)
 
 
+@nox.session(python="3")
+def benchmarks(session):
+    """
+    Run the benchmarks against a simulated workspace and compare
+    the results to the stored baseline.
+    Pass ``--save-baseline`` to update the baseline, preferably on
+    the machine that runs the comparison.
+    """
+    if sys.platform == "darwin":
+        _install(session, "-e", ".")
+    else:
+        # pyobjc can only be installed on macOS, the simulation does not need it.
+        _install(session, "--no-deps", "-e", ".")
+        _install(session, "pyyaml", "xdg")
+    session.run(
+        "python",
+        "-m",
+        "benchmarks",
+        "--output",
+        str(ARTIFACTS_DIR / "benchmarks.json"),
+        *session.posargs,
+    )
+
+
 @nox.session(python="3")
 def tests(session):
     return _tests(session)
@@ -1,6 +1,22 @@
 __author__ = "jeanluc"
 __version__ = "0.2.1"
 
-from .dooti import ApplicationNotFound, BundleURLNotFound, Dooti, ExtHasNoRegisteredUTI
+# pylint: disable=undefined-all-variable
+__all__ = [
+    "ApplicationNotFound",
+    "BundleURLNotFound",
+    "Dooti",
+    "ExtHasNoRegisteredUTI",
+    "HandlerNotSet",
+]
+# pylint: enable=undefined-all-variable
 
-__all__ = ["ApplicationNotFound", "BundleURLNotFound", "Dooti", "ExtHasNoRegisteredUTI"]
+
+def __getattr__(name):
+    # Importing the ObjC bridge is slow and only possible on macOS. Defer it,
+    # so modules that do not need it (e.g. the catalog) can be used without.
+    if name in __all__:
+        from . import dooti  # pylint: disable=import-outside-toplevel
+
+        return getattr(dooti, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,528 @@
+"""
+Index of file extensions, UTIs and URL schemes known to the system.
+
+The index is built from the declarations in the ``Info.plist`` of
+installed bundles, which does not require any calls into LaunchServices.
+"""
+
+import bisect
+import fnmatch
+import hashlib
+import json
+import logging
+import os
+import plistlib
+import re
+from pathlib import Path
+
+from .paths import cache_dir
+
+log = logging.getLogger(__name__)
+
+CACHE_VERSION = 2
+REGEX_META = frozenset(".^$*+?{}[]\\|()")
+
+TYPE_BUNDLES = (Path("/System/Library/CoreServices/CoreTypes.bundle"),)
+"""
+Bundles that declare the system-defined UTIs. Nested bundles inside
+``Contents/Library`` are included as well.
+"""
+
+HANDLER_RANKS = ("None", "Alternate", "Default", "Owner")
+"""
+Values of ``LSHandlerRank``, from least to most preferred.
+"""
+
+ROLES = ("None", "Shell", "Viewer", "Editor")
+"""
+Values of ``CFBundleTypeRole``, from least to most preferred.
+"""
+
+APP_DIRS = (
+    Path("/Applications"),
+    Path("/Applications/Utilities"),
+    Path("/System/Applications"),
+    Path("/System/Applications/Utilities"),
+    Path("/System/Library/CoreServices"),
+    Path("~/Applications").expanduser(),
+)
+"""
+Directories that are searched for application bundles.
+"""
+
+
+class Catalog:  # pylint: disable=too-many-instance-attributes
+    """
+    Collection of file extensions, UTIs and URL schemes declared by
+    installed bundles, including an index of the UTI conformance graph
+    and of the file extensions and MIME types tagging each UTI.
+    """
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        extensions=(),
+        utis=(),
+        schemes=(),
+        parents=None,
+        tags=None,
+        exported=(),
+    ):
+        self.extensions = set(extensions)
+        self.utis = set(utis)
+        self.schemes = set(schemes)
+        self.parents = {uti: set(sup) for uti, sup in (parents or {}).items()}
+        # Ordered by declaration, which determines the preferred UTI for a tag
+        self.tags = {
+            uti: {tag_class: list(vals) for tag_class, vals in uti_tags.items()}
+            for uti, uti_tags in (tags or {}).items()
+        }
+        self.exported = set(exported)
+        # Fingerprint of the bundles the catalog was built from, set by load
+        self.fingerprint = None
+        # Derived indices, built on demand
+        self._by_tag = None
+        self._children = None
+        self._conforming = {}
+        self._sorted = {}
+        self._expanded = {}
+
+    @classmethod
+    def load(cls, cache_file=None, bundles=None) -> "Catalog":
+        """
+        Load the catalog from the cache. The catalog is rebuilt and the cache
+        refreshed when a bundle was added, removed or modified since.
+
+        :param Path cache_file: path to the cache. Defaults to ``catalog.json``
+                                inside the dooti cache directory.
+        :param list bundles: bundle paths to read. Defaults to the system type
+                             bundles and all applications found in ``APP_DIRS``.
+        """
+        if cache_file is None:
+            cache_file = cache_dir() / "catalog.json"
+        if bundles is None:
+            bundles = find_bundles()
+
+        fingerprint = _fingerprint(bundles)
+        try:
+            with open(cache_file, encoding="utf-8") as f:
+                cached = json.load(f)
+            if (
+                cached["version"] == CACHE_VERSION
+                and cached["fingerprint"] == fingerprint
+            ):
+                catalog = cls.from_dict(cached)
+                catalog.fingerprint = fingerprint
+                return catalog
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+        catalog = cls.scan(bundles)
+        catalog.fingerprint = fingerprint
+        try:
+            catalog.save(cache_file, fingerprint)
+        except OSError as err:
+            log.warning("Could not write catalog cache: %s", err)
+        return catalog
+
+    @classmethod
+    def read(cls, cache_file) -> "Catalog":
+        """
+        Load a catalog written by ``save`` without checking whether it
+        matches the installed bundles, e.g. one exported from another machine.
+
+        :param Path cache_file: path to the catalog
+        """
+        try:
+            with open(cache_file, encoding="utf-8") as f:
+                return cls.from_dict(json.load(f))
+        except (ValueError, KeyError, TypeError, IndexError) as err:
+            raise ValueError(f"Invalid catalog `{cache_file}`: {err}") from err
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "Catalog":
+        """
+        Create a catalog from its serialized form (see ``to_dict``).
+
+        :param dict data: serialized catalog
+        """
+        utis = data["utis"]
+        return cls(
+            extensions=data["extensions"],
+            utis=utis,
+            schemes=data["schemes"],
+            parents={uti: rec[0] for uti, rec in utis.items()},
+            tags={
+                uti: {"ext": rec[1], "mime": rec[2]}
+                for uti, rec in utis.items()
+                if rec[1] or rec[2]
+            },
+            exported=(uti for uti, rec in utis.items() if rec[3]),
+        )
+
+    def to_dict(self) -> dict:
+        """
+        Returns a compact, JSON-serializable representation of the catalog.
+        Each UTI maps to a list of its parents, file extensions, MIME types
+        and whether it was exported by a bundle.
+        """
+        utis = list(self.tags) + sorted(self.utis.difference(self.tags))
+        return {
+            "extensions": sorted(self.extensions),
+            "schemes": sorted(self.schemes),
+            "utis": {
+                uti: [
+                    sorted(self.parents.get(uti, ())),
+                    self.tags.get(uti, {}).get("ext", []),
+                    self.tags.get(uti, {}).get("mime", []),
+                    int(uti in self.exported),
+                ]
+                for uti in utis
+            },
+        }
+
+    def save(self, cache_file: Path, fingerprint: str = "") -> None:
+        """
+        Write the catalog to a cache file.
+
+        :param Path cache_file: path to write the catalog to
+        :param str fingerprint: fingerprint of the bundles the catalog was built from
+        """
+        cache_file = Path(cache_file)
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        data = {"version": CACHE_VERSION, "fingerprint": fingerprint}
+        data.update(self.to_dict())
+        tmp = cache_file.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, cache_file)
+
+    def ext_utis(self, ext: str) -> list[str]:
+        """
+        Returns all UTI declared for a file extension. Exported declarations
+        come before imported ones, the preferred UTI is the first element.
+
+        :param str ext: file extension to look up UTI for
+        """
+        return self._tag_index()["ext"].get(ext.lower(), [])
+
+    def mime_utis(self, mime: str) -> list[str]:
+        """
+        Returns all UTI declared for a MIME type. Exported declarations
+        come before imported ones, the preferred UTI is the first element.
+
+        :param str mime: MIME type to look up UTI for
+        """
+        return self._tag_index()["mime"].get(mime.lower(), [])
+
+    def uti_tags(self, uti: str) -> dict[str, list[str]]:
+        """
+        Returns the file extensions (``ext``) and MIME types (``mime``)
+        declared for a UTI.
+
+        :param str uti: UTI to look up tags for
+        """
+        tags = self.tags.get(uti, {})
+        return {"ext": list(tags.get("ext", [])), "mime": list(tags.get("mime", []))}
+
+    def conforming(self, uti: str) -> list[str]:
+        """
+        Returns all known UTI that conform to the specified one, directly or
+        transitively, including the UTI itself. Results are cached.
+
+        :param str uti: UTI to look up conforming types for
+        """
+        if uti not in self._conforming:
+            if self._children is None:
+                self._children = {}
+                for child, parents in self.parents.items():
+                    for parent in parents:
+                        self._children.setdefault(parent, []).append(child)
+            found = {uti}
+            queue = [uti]
+            while queue:
+                for child in self._children.get(queue.pop(), ()):
+                    if child not in found:
+                        found.add(child)
+                        queue.append(child)
+            self._conforming[uti] = sorted(found)
+        return self._conforming[uti]
+
+    @classmethod
+    def scan(cls, bundles=None) -> "Catalog":
+        """
+        Build a catalog from the declarations of installed bundles.
+
+        :param list bundles: bundle paths to read. Defaults to the system type
+                             bundles and all applications found in ``APP_DIRS``.
+        """
+        if bundles is None:
+            bundles = find_bundles()
+        catalog = cls()
+        for bundle in bundles:
+            catalog.add_bundle(bundle)
+        return catalog
+
+    def add_bundle(self, bundle: Path) -> None:
+        """
+        Add the declarations of a single bundle to the catalog.
+        Bundles without a readable ``Info.plist`` are skipped.
+
+        :param Path bundle: path to the bundle
+        """
+        info = read_info(bundle)
+        if info is None:
+            return
+        self._reset_indices()
+
+        for doc_type in _as_list(info.get("CFBundleDocumentTypes")):
+            if not isinstance(doc_type, dict):
+                continue
+            self.extensions.update(
+                ext.lower()
+                for ext in _strings(doc_type.get("CFBundleTypeExtensions"))
+                if ext != "*"
+            )
+            self.utis.update(_strings(doc_type.get("LSItemContentTypes")))
+
+        for key in ("UTExportedTypeDeclarations", "UTImportedTypeDeclarations"):
+            for decl in _as_list(info.get(key)):
+                if isinstance(decl, dict):
+                    self._add_declaration(decl, "UTExportedTypeDeclarations" == key)
+
+        for url_type in _as_list(info.get("CFBundleURLTypes")):
+            if not isinstance(url_type, dict):
+                continue
+            self.schemes.update(
+                scheme.lower()
+                for scheme in _strings(url_type.get("CFBundleURLSchemes"))
+            )
+
+    def _add_declaration(self, decl, exported):
+        uti = decl.get("UTTypeIdentifier")
+        if not isinstance(uti, str):
+            return
+        self.utis.add(uti)
+        self.parents.setdefault(uti, set()).update(
+            _strings(decl.get("UTTypeConformsTo"))
+        )
+        if exported:
+            self.exported.add(uti)
+
+        spec = decl.get("UTTypeTagSpecification")
+        if not isinstance(spec, dict):
+            return
+        tags = self.tags.setdefault(uti, {"ext": [], "mime": []})
+        for tag_class, tag_key in (
+            ("ext", "public.filename-extension"),
+            ("mime", "public.mime-type"),
+        ):
+            for tag in _strings(spec.get(tag_key)):
+                tag = tag.lower()
+                if tag not in tags[tag_class]:
+                    tags[tag_class].append(tag)
+        self.extensions.update(tags["ext"])
+
+    def expand(self, pattern: str, kind: str) -> list[str]:
+        """
+        Returns all known file extensions, MIME types or UTI matching a pattern,
+        sorted. Patterns are either globs or regular expressions enclosed in slashes.
+        Candidates are narrowed down by the literal prefix of the pattern,
+        results are cached per pattern.
+
+        :param str pattern: glob, e.g. ``public.*-source``, or
+                            regular expression, e.g. ``/^(c|h)(pp|xx)?$/``
+        :param str kind: ``ext`` to match file extensions, ``mime`` to match
+                         MIME types, ``uti`` to match UTI
+
+        :raises:
+            ValueError: when the regular expression is invalid
+        """
+        key = (kind, pattern)
+        if key not in self._expanded:
+            if kind not in self._sorted:
+                self._sorted[kind] = sorted(
+                    {
+                        "ext": self.extensions,
+                        "mime": self._tag_index()["mime"],
+                        "uti": self.utis,
+                    }[kind]
+                )
+            candidates = self._sorted[kind]
+
+            if is_regex(pattern):
+                try:
+                    regex = re.compile(pattern[1:-1])
+                except re.error as err:
+                    raise ValueError(
+                        f"Invalid regular expression '{pattern}': {err}"
+                    ) from err
+                prefix = _regex_prefix(pattern[1:-1])
+                matches = regex.search
+            else:
+                if kind in ("ext", "mime"):
+                    pattern = pattern.lower()
+                prefix = re.split(r"[*?[]", pattern, maxsplit=1)[0]
+                regex = re.compile(fnmatch.translate(pattern))
+                matches = regex.match
+
+            found = []
+            for pos in range(bisect.bisect_left(candidates, prefix), len(candidates)):
+                if not candidates[pos].startswith(prefix):
+                    break
+                if matches(candidates[pos]):
+                    found.append(candidates[pos])
+            self._expanded[key] = found
+        return self._expanded[key]
+
+    def _tag_index(self):
+        if self._by_tag is None:
+            self._by_tag = {"ext": {}, "mime": {}}
+            # Declaration order is kept, but exported types are preferred.
+            for exported in (True, False):
+                for uti, tags in self.tags.items():
+                    if (uti in self.exported) is not exported:
+                        continue
+                    for tag_class, index in self._by_tag.items():
+                        for tag in tags.get(tag_class, ()):
+                            index.setdefault(tag, []).append(uti)
+        return self._by_tag
+
+    def _reset_indices(self):
+        self._by_tag = None
+        self._children = None
+        self._conforming = {}
+        self._sorted = {}
+        self._expanded = {}
+
+
+def handler_rank(info: dict | None, kind: str, target: str) -> tuple[int, int]:
+    """
+    Returns the rank and role a bundle declares for handling a UTI or URL
+    scheme as indices into ``HANDLER_RANKS`` and ``ROLES``, or ``(-1, -1)``
+    if it does not declare the target itself (e.g. only a type it conforms to).
+    Higher values are preferred.
+
+    :param dict info: parsed ``Info.plist`` of the bundle, see ``read_info``
+    :param str kind: ``uti`` or ``scheme``
+    :param str target: UTI or URL scheme
+    """
+    if "scheme" == kind:
+        key, tags = "CFBundleURLTypes", "CFBundleURLSchemes"
+    else:
+        key, tags = "CFBundleDocumentTypes", "LSItemContentTypes"
+    target = target.lower()
+    best = (-1, -1)
+    for decl in _as_list((info or {}).get(key)):
+        if not isinstance(decl, dict) or target not in (
+            tag.lower() for tag in _strings(decl.get(tags))
+        ):
+            continue
+        # LaunchServices assumes the Default rank if none is declared.
+        rank = decl.get("LSHandlerRank", "Default")
+        role = decl.get("CFBundleTypeRole", "None")
+        best = max(
+            best,
+            (
+                HANDLER_RANKS.index(rank) if rank in HANDLER_RANKS else 0,
+                ROLES.index(role) if role in ROLES else 0,
+            ),
+        )
+    return best
+
+
+def is_regex(item: str) -> bool:
+    """
+    Checks whether a config key is a regular expression enclosed in slashes.
+
+    :param str item: config key to check
+    """
+    return len(item) > 2 and item.startswith("/") and item.endswith("/")
+
+
+def is_pattern(item: str) -> bool:
+    """
+    Checks whether a config key is a glob pattern or a regular expression.
+
+    :param str item: config key to check
+    """
+    return is_regex(item) or any(char in item for char in "*?[")
+
+
+def find_bundles(app_dirs=APP_DIRS):
+    """
+    Returns the paths of the system type bundles and all application bundles
+    found in ``app_dirs`` or in directories directly below them, like
+    ``/Applications/Setapp``.
+
+    :param app_dirs: directories to search, defaults to ``APP_DIRS``
+    """
+    bundles = []
+    for bundle in TYPE_BUNDLES:
+        bundles.append(bundle)
+        bundles.extend(sorted((bundle / "Contents" / "Library").glob("*.bundle")))
+    for app_dir in app_dirs:
+        bundles.extend(sorted(app_dir.glob("*.app")))
+        bundles.extend(
+            sorted(
+                app for app in app_dir.glob("*/*.app") if app.parent.suffix != ".app"
+            )
+        )
+    return list(dict.fromkeys(bundles))
+
+
+def _regex_prefix(expr):
+    """
+    Returns the literal string every match of an anchored regular
+    expression starts with, if it can be determined trivially.
+    """
+    if not expr.startswith("^") or "|" in expr:
+        return ""
+    prefix = ""
+    for char in expr[1:]:
+        if char in REGEX_META:
+            if char in "?*{":
+                # the preceding character is optional
+                prefix = prefix[:-1]
+            break
+        prefix += char
+    return prefix
+
+
+def _fingerprint(bundles):
+    digest = hashlib.sha256()
+    for bundle in bundles:
+        try:
+            mtime = os.stat(Path(bundle) / "Contents" / "Info.plist").st_mtime_ns
+        except OSError:
+            continue
+        digest.update(f"{bundle}:{mtime}\n".encode())
+    return digest.hexdigest()
+
+
+def read_info(bundle) -> dict | None:
+    """
+    Returns the parsed ``Info.plist`` of a bundle or ``None`` if it is unreadable.
+
+    :param Path bundle: path to the bundle
+    """
+    try:
+        with open(Path(bundle) / "Contents" / "Info.plist", "rb") as f:
+            info = plistlib.load(f)
+    except (OSError, ValueError, plistlib.InvalidFileException):
+        return None
+    if not isinstance(info, dict):
+        return None
+    return info
+
+
+def _as_list(value):
+    if isinstance(value, list):
+        return value
+    return []
+
+
+def _strings(value):
+    if isinstance(value, str):
+        return [value]
+    return [val for val in _as_list(value) if isinstance(val, str)]
@@ -1,81 +1,250 @@
+# pylint: disable=too-many-lines
 import argparse
+import contextlib
+import hashlib
+import itertools
 import json
 import logging
+import os
 import sys
 import time
 from pathlib import Path
+from typing import NamedTuple
 
 import yaml
 from xdg import xdg_config_home
 
-from .dooti import ApplicationNotFound, Dooti
+from . import trace
+from .catalog import APP_DIRS, Catalog, is_pattern
+from .completion import SHELLS, script
+from .dooti import MAX_IN_FLIGHT, ApplicationNotFound, Dooti
+from .lock import ApplyLock
+from .paths import launchservices_prefs
+from .profiles import ProfileStore
+from .state import KINDS, HandlerState
+from .stream import is_jsonl, iter_entries
+from .watch import LaunchServicesEvents, Schedule, Watcher
 
 log = logging.getLogger(__name__)
 logging.basicConfig(
     stream=sys.stderr, level=logging.INFO, format="{levelname}: {message}", style="{"
 )
 
+SNAPSHOT_CHUNK_SIZE = 256
+STREAM_CHUNK_SIZE = 500
+VERIFY_INTERVAL = 24 * 60 * 60
+ENFORCE_INTERVAL = 15 * 60
 
-class DootiCLI:
+
+class Claim(NamedTuple):
+    """
+    A configuration entry that assigns a handler to a UTI or URL scheme.
+    """
+
+    location: str
+    entry: str
+    handler: str
+    item: str | None = None
+    """
+    The entry with patterns expanded, e.g. one of the file extensions it matches.
+    """
+
+    @property
+    def scope(self) -> str:
+        """
+        The scope of the entry, e.g. ``ext`` for ``app.Preview.ext``.
+        """
+        return self.location.rsplit(".", 1)[-1]
+
+
+class DootiCLI:  # pylint: disable=too-many-instance-attributes
     """
     Wraps Dooti for the command line.
     """
 
-    changes = {}
-    errors = []
-    handlers = {}
-    scopes = ("ext", "scheme", "uti")
+    # Broader scopes come first, so more specific definitions take precedence.
+    scopes = ("conforms", "mime", "ext", "scheme", "uti")
 
-    def __init__(self, assume_yes=False, dry_run=False, fmt="yaml"):
-        self.do = Dooti()
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        assume_yes=False,
+        dry_run=False,
+        fmt="yaml",
+        dooti=None,
+        write_rate=None,
+        max_in_flight=MAX_IN_FLIGHT,
+    ):
+        self._dooti = dooti
+        self._catalog = None
+        self.write_rate = write_rate
+        self.max_in_flight = max_in_flight
         self.assume_yes = assume_yes
         self.dry_run = dry_run
         self.fmt = fmt
+        self.changes = HandlerState()
+        self.errors = []
+        self.handlers = {}
+        # file extension that planned UTI take effect through, see _reported
+        self.sources = {}
+        self.lock = None
+        self.config_hash = None
+        self.profile_name = None
+        self.completed = False
+        self.streamed = False
+        self.skipped = False
+
+    @property
+    def do(self):
+        """
+        The wrapped Dooti instance. Created on first use, so runs that are
+        skipped do not load the ObjC bridge.
+        """
+        if self._dooti is None:
+            self._dooti = Dooti(
+                catalog=self._catalog,
+                write_rate=self.write_rate,
+                max_in_flight=self.max_in_flight,
+            )
+        return self._dooti
 
-    def apply_(self, file=None, dynamic=False):
+    @property
+    def catalog(self):
+        """
+        The catalog entries are resolved with, usually the one of ``do``.
+        Loaded without the ObjC bridge if nothing else needs it.
+        """
+        if self._catalog is not None:
+            return self._catalog
+        if self._dooti is not None:
+            return self._dooti.catalog
+        with trace.span("load catalog"):
+            self._catalog = Catalog.load()
+        return self._catalog
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def apply_(
+        self,
+        file=None,
+        dynamic=False,
+        stream=False,
+        chunk_size=None,
+        force=False,
+        verify_interval=VERIFY_INTERVAL,
+        only=None,
+        app=None,
+    ):
         """
         Apply configuration from a file.
         """
         file = self._find_config(file)
+        targets = [
+            target.strip()
+            for value in only or ()
+            for target in value.split(",")
+            if target.strip()
+        ]
+        # Partial runs neither skip nor count as applying the configuration.
+        if self.lock is not None and not (targets or app):
+            self.config_hash = _hash_config(file, dynamic)
+            record = self.lock.coalesced(self.config_hash)
+            if record is not None:
+                log.info(
+                    "The same configuration was applied while waiting. Nothing to do."
+                )
+                self.errors.extend(record.get("errors", []))
+                self.skipped = True
+                return None, HandlerState()
+            if not force and self._unchanged(verify_interval):
+                log.info(
+                    "Nothing changed since the configuration was last applied. "
+                    "Pass --force to check anyway."
+                )
+                self.skipped = True
+                return None, HandlerState()
+        if stream or is_jsonl(file):
+            if targets or app:
+                raise ValueError("Streamed configurations cannot be applied partially.")
+            self._apply_stream(file, dynamic, chunk_size or STREAM_CHUNK_SIZE)
+            return None, HandlerState()
         definitions = self._load_config(file)
+        if targets or app:
+            plan = self._select(definitions, dynamic, targets, app or ())
+        else:
+            plan = self._compile(definitions, dynamic)
+        return None, HandlerState.merge((self._plan_diff(plan, {}),), kinds=KINDS)
 
-        parsed = {"extensions": {}, "schemes": {}, "utis": {}}
-
-        for ext, handler in definitions.get("ext", {}).items():
-            try:
-                _, single = self.ext([ext], dynamic=dynamic, handler=handler)
-                parsed["extensions"].update(single["extensions"])
-            except ApplicationNotFound as err:
-                self.errors.append(str(err))
-
-        for scope in ("scheme", "uti"):
-            parser = getattr(self, scope)
-            for item, handler in definitions.get(scope, {}).items():
-                try:
-                    _, single = parser([item], handler=handler)
-                    parsed[f"{scope}s"].update(single[f"{scope}s"])
-                except ApplicationNotFound as err:
-                    self.errors.append(str(err))
+    def _apply_stream(self, file, dynamic, chunk_size):
+        """
+        Reads a configuration in chunks of definitions and keeps only the
+        claim that takes effect for each target, so memory use grows with
+        the number of targets instead of definitions. The targets are then
+        planned and applied in chunks. Claims take precedence like in
+        ``_iter_entries``, so streaming does not change the result.
+        """
+        if not (self.assume_yes or self.dry_run):
+            raise ValueError(
+                "Streamed configurations are applied chunk by chunk. "
+                "Pass `-y`/`--yes` or `-t`/`--dry-run`."
+            )
+        self.streamed = True
+        effective = self._read_stream(file, dynamic, chunk_size)
+        done = 0
+        for num, chunk in enumerate(_chunked(effective.items(), chunk_size), 1):
+            with trace.span("plan chunk", chunk=num):
+                plan = self._compile_claims(
+                    (kind, target, claim) for (kind, target), (_, claim) in chunk
+                )
+                diff = HandlerState.merge((self._plan_diff(plan, {}),), kinds=KINDS)
+            self.changes = HandlerState()
+            with trace.span("apply chunk", chunk=num):
+                self._apply_diff(diff)
+            changed = len(diff)
+            done += len(chunk)
+            log.info(
+                "Chunk %d: planned %d of %d targets, %d changes.",
+                num,
+                done,
+                len(effective),
+                changed,
+            )
+            if changed:
+                self._output({"changes": self.changes.to_dict()}, document=True)
 
-        for handler, app_config in definitions.get("app", {}).items():
-            if "ext" in app_config:
-                try:
-                    _, single = self.ext(
-                        app_config["ext"], dynamic=dynamic, handler=handler
-                    )
-                    parsed["extensions"].update(single["extensions"])
-                except ApplicationNotFound as err:
-                    self.errors.append(str(err))
-            for scope in ("scheme", "uti"):
-                if scope in app_config:
-                    parser = getattr(self, scope)
-                    try:
-                        _, single = parser(app_config[scope], handler=handler)
-                        parsed[f"{scope}s"].update(single[f"{scope}s"])
-                    except ApplicationNotFound as err:
-                        self.errors.append(str(err))
+    def _read_stream(self, file, dynamic, chunk_size):
+        """
+        Returns the claim that takes effect for each target of a streamed
+        configuration as ``{(kind, target): (precedence, claim)}``.
+        """
+        effective = {}
+        apps = {}
+        total = 0
+        for num, chunk in enumerate(_chunked(iter_entries(file), chunk_size), 1):
+            with trace.span("read chunk", chunk=num):
+                for kind, target, claim in self._resolve_claims(chunk, dynamic):
+                    rank = self._precedence(claim, apps)
+                    current = effective.get((kind, target))
+                    # later claims with the same precedence win
+                    if current is None or rank >= current[0]:
+                        effective[kind, target] = rank, claim
+            total += len(chunk)
+            log.info("Read %d definitions.", total)
+        if not total:
+            raise ValueError(
+                "Configuration does not contain any actionable definitions."
+            )
+        return effective
 
-        return None, parsed
+    def _precedence(self, claim, apps):
+        """
+        Returns a key that orders claims like ``_iter_entries`` applies them:
+        top-level definitions by scope, then ``app`` blocks in the order
+        they appear, each by scope. ``apps`` keeps the order of the blocks.
+        """
+        rank = self.scopes.index(claim.scope)
+        if claim.location == claim.scope:
+            return (0, rank)
+        return (1, apps.setdefault(claim.handler, len(apps)), rank)
 
     def ext(self, extensions, dynamic=False, handler=None):
         """
@@ -98,13 +267,11 @@ class DootiCLI:
                 )
             extensions = allowed_extensions
 
-        diff = {
-            ext: {"from": current[ext], "to": handler}
-            for ext in extensions
-            if current[ext] != handler
-        }
-
-        return current, {"extensions": diff}
+        return current, HandlerState.compare(
+            "extensions",
+            ((ext, current[ext], handler) for ext in extensions),
+            self.do.same_handler,
+        )
 
     def scheme(self, schemes, handler=None):
         """
@@ -117,18 +284,22 @@ class DootiCLI:
 
         handler = self._lookup_handler(handler)
 
-        diff = {
-            scheme: {"from": current[scheme], "to": handler}
-            for scheme in schemes
-            if current[scheme] != handler
-        }
-
-        return current, {"schemes": diff}
+        return current, HandlerState.compare(
+            "schemes",
+            ((scheme, current[scheme], handler) for scheme in schemes),
+            self.do.same_handler,
+        )
 
-    def uti(self, utis, handler=None):
+    def uti(self, utis, handler=None, conforming=False):
         """
         Set handler or get handlers for a list of UTI.
         """
+        if conforming:
+            utis = list(
+                dict.fromkeys(
+                    child for uti in utis for child in self.do.conforming_utis(uti)
+                )
+            )
         current = {uti: self.do.get_default_uti(uti) for uti in utis}
 
         if handler is None:
@@ -136,13 +307,319 @@ class DootiCLI:
 
         handler = self._lookup_handler(handler)
 
-        diff = {
-            uti: {"from": current[uti], "to": handler}
-            for uti in utis
-            if current[uti] != handler
-        }
+        return current, HandlerState.compare(
+            "utis",
+            ((uti, current[uti], handler) for uti in utis),
+            self.do.same_handler,
+        )
+
+    def mime(self, mimes, handler=None):
+        """
+        Set handler or get handlers for all UTI registered to a list of MIME types.
+        """
+        utis = []
+        unknown = []
+        for mime in mimes:
+            registered = self.do.mime_to_utis(mime)
+            if not registered:
+                unknown.append(mime)
+            utis.extend(registered)
+        if unknown and handler is None:
+            # The output of getters has no room for errors.
+            raise ValueError(
+                "No UTI are registered for MIME type(s) "
+                + ", ".join(f"'{mime}'" for mime in unknown)
+                + "."
+            )
+        self.errors.extend(
+            f"No UTI are registered for MIME type '{mime}'." for mime in unknown
+        )
+
+        return self.uti(list(dict.fromkeys(utis)), handler=handler)
+
+    def snapshot(self, file):
+        """
+        Export the current default handlers of all known file extensions,
+        URL schemes and UTI to a file.
+        """
+        catalog = self.catalog
+        counts = {}
+
+        with open(file, "w", encoding="utf-8") as f:
+            for scope, targets in (
+                ("ext", catalog.extensions),
+                # The file:// scheme cannot be looked up.
+                ("scheme", catalog.schemes - {"file"}),
+                ("uti", catalog.utis),
+            ):
+                counts[scope] = 0
+                for chunk in _chunked(sorted(targets), SNAPSHOT_CHUNK_SIZE):
+                    current, _ = getattr(self, scope)(chunk)
+                    for target in chunk:
+                        if current[target] is None:
+                            continue
+                        if not counts[scope]:
+                            f.write(f"{scope}:\n")
+                        f.write(
+                            "  "
+                            + yaml.safe_dump(
+                                {target: current[target]},
+                                allow_unicode=True,
+                                width=float("inf"),
+                            )
+                        )
+                        counts[scope] += 1
+                log.info("Exported %d %s handlers.", counts[scope], scope)
+
+        return counts, None
+
+    def profile(self, action, name=None, dynamic=False):
+        """
+        List profiles or switch to one.
+        """
+        store = ProfileStore()
+        if "list" == action:
+            return {"active": store.active(), "profiles": store.names()}, None
+
+        file = store.find(name)
+        # Plans also depend on the installed types, e.g. via file extensions.
+        source = _hash_config(file, dynamic, self.catalog.fingerprint)
+        plan = store.compiled(name, source)
+        if plan is None:
+            plan = self._compile(self._load_config(file), dynamic)
+            # Incomplete plans are recompiled on the next switch.
+            if not self.errors:
+                store.save(name, source, plan)
+
+        # Targets both profiles assign to the same handler are assumed
+        # to be in place already. Switching to the active profile
+        # checks all of them.
+        active = store.active()
+        previous = store.compiled(active) if active and active != name else None
+
+        self.profile_name = name
+        return None, self._plan_diff(plan, previous or {})
+
+    def _plan_diff(self, plan, previous):
+        """
+        Compares a compiled plan to the live state, skipping targets
+        that ``previous`` assigns to the same handler.
+        """
+        return HandlerState.merge(
+            HandlerState.compare(
+                kind,
+                (
+                    (target, getter(target), handler)
+                    for target, handler in plan.get(kind, {}).items()
+                    if previous.get(kind, {}).get(target) != handler
+                ),
+                self.do.same_handler,
+            )
+            for kind, getter in (
+                ("utis", self.do.get_default_uti),
+                ("schemes", self.do.get_default_scheme),
+            )
+        )
+
+    def explain(self, targets, file=None, dynamic=False):
+        """
+        Show all configuration entries that claim file extensions, UTI or URL
+        schemes, which of them takes effect and the current handler.
+        """
+        definitions = self._load_config(self._find_config(file))
+        index = {}
+        for kind, target, claim in self._iter_claims(definitions, dynamic):
+            index.setdefault((kind, target), []).append(claim)
+
+        explained = {}
+        for target in targets:
+            for kind, resolved in self._resolve_target(target, index):
+                claims = index.get((kind, resolved), [])
+                getter = (
+                    self.do.get_default_uti
+                    if "uti" == kind
+                    else self.do.get_default_scheme
+                )
+                current = getter(resolved)
+                effective = self._describe_claim(claims[-1]) if claims else None
+                explained[resolved] = {
+                    "kind": kind,
+                    "effective": effective,
+                    "overridden": [
+                        self._describe_claim(claim) for claim in reversed(claims[:-1])
+                    ],
+                    "current": current,
+                    "in_effect": effective is not None
+                    and effective["path"] is not None
+                    and self.do.same_handler(current, effective["path"]),
+                }
+        return explained, None
+
+    def candidates(self, targets):
+        """
+        List the applications that can open file extensions, UTI or URL schemes,
+        the current default first.
+        """
+        resolved = [
+            f"{kind}:{item}"
+            for target in targets
+            for kind, item in self._resolve_target(target, {})
+        ]
+        return {
+            key.partition(":")[2]: paths
+            for key, paths in self.do.get_candidates(resolved).items()
+        }, None
+
+    def diff(self, old, new, dynamic=False, catalog=None):
+        """
+        Compare the handlers two configurations assign after resolving
+        all entries to their targets. Only reads the catalog, never the
+        current handlers or applications, so handlers are compared as written.
+        """
+        if catalog is not None:
+            self._catalog = Catalog.read(catalog)
+        with trace.span("normalize"):
+            before, after = (
+                {
+                    (kind, target): claim.handler
+                    for kind, target, claim in self._iter_claims(
+                        self._load_config(self._find_config(file)),
+                        dynamic,
+                        offline=True,
+                    )
+                }
+                for file in (old, new)
+            )
+        diff = {"utis": {}, "schemes": {}}
+        kinds = {"uti": "utis", "scheme": "schemes", "ext": "extensions"}
+        for kind, target in sorted({key for key, _ in before.items() ^ after.items()}):
+            diff.setdefault(kinds[kind], {})[target] = {
+                "from": before.get((kind, target)),
+                "to": after.get((kind, target)),
+            }
+        return diff, None
+
+    def watch(self, file=None, dynamic=False):
+        """
+        Restore the configured handlers whenever they are changed,
+        until interrupted.
+        """
+        file = self._find_config(file)
+
+        def replan():
+            self.handlers.clear()
+            return self._compile(self._load_config(file), dynamic)
+
+        events = LaunchServicesEvents()
+        watcher = Watcher(
+            self.do,
+            replan(),
+            replan=replan,
+            lock=None if self.dry_run else ApplyLock(),
+            dry_run=self.dry_run,
+        )
+        restored = HandlerState()
+        log.info("Watching for changes of default handlers. Press Ctrl-C to stop.")
+        try:
+            for changes, errors in watcher.run(events):
+                restored = HandlerState.merge((restored, changes))
+                self.errors.extend(errors)
+        except KeyboardInterrupt:
+            pass
+        return {"changes": restored.to_dict(), "errors": self.errors}, None
 
-        return current, {"utis": diff}
+    def enforce(self, file=None, dynamic=False, interval=ENFORCE_INTERVAL, jitter=0):
+        """
+        Check and restore the configured handlers periodically,
+        until interrupted.
+        """
+        file = self._find_config(file)
+        schedule = Schedule(interval, jitter)
+        watcher = Watcher(
+            self.do,
+            {},
+            lock=None if self.dry_run else ApplyLock(),
+            dry_run=self.dry_run,
+        )
+        modified = None
+        # Errors of the configuration itself, e.g. a missing application,
+        # do not clear by checking again and are kept until it changes.
+        config_errors = None
+        # Each run is output as a separate document.
+        self.streamed = True
+        log.info(
+            "Checking default handlers every %.0f s, first in %.0f s. "
+            "Press Ctrl-C to stop.",
+            interval,
+            schedule.offset,
+        )
+        try:
+            for _ in schedule:
+                self.errors = []
+                changes = HandlerState()
+                failures = []
+                compiled = False
+                try:
+                    if schedule.failures:
+                        # Start from scratch, e.g. an application moved.
+                        self.do.refresh()
+                    modified, previous = _mtime(file), modified
+                    if (
+                        config_errors is None
+                        or schedule.failures
+                        or modified != previous
+                    ):
+                        self.handlers.clear()
+                        watcher.plan = self._compile(self._load_config(file), dynamic)
+                        config_errors, compiled = self.errors, True
+                    changes, failures = watcher.check()
+                except (ValueError, yaml.YAMLError, OSError) as err:
+                    # e.g. the configuration was removed, retry with backoff
+                    config_errors, failures = None, [str(err)]
+                # Only failed reads and writes are worth retrying sooner.
+                schedule.record(failed=bool(failures))
+                self.errors = [*(config_errors or ()), *failures]
+                if changes or failures or (compiled and self.errors):
+                    self._output(
+                        {"changes": changes.to_dict(), "errors": self.errors},
+                        document=True,
+                    )
+        except KeyboardInterrupt:
+            pass
+        return None, None
+
+    def _resolve_target(self, target, index):
+        """
+        Returns the ``(kind, target)`` pairs an argument of ``explain``
+        or ``candidates`` refers to.
+        Arguments can be prefixed with their scope, e.g. ``ext:py``.
+        Otherwise, they are looked up as URL scheme, UTI and file extension.
+        """
+        scope, sep, item = target.partition(":")
+        if not sep or scope not in ("ext", "mime", "scheme", "uti"):
+            scope, item = None, target
+            if ("scheme", item) in index or item in self.catalog.schemes:
+                scope = "scheme"
+            elif ("uti", item) in index or item in self.catalog.utis:
+                scope = "uti"
+            else:
+                scope = "ext"
+        if "scheme" == scope:
+            return [("scheme", item)]
+        return [("uti", uti) for uti in self._scope_utis(scope, item, dynamic=True)]
+
+    def _describe_claim(self, claim):
+        try:
+            path = self._lookup_handler(claim.handler)
+        except ApplicationNotFound as err:
+            self.errors.append(str(err))
+            path = None
+        return {
+            "location": claim.location,
+            "entry": claim.entry,
+            "handler": claim.handler,
+            "path": path,
+        }
 
     def run(self, func, args):
         """
@@ -150,86 +627,414 @@ class DootiCLI:
         """
         ret = None
         try:
-            current, diff = getattr(self, func)(**vars(args))
-            if diff is None:
-                ret = current
-            else:
-                self._apply_diff(diff)
+            with self._serialize(func, args):
+                with trace.span("plan", command=func):
+                    current, diff = getattr(self, func)(**vars(args))
+                if diff is None:
+                    ret = current
+                else:
+                    with trace.span("apply changes"):
+                        self._apply_diff(diff)
         except (ValueError, yaml.parser.ParserError, ApplicationNotFound) as err:
             self.errors.append(str(err))
         except Exception as err:  # pylint: disable=broad-except
             log.error(str(err))
+            # Partial output must not pass for a result.
+            self.errors.append(str(err))
         finally:
-            self._output(ret)
+            with trace.span("output"):
+                self._output(ret)
             # bandaid for PyThread_exit_thread / pthread_exit being called too early
             # because pyobjc does not have the correct metadata for completionHandler
-            if ret is None:
+            if ret is None and not self.skipped:
                 time.sleep(0.1)
             sys.exit(int(bool(self.errors)))
 
+    def _unchanged(self, verify_interval):
+        """
+        Whether the last run applied the same configuration without errors
+        and nothing it depends on changed since, within the verification interval.
+        """
+        previous = self.lock.fingerprint(self.config_hash, verify_interval)
+        if not previous or not isinstance(previous.get("handlers"), dict):
+            return False
+        handlers = {name: path for name, (path, _) in previous["handlers"].items()}
+        return previous == _fingerprint(handlers)
+
+    @contextlib.contextmanager
+    def _serialize(self, func, args):
+        """
+        Holds the apply lock while planning and applying a configuration,
+        so concurrent runs plan against the result of the previous one.
+        """
+        writes = "apply_" == func or (
+            "profile" == func and "use" == getattr(args, "action", None)
+        )
+        if not writes or self.dry_run:
+            yield
+            return
+        self.lock = ApplyLock()
+        with trace.span("apply lock"):
+            self.lock.acquire()
+        try:
+            # Runs we waited for changed handlers behind our back.
+            if self._dooti is not None:
+                self._dooti.refresh_handlers()
+            yield
+            if self.completed and self.config_hash and not self.skipped:
+                self.lock.record(
+                    self.config_hash,
+                    self.errors,
+                    None if self.errors else _fingerprint(self.handlers),
+                )
+            # Switching from a partly applied profile must check all targets.
+            if self.completed and self.profile_name and not self.errors:
+                ProfileStore().set_active(self.profile_name)
+        finally:
+            self.lock.release()
+
     def _apply_diff(self, diff):
-        if self.dry_run or not any(
-            (scope in diff and diff[scope])
-            for scope in ("extensions", "schemes", "utis")
-        ):
-            self.changes = diff
+        if self.dry_run or not diff:
+            self.changes = self._reported(diff)
+            self.completed = not self.dry_run
             return
-        if not (self.assume_yes or self._ask_consent(diff)):
+        consent = self.assume_yes
+        if not consent:
+            with trace.span("consent"):
+                consent = self._ask_consent(self._reported(diff))
+        if not consent:
             log.info("Did not get consent to apply changes. Exiting.")
             return
 
-        if "extensions" in diff:
-            for ext, handler in diff["extensions"].items():
-                self.do.set_default_ext(ext, handler["to"], allow_dynamic=True)
-            self.changes["extensions"] = diff["extensions"]
+        prefixes = {"extensions": "ext", "schemes": "scheme", "utis": "uti"}
+        results = self.do.set_defaults(
+            {f"{prefixes[kind]}:{target}": change.new for kind, target, change in diff},
+            allow_dynamic=True,
+        )
+        _log_write_stats(self.do.write_stats)
+        failed = set()
+        for kind, target, _ in diff:
+            error = results[f"{prefixes[kind]}:{target}"]
+            if error is not None:
+                self.errors.append(str(error))
+                failed.add((kind, target))
+        self.changes = self._reported(diff.without(failed))
 
-        if "schemes" in diff:
-            for scheme, handler in diff["schemes"].items():
-                self.do.set_default_scheme(scheme, handler["to"])
-            self.changes["schemes"] = diff["schemes"]
+        self.completed = True
 
-        if "utis" in diff:
-            for uti, handler in diff["utis"].items():
-                self.do.set_default_uti(uti, handler["to"])
-            self.changes["utis"] = diff["utis"]
+    def _reported(self, diff):
+        """
+        Reports planned changes of UTI under the file extension entry
+        that claimed them, as written in the configuration.
+        Writes are still made per UTI, so other entries can take
+        precedence for some UTI of a file extension.
+        """
+        if not self.sources:
+            return diff
+        return diff.rekey(
+            lambda kind, target: (
+                ("extensions", self.sources[target])
+                if "utis" == kind and target in self.sources
+                else (kind, target)
+            )
+        )
 
-    def _output(self, ret=None):
+    def _output(self, ret=None, document=False):
         if ret is None:
-            ret = {"changes": self.changes, "errors": self.errors}
+            # Streamed changes were output chunk by chunk.
+            ret = {"errors": self.errors}
+            if not self.streamed:
+                ret = {"changes": self.changes.to_dict(), **ret}
+            document = self.streamed
         if "json" == self.fmt:
             return print(json.dumps(ret))
-        return print(yaml.dump(ret))
+        return print(yaml.dump(ret, explicit_start=document))
 
     def _lookup_handler(self, handler):
         if handler not in self.handlers:
-            self.handlers[handler] = (
-                self.do.get_app_path(handler).fileSystemRepresentation().decode()
-            )
+            with trace.span("resolve handler", handler=handler):
+                self.handlers[handler] = (
+                    self.do.get_app_path(handler).fileSystemRepresentation().decode()
+                )
         return self.handlers[handler]
 
-    def _find_config(self, file=None):
-        if file is None:
-            xch = xdg_config_home()
-
-            for path in (
-                xch / "dooti.yaml",
-                xch / "dooti.yml",
-                xch / "dooti" / "dooti.yaml",
-                xch / "dooti" / "dooti.yml",
-                xch / "dooti" / "config.yaml",
-                xch / "dooti" / "config.yml",
-            ):
-                if path.exists():
-                    return path
-            raise ValueError(f"Could not find dooti configuration in `{xch}`.")
-        if not Path(file).exists():
-            raise ValueError(
-                f"Passed dooti configuration file `{file}` does not exist."
+    def _expand(self, items, scope):
+        """
+        Replaces glob patterns and regular expressions in a list of
+        file extensions or UTI with the matching known ones.
+        """
+        if "scheme" == scope or not any(is_pattern(item) for item in items):
+            return items
+        kind = scope if scope in ("ext", "mime") else "uti"
+        expanded = []
+        for item in items:
+            if not is_pattern(item):
+                expanded.append(item)
+                continue
+            matches = self.catalog.expand(item, kind)
+            if not matches:
+                log.warning(
+                    "Pattern `%s` in scope `%s` did not match anything.", item, scope
+                )
+            expanded.extend(matches)
+        return expanded
+
+    def _iter_entries(self, definitions):
+        """
+        Yields ``(location, scope, entry, handler)`` for every single entry
+        of a configuration in the order they are applied.
+        """
+        for scope in self.scopes:
+            for entry, handler in definitions.get(scope, {}).items():
+                yield scope, scope, entry, handler
+
+        for handler, app_config in definitions.get("app", {}).items():
+            for scope in self.scopes:
+                for entry in app_config.get(scope, ()):
+                    yield f"app.{handler}.{scope}", scope, entry, handler
+
+    def _iter_claims(self, definitions, dynamic=False, offline=False):
+        """
+        Yields ``(kind, target, claim)`` for all entries in the order they
+        are applied. File extensions, MIME types, conforming types and
+        patterns are resolved to the UTI they stand for, so ``kind``
+        is either ``uti`` or ``scheme``.
+
+        When ``offline``, entries are only resolved with the catalog.
+        File extensions it does not know cannot be mapped to their dynamic
+        UTI then and are yielded with kind ``ext``.
+        """
+        return self._resolve_claims(self._iter_entries(definitions), dynamic, offline)
+
+    def _resolve_claims(self, entries, dynamic=False, offline=False):
+        """
+        Same as ``_iter_claims`` for ``(location, scope, entry, handler)``
+        entries, e.g. those of a streamed configuration.
+        """
+        for location, scope, entry, handler in entries:
+            for item in self._expand([entry], scope):
+                claim = Claim(location, entry, handler, item)
+                if "scheme" == scope:
+                    yield "scheme", item, claim
+                    continue
+                utis = self._scope_utis(scope, item, dynamic, offline)
+                if offline and dynamic and "ext" == scope and not utis:
+                    yield "ext", item, claim
+                for uti in utis:
+                    yield "uti", uti, claim
+
+    def _scope_utis(self, scope, item, dynamic=False, offline=False):
+        if offline:
+            return self._catalog_utis(scope, item, dynamic)
+        if "ext" == scope:
+            if not dynamic and self.do.is_dynamic_uti(item):
+                self.errors.append(_unregistered_ext(item))
+                return []
+            return self.do.get_ext_utis(item)
+        if "mime" == scope:
+            utis = self.do.mime_to_utis(item)
+            if not utis:
+                self.errors.append(f"No UTI are registered for MIME type '{item}'.")
+            return utis
+        if "conforms" == scope:
+            return self.do.conforming_utis(item)
+        return [item]
+
+    def _catalog_utis(self, scope, item, dynamic=False):
+        """
+        Same as ``_scope_utis``, but only consults the catalog.
+        """
+        catalog = self.catalog
+        if "ext" == scope:
+            utis = catalog.ext_utis(item)
+            if not utis and not dynamic:
+                self.errors.append(_unregistered_ext(item))
+            return utis
+        if "mime" == scope:
+            utis = catalog.mime_utis(item)
+            if not utis:
+                self.errors.append(f"No UTI are registered for MIME type '{item}'.")
+            return utis
+        if "conforms" == scope:
+            return catalog.conforming(item)
+        return [item]
+
+    def _compile(self, definitions, dynamic=False):
+        """
+        Resolves a configuration to the handler path of every UTI and
+        URL scheme it manages. Later definitions take precedence.
+        """
+        return self._compile_claims(self._iter_claims(definitions, dynamic))
+
+    def _compile_claims(self, claims):
+        plan = {"utis": {}, "schemes": {}}
+        missing = set()
+        self.sources = {}
+        for kind, target, claim in claims:
+            if "ext" == claim.scope and "uti" == kind:
+                self.sources[target] = claim.item
+            else:
+                self.sources.pop(target, None)
+            path = None
+            if claim.handler not in missing:
+                try:
+                    path = self._lookup_handler(claim.handler)
+                except ApplicationNotFound as err:
+                    self.errors.append(str(err))
+                    missing.add(claim.handler)
+            if path is None:
+                # The claim that takes effect cannot be applied,
+                # so earlier ones must not be applied in its place.
+                plan[f"{kind}s"].pop(target, None)
+            else:
+                plan[f"{kind}s"][target] = path
+        return plan
+
+    def _select(self, definitions, dynamic=False, targets=(), apps=()):
+        """
+        Compiles the part of a configuration that manages ``targets``
+        and assigns them to one of ``apps``, if given. Selects from an index
+        of the entries that take effect, so only the selected targets are
+        compiled, read and written. Entries that cannot claim a selected
+        target are not resolved, and errors of entries outside the
+        selection are not reported.
+        """
+        entries = list(self._iter_entries(definitions))
+        wanted = None
+        if targets:
+            by_target = self._resolve_targets(targets, entries)
+            wanted = set().union(*by_target.values())
+            entries = [entry for entry in entries if self._may_claim(entry, wanted)]
+        index, resolved = self._index_claims(entries, dynamic)
+        selected = index.keys()
+        if targets:
+            selected = set()
+            for target, keys in by_target.items():
+                keys = [key for key in keys if key in index]
+                if not keys:
+                    log.warning("`%s` is not managed by the configuration.", target)
+                selected.update(keys)
+        handlers = None
+        if apps:
+            handlers = self._matching_handlers(
+                {entry[-1] for entry, _, _ in resolved}, apps
             )
-        return file
+            selected = {key for key in selected if index[key].handler in handlers}
+        if not selected:
+            log.warning("No entries of the configuration match the selection.")
+        self.errors.extend(
+            error
+            for entry, keys, errors in resolved
+            if self._selects(entry, keys, selected, wanted, handlers)
+            for error in errors
+        )
+        return self._compile_claims(
+            (*key, claim) for key, claim in index.items() if key in selected
+        )
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def _selects(self, entry, keys, selected, wanted, handlers):
+        """
+        Whether an entry that claims ``keys`` is part of the selection.
+        Entries that claim nothing, e.g. unregistered file extensions,
+        are selected when they stand for a ``wanted`` target and refer
+        to one of the selected ``handlers``.
+        """
+        if keys:
+            return not selected.isdisjoint(keys)
+        _, scope, item, handler = entry
+        if handlers is not None and handler not in handlers:
+            return False
+        if wanted is None:
+            return True
+        if "ext" != scope or is_pattern(item):
+            return False
+        return any(("uti", uti) in wanted for uti in self.do.get_ext_utis(item))
+
+    def _resolve_targets(self, targets, entries):
+        """
+        Returns the ``(kind, target)`` keys each of ``targets`` refers to.
+        Unprefixed targets are looked up among the entries as written.
+        """
+        written = {
+            (scope, entry)
+            for _, scope, entry, _ in entries
+            if scope in ("scheme", "uti")
+        }
+        return {target: self._resolve_target(target, written) for target in targets}
+
+    def _may_claim(self, entry, keys):
+        """
+        Whether an entry can claim one of the selected ``(kind, target)`` keys.
+        Only file extensions can need to be looked up in LaunchServices,
+        the others are resolved without being filtered here.
+        """
+        _, scope, item, _ = entry
+        if "ext" != scope or is_pattern(item):
+            return True
+        utis = self.catalog.ext_utis(item)
+        if utis:
+            return any(("uti", uti) in keys for uti in utis)
+        return any(kind == "uti" and uti.startswith("dyn.") for kind, uti in keys)
+
+    def _index_claims(self, entries, dynamic=False):
+        """
+        Returns the claim that takes effect per ``(kind, target)`` and
+        ``(entry, keys, errors)`` for each entry, so errors can be reported
+        for the entries that were selected only.
+        """
+        index = {}
+        resolved = []
+        for entry in entries:
+            mark = len(self.errors)
+            keys = []
+            for kind, target, claim in self._resolve_claims([entry], dynamic):
+                index[kind, target] = claim
+                keys.append((kind, target))
+            resolved.append((entry, keys, self.errors[mark:]))
+            del self.errors[mark:]
+        return index, resolved
+
+    def _matching_handlers(self, handlers, apps):
+        """
+        Returns the handlers of the configuration that refer to one of
+        ``apps``. Each distinct handler is resolved once.
+        """
+        wanted = [self._lookup_handler(app) for app in apps]
+        matching = set()
+        for handler in handlers:
+            try:
+                path = self._lookup_handler(handler)
+            except ApplicationNotFound:
+                continue
+            if any(self.do.same_handler(path, app) for app in wanted):
+                matching.add(handler)
+        return matching
+
+    def _find_config(self, file=None):
+        with trace.span("find config"):
+            if file is None:
+                xch = xdg_config_home()
+
+                for path in (
+                    xch / "dooti.yaml",
+                    xch / "dooti.yml",
+                    xch / "dooti" / "dooti.yaml",
+                    xch / "dooti" / "dooti.yml",
+                    xch / "dooti" / "config.yaml",
+                    xch / "dooti" / "config.yml",
+                ):
+                    if path.exists():
+                        return path
+                raise ValueError(f"Could not find dooti configuration in `{xch}`.")
+            if not Path(file).exists():
+                raise ValueError(
+                    f"Passed dooti configuration file `{file}` does not exist."
+                )
+            return file
 
     def _load_config(self, file):
-        with open(file, encoding="utf-8") as f:
+        with trace.span("parse config"), open(file, encoding="utf-8") as f:
             definitions = yaml.load(f, Loader=yaml.Loader)
 
         if not isinstance(definitions, dict):
@@ -241,7 +1046,7 @@ class DootiCLI:
         return definitions
 
     def _ask_consent(self, diffs):
-        for atype, diff in diffs.items():
+        for atype, diff in diffs.to_dict().items():
             if not diff:
                 continue
             print(
@@ -258,10 +1063,83 @@ class DootiCLI:
             return False
 
 
-def main():
+def _unregistered_ext(ext):
+    return (
+        f"No UTI are registered for file extension '{ext}'. "
+        "To force using a dynamic UTI, pass `-u`/`--dynamic`."
+    )
+
+
+def _duration(value):
     """
-    Prepare CLI args parser and hand off to DootiCLI
+    Parses durations like ``90``, ``30s``, ``15m``, ``2h`` or ``1d`` to seconds.
     """
+    units = {"s": 1, "m": 60, "h": 60 * 60, "d": 24 * 60 * 60}
+    number, unit = (value[:-1], value[-1]) if value[-1:] in units else (value, "s")
+    try:
+        seconds = float(number) * units[unit]
+    except ValueError:
+        seconds = -1
+    if not 0 <= seconds < float("inf"):
+        raise argparse.ArgumentTypeError(f"invalid duration: '{value}'")
+    return seconds
+
+
+def _log_write_stats(stats):
+    if stats is None or not stats.submitted:
+        return
+    log.info(
+        "Dispatched %d writes (%d superseded), at most %d queued and %d in flight. "
+        "Waited %.0f ms on average, %.0f ms at most.",
+        stats.dispatched,
+        stats.coalesced,
+        stats.max_depth,
+        stats.max_in_flight,
+        stats.mean_wait * 1000,
+        stats.max_wait * 1000,
+    )
+
+
+def _hash_config(file, dynamic, catalog_fingerprint=None):
+    digest = hashlib.sha256()
+    with open(file, "rb") as f:
+        while block := f.read(1 << 16):
+            digest.update(block)
+    digest.update(b"dynamic" if dynamic else b"")
+    if catalog_fingerprint:
+        digest.update(catalog_fingerprint.encode())
+    return digest.hexdigest()
+
+
+def _fingerprint(handlers):
+    """
+    Cheap markers of the state a run depends on: the resolved handlers,
+    the LaunchServices preferences and the application directories.
+    """
+    return {
+        "handlers": {
+            name: [path, _mtime(Path(path) / "Contents" / "Info.plist")]
+            for name, path in handlers.items()
+        },
+        "launchservices": _mtime(launchservices_prefs()),
+        "apps": [_mtime(directory) for directory in APP_DIRS],
+    }
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime_ns
+    except OSError:
+        return None
+
+
+def _chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(itertools.islice(iterator, size)):
+        yield chunk
+
+
+def _parser():  # pylint: disable=too-many-statements,too-many-locals
     parser = argparse.ArgumentParser(
         prog="dooti", description="Manage default handlers on macOS."
     )
@@ -279,6 +1157,25 @@ def main():
         dest="assume_yes",
         action="store_true",
     )
+    parser.add_argument(
+        "--trace",
+        metavar="FILE",
+        help="Record a timeline of the run in Chrome trace event format.",
+    )
+    parser.add_argument(
+        "--write-rate",
+        type=float,
+        metavar="N",
+        help="Set at most N default handlers per second. Unlimited by default.",
+    )
+    parser.add_argument(
+        "--max-in-flight",
+        type=int,
+        default=MAX_IN_FLIGHT,
+        metavar="N",
+        help="Changes awaiting confirmation by LaunchServices at a time "
+        f"(default {MAX_IN_FLIGHT}).",
+    )
     parser.add_argument(
         "-t",
         "--dry-run",
@@ -303,6 +1200,45 @@ def main():
         "--file",
         help="Configuration to apply. If unspecified, searches in $XDG_CONFIG_HOME.",
     )
+    apply_parser.add_argument(
+        "-s",
+        "--stream",
+        action="store_true",
+        help="Read, plan and apply the configuration in chunks. "
+        "Implied for JSON Lines files (.jsonl, .ndjson).",
+    )
+    apply_parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=STREAM_CHUNK_SIZE,
+        help=f"Definitions per chunk when streaming (default {STREAM_CHUNK_SIZE}).",
+    )
+    apply_parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Check every definition even if nothing changed since the last run.",
+    )
+    apply_parser.add_argument(
+        "--verify-interval",
+        type=float,
+        default=VERIFY_INTERVAL,
+        metavar="SECONDS",
+        help="Check every definition if the last full run is older than this "
+        f"(default {VERIFY_INTERVAL}).",
+    )
+    apply_parser.add_argument(
+        "--only",
+        action="append",
+        metavar="TARGETS",
+        help="Only apply the entries for these comma-separated file extensions, "
+        "UTI or schemes. Prefix with ext:, mime:, uti: or scheme: to disambiguate.",
+    )
+    apply_parser.add_argument(
+        "--app",
+        action="append",
+        help="Only apply the entries that take effect for this handler. "
+        "Can be passed multiple times.",
+    )
     apply_parser.set_defaults(func="apply_")
 
     ext_parser = subparsers.add_parser(
@@ -343,21 +1279,193 @@ def main():
         "--handler",
         help="The handler to associate with the UTI(s). If unset, returns the default handler(s).",
     )
+    uti_parser.add_argument(
+        "-c",
+        "--conforming",
+        action="store_true",
+        help="Include all installed UTI that conform to the specified UTI(s).",
+    )
     uti_parser.set_defaults(func="uti")
 
+    mime_parser = subparsers.add_parser(
+        "mime", help="Manage default handler for all UTI associated with MIME type(s)"
+    )
+    mime_parser.add_argument("mimes", nargs="+", help="MIME type(s) to operate on")
+    mime_parser.add_argument(
+        "-x",
+        "--handler",
+        help="The handler to associate with the MIME type(s). If unset, returns the default handler(s).",
+    )
+    mime_parser.set_defaults(func="mime")
+
+    snapshot_parser = subparsers.add_parser(
+        "snapshot",
+        help="Export the default handlers of all known targets as a YAML configuration",
+    )
+    snapshot_parser.add_argument("file", help="File to write the snapshot to")
+    snapshot_parser.set_defaults(func="snapshot")
+
+    profile_parser = subparsers.add_parser(
+        "profile",
+        help="Switch between named configurations in $XDG_CONFIG_HOME/dooti/profiles",
+    )
+    profile_subparsers = profile_parser.add_subparsers(dest="action", required=True)
+    profile_subparsers.add_parser("list", help="List available profiles")
+    profile_use_parser = profile_subparsers.add_parser(
+        "use", help="Switch to a profile"
+    )
+    profile_use_parser.add_argument("name", help="Name of the profile")
+    profile_use_parser.add_argument(
+        "-u",
+        "--dynamic",
+        action="store_true",
+        help="Allow unregistered file extensions / dynamic UTIs.",
+    )
+    profile_parser.set_defaults(func="profile")
+
+    explain_parser = subparsers.add_parser(
+        "explain",
+        help="Show which configuration entries claim the target(s) and which one wins",
+    )
+    explain_parser.add_argument(
+        "targets",
+        nargs="+",
+        help="File extension(s), UTI or scheme(s). "
+        "Prefix with ext:, mime:, uti: or scheme: to disambiguate.",
+    )
+    explain_parser.add_argument(
+        "-i",
+        "--file",
+        help="Configuration to inspect. If unspecified, searches in $XDG_CONFIG_HOME.",
+    )
+    explain_parser.add_argument(
+        "-u",
+        "--dynamic",
+        action="store_true",
+        help="Allow unregistered file extensions / dynamic UTIs.",
+    )
+    explain_parser.set_defaults(func="explain")
+
+    candidates_parser = subparsers.add_parser(
+        "candidates",
+        help="List the applications that can open the target(s), the default first",
+    )
+    candidates_parser.add_argument(
+        "targets",
+        nargs="+",
+        help="File extension(s), UTI or scheme(s). "
+        "Prefix with ext:, mime:, uti: or scheme: to disambiguate.",
+    )
+    candidates_parser.set_defaults(func="candidates")
+
+    diff_parser = subparsers.add_parser(
+        "diff",
+        help="Show the targets whose handlers differ between two configurations",
+    )
+    diff_parser.add_argument("old", help="Configuration to compare against.")
+    diff_parser.add_argument("new", help="Configuration to compare.")
+    diff_parser.add_argument(
+        "-u",
+        "--dynamic",
+        action="store_true",
+        help="Allow unregistered file extensions / dynamic UTIs.",
+    )
+    diff_parser.add_argument(
+        "--catalog",
+        help="UTI catalog to resolve entries with, e.g. the cached one "
+        "of another machine. Defaults to the local one.",
+    )
+    diff_parser.set_defaults(func="diff")
+
+    watch_parser = subparsers.add_parser(
+        "watch",
+        help="Restore the configured handlers whenever they are changed",
+    )
+    watch_parser.add_argument(
+        "-i",
+        "--file",
+        help="Configuration to enforce. If unspecified, searches in $XDG_CONFIG_HOME.",
+    )
+    watch_parser.add_argument(
+        "-u",
+        "--dynamic",
+        action="store_true",
+        help="Allow unregistered file extensions / dynamic UTIs.",
+    )
+    watch_parser.set_defaults(func="watch")
+
+    enforce_parser = subparsers.add_parser(
+        "enforce",
+        help="Check and restore the configured handlers periodically",
+    )
+    enforce_parser.add_argument(
+        "-i",
+        "--file",
+        help="Configuration to enforce. If unspecified, searches in $XDG_CONFIG_HOME.",
+    )
+    enforce_parser.add_argument(
+        "-u",
+        "--dynamic",
+        action="store_true",
+        help="Allow unregistered file extensions / dynamic UTIs.",
+    )
+    enforce_parser.add_argument(
+        "--interval",
+        type=_duration,
+        default=ENFORCE_INTERVAL,
+        metavar="DURATION",
+        help="Time between checks, e.g. 90s, 15m or 1h (default 15m).",
+    )
+    enforce_parser.add_argument(
+        "--jitter",
+        type=_duration,
+        default=0,
+        metavar="DURATION",
+        help="Delay the checks by up to this, stable per host (default 0).",
+    )
+    enforce_parser.set_defaults(func="enforce")
+
+    completion_parser = subparsers.add_parser(
+        "completion", help="Print the shell completion script"
+    )
+    completion_parser.add_argument("shell", choices=SHELLS)
+    completion_parser.set_defaults(func="completion")
+
+    return parser
+
+
+def main():
+    """
+    Prepare CLI args parser and hand off to DootiCLI
+    """
+    parser = _parser()
     args = parser.parse_args()
     if len(sys.argv[1:]) == 0:
         parser.print_help()
         parser.exit()
     args = parser.parse_args()
-    cli = DootiCLI(assume_yes=args.assume_yes, dry_run=args.dry_run, fmt=args.fmt)
+    if "completion" == args.func:
+        print(script(args.shell), end="")
+        parser.exit()
+    trace_file = args.trace
     func = args.func
     del args.func
-    del args.assume_yes
-    del args.dry_run
-    del args.fmt
+    del args.trace
+    with trace.recording(trace_file):
+        cli = DootiCLI(
+            assume_yes=args.assume_yes,
+            dry_run=args.dry_run,
+            fmt=args.fmt,
+            write_rate=args.write_rate,
+            max_in_flight=args.max_in_flight,
+        )
+        del args.assume_yes
+        del args.dry_run
+        del args.fmt
+        del args.write_rate
+        del args.max_in_flight
 
-    cli.run(func, args)
+        cli.run(func, args)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,282 @@
+"""
+Shell completion for the dooti command line.
+
+The completer runs on every key press, so it only reads the on-disk
+catalog cache and must not import the ObjC bridge or other modules
+that are slow to import (including ``xdg`` and ``dooti.catalog``).
+"""
+
+import json
+import os
+import sys
+
+SHELLS = ("bash", "zsh", "fish")
+
+GLOBAL_OPTIONS = (
+    "-h",
+    "--help",
+    "-f",
+    "--format",
+    "-y",
+    "--yes",
+    "--trace",
+    "--write-rate",
+    "--max-in-flight",
+    "-t",
+    "--dry-run",
+)
+
+COMMANDS = {
+    "apply": (
+        "-u",
+        "--dynamic",
+        "-i",
+        "--file",
+        "-s",
+        "--stream",
+        "--chunk-size",
+        "--force",
+        "--verify-interval",
+        "--only",
+        "--app",
+    ),
+    "ext": ("-u", "--dynamic", "-x", "--handler"),
+    "scheme": ("-x", "--handler"),
+    "uti": ("-x", "--handler", "-c", "--conforming"),
+    "mime": ("-x", "--handler"),
+    "snapshot": (),
+    "profile": ("-u", "--dynamic"),
+    "explain": ("-i", "--file", "-u", "--dynamic"),
+    "candidates": (),
+    "diff": ("-u", "--dynamic", "--catalog"),
+    "watch": ("-i", "--file", "-u", "--dynamic"),
+    "enforce": ("-i", "--file", "-u", "--dynamic", "--interval", "--jitter"),
+    "completion": (),
+}
+"""
+Subcommands and their options. Keep in sync with ``cli._parser``.
+"""
+
+TAKES_VALUE = frozenset(
+    (
+        "-f",
+        "--format",
+        "--trace",
+        "--write-rate",
+        "--max-in-flight",
+        "-x",
+        "--handler",
+        "-i",
+        "--file",
+        "--chunk-size",
+        "--verify-interval",
+        "--catalog",
+        "--interval",
+        "--jitter",
+        "--only",
+        "--app",
+    )
+)
+
+TARGETS = {"ext": "extensions", "scheme": "schemes", "uti": "utis", "mime": "mimes"}
+
+APP_DIRS = (
+    "/Applications",
+    "/Applications/Utilities",
+    "/System/Applications",
+    "/System/Applications/Utilities",
+    "/System/Library/CoreServices",
+    "~/Applications",
+)
+"""
+Same as ``catalog.APP_DIRS``, without importing ``pathlib``.
+"""
+
+SCRIPTS = {
+    "bash": """\
+_dooti() {
+    local IFS=$'\\n' word
+    COMPREPLY=()
+    for word in $(_dooti_complete "${COMP_WORDS[@]:1:COMP_CWORD}"); do
+        COMPREPLY+=("$(printf '%q' "$word")")
+    done
+}
+complete -o default -F _dooti dooti
+""",
+    "zsh": """\
+#compdef dooti
+_dooti() {
+    local -a candidates
+    candidates=(${(f)"$(_dooti_complete "${(@)words[2,CURRENT]}")"})
+    if (( $#candidates )); then
+        compadd -a candidates
+    else
+        _files
+    fi
+}
+compdef _dooti dooti
+""",
+    "fish": """\
+function __dooti_complete
+    set -l tokens (commandline -opc)
+    set -e tokens[1]
+    set -l current (commandline -ct)
+    set -l candidates (_dooti_complete $tokens "$current")
+    if set -q candidates[1]
+        printf '%s\\n' $candidates
+    else
+        __fish_complete_path "$current"
+    end
+end
+complete -c dooti -f -a '(__dooti_complete)'
+""",
+}
+
+
+def script(shell: str) -> str:
+    """
+    Returns the completion script for a shell.
+
+    :param str shell: one of ``bash``, ``zsh`` or ``fish``
+    """
+    return SCRIPTS[shell]
+
+
+def complete(words: list[str], cache_file=None, config_dir=None) -> list[str]:
+    """
+    Returns the completion candidates for a command line.
+
+    :param list words: words following the program name. The last one
+                       is the (possibly empty) word being completed.
+    :param str cache_file: path to the catalog cache
+    :param str config_dir: path to the dooti configuration directory
+    """
+    *done, current = words or [""]
+    command, positional, option = _parse(done)
+
+    if option is not None:
+        candidates = _option_values(option)
+    elif current.startswith("-"):
+        candidates = GLOBAL_OPTIONS if command is None else COMMANDS.get(command, ())
+    elif command is None:
+        candidates = COMMANDS
+    elif command in TARGETS:
+        candidates = _catalog_targets(TARGETS[command], cache_file)
+    elif command in ("explain", "candidates"):
+        candidates = [
+            target
+            for kind in ("extensions", "schemes", "utis")
+            for target in _catalog_targets(kind, cache_file)
+        ]
+    elif "profile" == command:
+        candidates = ()
+        if not positional:
+            candidates = ("list", "use")
+        elif ["use"] == positional:
+            candidates = _profiles(config_dir)
+    elif "completion" == command and not positional:
+        candidates = SHELLS
+    else:
+        candidates = ()
+    return sorted(item for item in candidates if item.startswith(current))
+
+
+def _parse(words):
+    """
+    Returns the subcommand, its positional arguments and the option
+    that awaits a value, if any.
+    """
+    command = None
+    positional = []
+    option = None
+    for word in words:
+        if option is not None:
+            option = None
+        elif word in TAKES_VALUE:
+            option = word
+        elif word.startswith("-"):
+            continue
+        elif command is None:
+            command = word
+        else:
+            positional.append(word)
+    return command, positional, option
+
+
+def _option_values(option):
+    if option in ("-f", "--format"):
+        return ("json", "yaml")
+    if option in ("-x", "--handler", "--app"):
+        return _apps()
+    return ()
+
+
+def _catalog_targets(kind, cache_file=None):
+    if cache_file is None:
+        cache_file = os.path.join(_xdg_dir("XDG_CACHE_HOME", ".cache"), "catalog.json")
+    try:
+        with open(cache_file, encoding="utf-8") as f:
+            data = json.load(f)
+        if "utis" == kind:
+            return data["utis"]
+        if "mimes" == kind:
+            return {mime for rec in data["utis"].values() for mime in rec[2]}
+        return data[kind]
+    except (OSError, ValueError, KeyError, TypeError, IndexError):
+        return ()
+
+
+def _apps(app_dirs=APP_DIRS, depth=1):
+    apps = set()
+    for directory in app_dirs:
+        try:
+            with os.scandir(os.path.expanduser(directory)) as entries:
+                for entry in entries:
+                    if entry.name.endswith(".app"):
+                        apps.add(entry.name[:-4])
+                    elif depth and entry.is_dir():
+                        apps.update(_apps((entry.path,), depth - 1))
+        except OSError:
+            continue
+    return apps
+
+
+def _profiles(config_dir=None):
+    if config_dir is None:
+        config_dir = _xdg_dir("XDG_CONFIG_HOME", ".config")
+    try:
+        names = os.listdir(os.path.join(config_dir, "profiles"))
+    except OSError:
+        return ()
+    return {
+        os.path.splitext(name)[0] for name in names if name.endswith((".yaml", ".yml"))
+    }
+
+
+def _xdg_dir(variable, default):
+    """
+    Returns the dooti directory inside an XDG base directory,
+    following the same rules as the ``xdg`` package.
+    """
+    base = os.environ.get(variable, "")
+    if not os.path.isabs(base):
+        base = os.path.join(os.path.expanduser("~"), default)
+    return os.path.join(base, "dooti")
+
+
+def main():
+    """
+    Print the completion candidates for the words passed as arguments.
+    """
+    try:
+        candidates = complete(sys.argv[1:])
+    except Exception:  # pylint: disable=broad-except
+        # Never disturb the shell with a traceback.
+        return 0
+    if candidates:
+        print("\n".join(candidates))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,12 +1,52 @@
-import os.path
+# pylint: disable=too-many-lines
+from __future__ import annotations
 
-import objc
-from AppKit import NSWorkspace  # pylint: disable=no-name-in-module
-from Foundation import NSURL, NSArray  # pylint: disable=no-name-in-module
-from UniformTypeIdentifiers import (  # pylint: disable=no-name-in-module
-    UTTagClassFilenameExtension,
-    UTType,
-)
+import contextlib
+import os.path
+import plistlib
+import threading
+import time
+from collections import Counter, OrderedDict
+from collections.abc import Callable, Iterator
+from typing import NamedTuple
+
+from . import trace
+from .catalog import Catalog, handler_rank, read_info
+
+# The ObjC bridge is loaded by the first Dooti instance, see _load_bridge
+# pylint: disable-next=invalid-name
+objc = NSWorkspace = NSURL = NSArray = UTTagClassFilenameExtension = UTType = None
+
+# Active call counters, see Dooti.count_calls
+_TALLIES = []
+
+MAX_IN_FLIGHT = 16
+"""
+Default number of writes ``Dooti.set_defaults`` keeps in flight.
+"""
+
+WRITE_TIMEOUT = 30
+"""
+Seconds to wait for LaunchServices to confirm a write.
+"""
+
+HANDLER_TTL = 60
+"""
+Seconds ``Dooti`` serves a default handler it read or set from memory
+before asking LaunchServices again.
+"""
+
+CACHE_SIZE = 10_000
+"""
+Number of default handlers and file extensions ``Dooti`` keeps in memory
+at most. The ones read or set longest ago are dropped first.
+"""
+
+PROMPTING_SCHEMES = frozenset(("http", "https"))
+"""
+URL schemes whose handler can only be changed after the user confirmed a prompt.
+Writes for them are dispatched first, so the prompt does not wait for bulk writes.
+"""
 
 
 class ExtHasNoRegisteredUTI(ValueError):
@@ -28,16 +68,144 @@ class BundleURLNotFound(ApplicationNotFound):
     """
 
 
-class Dooti:
+class HandlerNotSet(ValueError):
+    """
+    Returned by ``Dooti.set_defaults`` when LaunchServices did not
+    confirm setting a default handler.
+    """
+
+
+class HandlerIdentity(NamedTuple):
+    """
+    Canonical identity of a handler application.
+    """
+
+    bundle_id: str | None
+    """
+    Bundle ID, lowercased. ``None`` if the bundle does not declare one.
+    """
+
+    path: str
+    """
+    Absolute path with all symlinks resolved.
+    """
+
+    def matches(self, other: "HandlerIdentity") -> bool:
+        """
+        Checks whether two identities refer to the same application.
+        LaunchServices records handlers by bundle ID, so copies of an app
+        in different locations are considered the same.
+
+        :param HandlerIdentity other: identity to compare with
+        """
+        if self.bundle_id and other.bundle_id:
+            return self.bundle_id == other.bundle_id
+        return self.path == other.path
+
+
+class Dooti:  # pylint: disable=too-many-public-methods,too-many-instance-attributes
     """
     Wrapper for macOS system API to manage default handlers on macOS 12.0+.
     """
 
-    def __init__(self, workspace=None):
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def __init__(
+        self,
+        workspace=None,
+        catalog=None,
+        write_rate: float | None = None,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        handler_ttl: float | None = HANDLER_TTL,
+        clock: Callable[[], float] = time.monotonic,
+        cache_size: int = CACHE_SIZE,
+    ):
+        _load_bridge()
         if workspace is None:
             workspace = NSWorkspace.sharedWorkspace()
 
         self.workspace = workspace
+        self._catalog = catalog
+        self._ext_cache = _BoundedCache(cache_size)
+        self._identities = {}
+        self._candidates = {}
+        self._infos = {}
+        self.write_rate = write_rate
+        self.max_in_flight = max_in_flight
+        self.write_stats = None
+        self._bucket = None
+        self.handler_ttl = handler_ttl
+        self.clock = clock
+        self._handlers = _BoundedCache(cache_size)
+
+    @property
+    def catalog(self) -> Catalog:
+        """
+        Index of the file extensions, UTI and URL schemes declared by
+        installed bundles. Loaded from the cache on first access.
+        """
+        if self._catalog is None:
+            with trace.span("load catalog"):
+                self._catalog = Catalog.load()
+        return self._catalog
+
+    @catalog.setter
+    def catalog(self, catalog: Catalog) -> None:
+        self._catalog = catalog
+
+    def refresh(self) -> None:
+        """
+        Drops the catalog and cached lookups, e.g. after applications
+        were installed or removed.
+        """
+        self._catalog = None
+        self._ext_cache.clear()
+        self._identities.clear()
+        self._candidates.clear()
+        self._infos.clear()
+        self._handlers.clear()
+
+    def refresh_handlers(self, targets: list[str] | None = None) -> None:
+        """
+        Drops cached default handlers, so they are read from LaunchServices
+        again, e.g. after another process might have changed them.
+
+        Targets are specified like the keys of ``set_defaults``.
+
+        :param list targets: UTI, URL schemes or file extensions to drop,
+                             defaults to all of them
+        """
+        if targets is None:
+            self._handlers.clear()
+            return
+        for key in targets:
+            scope, target = _split_target(key)
+            if "ext" == scope:
+                for uti in self.get_ext_utis(target):
+                    self._handlers.pop(("uti", uti), None)
+            else:
+                self._handlers.pop((scope, target), None)
+
+    @staticmethod
+    @contextlib.contextmanager
+    def count_calls() -> Iterator[Counter]:
+        """
+        Context manager that counts the calls into the ObjC bridge made by
+        all Dooti instances while it is active. Yields a ``Counter`` that maps
+        the called selectors, e.g. ``URLForApplicationToOpenContentType_``,
+        to the number of calls. Can be nested.
+
+        .. code-block:: python
+
+            with Dooti.count_calls() as tally:
+                d.get_default_ext("csv")
+            assert tally["URLForApplicationToOpenContentType_"] == 1
+        """
+        tally = Counter()
+        _TALLIES.append(tally)
+        try:
+            yield tally
+        finally:
+            _TALLIES.remove(tally)
 
     @staticmethod
     def ext_to_utis(ext: str) -> NSArray:
@@ -48,25 +216,46 @@ class Dooti:
 
         :param str ext: file extension to look up associated UTI for
         """
-        return UTType.typesWithTag_tagClass_conformingToType_(
-            ext, UTTagClassFilenameExtension, objc.nil
+        return _call(
+            UTType,
+            "typesWithTag_tagClass_conformingToType_",
+            ext,
+            UTTagClassFilenameExtension,
+            objc.nil,
         )
 
-    def set_default_uti(self, uti: str | UTType, app: str) -> None:
+    def set_default_uti(
+        self, uti: str | UTType, app: str, conforming: bool = False
+    ) -> None:
         """
         Sets a default handler for a specific UTI.
 
         :param str | UTType uti: UTI to set the default handler for
         :param str app: absolute filesystem path, name or bundle ID of the handler
+        :param bool conforming: also set the handler for all installed UTI
+                                conforming to ``uti`` (default False)
         """
-        if not isinstance(uti, UTType):
-            uti = UTType.importedTypeWithIdentifier_(uti)
+        if not isinstance(uti, str):
+            uti = _call(uti, "identifier")
 
-        path = self.get_app_path(app)
+        if conforming:
+            utis = self.conforming_utis(uti)
+        else:
+            utis = [uti]
 
-        self.workspace.setDefaultApplicationAtURL_toOpenContentType_completionHandler_(
-            path, uti, objc.nil
-        )
+        self._set_all({f"uti:{single}": app for single in utis})
+
+    def conforming_utis(self, uti: str | UTType) -> list[str]:
+        """
+        Returns all installed UTI that conform to the specified UTI,
+        including the UTI itself. The lookup is served from the conformance
+        index of the catalog.
+
+        :param str | UTType uti: UTI to look up conforming types for
+        """
+        if not isinstance(uti, str):
+            uti = _call(uti, "identifier")
+        return self.catalog.conforming(uti)
 
     def set_default_scheme(self, scheme: str, app: str) -> None:
         """
@@ -76,11 +265,81 @@ class Dooti:
         :param str app: absolute filesystem path, name or bundle ID of the handler
         """
 
-        path = self.get_app_path(app)
+        self._set_all({f"scheme:{scheme}": app})
+
+    def set_defaults(
+        self,
+        handlers: dict[str, str],
+        allow_dynamic: bool = False,
+        max_in_flight: int | None = None,
+        rate: float | None = None,
+    ) -> dict[str, ValueError | None]:
+        """
+        Sets default handlers for many UTI, URL schemes and file extensions.
+        Each handler is resolved once. Writes are scheduled by a
+        ``WriteScheduler``: at most ``rate`` of them are dispatched per second
+        and up to ``max_in_flight`` of them await confirmation by LaunchServices.
+        Writes for URL schemes that prompt the user are dispatched first.
+        When several keys resolve to the same UTI, the last one wins.
+        Statistics of the writes are available as ``write_stats`` afterwards.
+
+        Keys can be prefixed with ``uti:``, ``scheme:`` or ``ext:``. Keys
+        without a prefix are treated as UTI if they contain a dot and as
+        URL scheme otherwise.
+
+        Returns a dict mapping each key to ``None`` on success or to the
+        error that prevented setting its handler.
 
-        self.workspace.setDefaultApplicationAtURL_toOpenURLsWithScheme_completionHandler_(
-            path, scheme, objc.nil
+        .. code-block:: python
+
+            d.set_defaults({"scheme:http": "Firefox", "ext:csv": "Numbers"})
+
+        :param dict handlers: maps targets to the absolute filesystem path,
+                              name or bundle ID of their handler
+        :param bool allow_dynamic: whether to allow dynamic UTIs (default False)
+        :param int max_in_flight: maximum number of unconfirmed writes,
+                                  defaults to ``self.max_in_flight``
+        :param float rate: maximum number of writes per second,
+                           defaults to ``self.write_rate`` (unlimited)
+        """
+        paths = {}
+        for app in dict.fromkeys(handlers.values()):
+            try:
+                with trace.span("resolve handler", handler=app):
+                    paths[app] = self.get_app_path(app)
+            except ApplicationNotFound as err:
+                paths[app] = err
+
+        writes = WriteScheduler(
+            max_in_flight=max_in_flight or self.max_in_flight,
+            bucket=self._write_bucket(rate or self.write_rate),
+            on_confirm=self._confirmed,
         )
+        for key, app in handlers.items():
+            if isinstance(paths[app], ApplicationNotFound):
+                writes.results[key] = paths[app]
+            else:
+                self._submit_write(writes, key, paths[app], allow_dynamic)
+        results = writes.run()
+        self.write_stats = writes.stats
+        return results
+
+    def _write_bucket(self, rate):
+        """
+        Returns the token bucket that limits writes to ``rate`` per second.
+        It is kept between calls, so the limit holds across them. The burst
+        is capped to the writes of one second.
+        """
+        if rate is None:
+            return None
+        if self._bucket is None or self._bucket.rate != rate:
+            self._bucket = TokenBucket(rate, max(1, min(self.max_in_flight, int(rate))))
+        return self._bucket
+
+    def _set_all(self, handlers, allow_dynamic=False):
+        for error in self.set_defaults(handlers, allow_dynamic).values():
+            if error is not None:
+                raise error
 
     def set_default_ext(self, ext: str, app: str, allow_dynamic: bool = False) -> None:
         """
@@ -93,16 +352,15 @@ class Dooti:
         :raises:
             ExtHasNoRegisteredUTI if the file extension is unknown to MacOS and not allowing dynamic UTI
         """
-        utis = Dooti.ext_to_utis(ext)
+        utis = self._ext_utis(ext)
 
-        if self.is_dynamic_uti(utis[0]) and not allow_dynamic:
+        if _is_dynamic(utis[0]) and not allow_dynamic:
             raise ExtHasNoRegisteredUTI(
                 f"No UTI are registered for file extension '{ext}'. "
                 "To force using a dynamic UTI, pass allow_dynamic=True."
             )
 
-        for uti in utis:
-            self.set_default_uti(uti, app)
+        self._set_all({f"ext:{ext}": app}, allow_dynamic=True)
 
     def is_dynamic_uti(self, ext_or_uti: str | UTType) -> bool:
         """
@@ -112,26 +370,19 @@ class Dooti:
         :param str | UTType ext_or_uti: UTI or file extension to check
         """
         if isinstance(ext_or_uti, str):
-            ext_or_uti = Dooti.ext_to_utis(ext_or_uti)[0]
-        return str(ext_or_uti).startswith("dyn.")
+            ext_or_uti = self._ext_utis(ext_or_uti)[0]
+        return _is_dynamic(ext_or_uti)
 
     def get_default_uti(self, uti: str | UTType) -> str | None:
         """
         Returns the filesystem path to the default handler for the
-        specified UTI.
+        specified UTI. Served from memory if it was read or set less
+        than ``handler_ttl`` seconds ago.
 
         :param str | UTType uti: UTI to look up the default handler path for
         """
-
-        if not isinstance(uti, UTType):
-            uti = UTType.importedTypeWithIdentifier_(uti)
-
-        handler = self.workspace.URLForApplicationToOpenContentType_(uti)
-
-        if not handler:
-            return None
-
-        return handler.fileSystemRepresentation().decode()
+        identifier = uti if isinstance(uti, str) else _call(uti, "identifier")
+        return self._cached_handler("uti", identifier, self._read_uti_handler, uti)
 
     def get_default_ext(self, ext: str) -> str | None:
         """
@@ -140,17 +391,34 @@ class Dooti:
 
         :param str ext: filename extension to look up the default handler path for
         """
-        utis = Dooti.ext_to_utis(ext)
+        utis = self._ext_utis(ext)
 
         # assume the handler is the same for all types (sensible?)
         # even if the extension was not registered, utis will still contain
         # a dynamic UTI, so we do not need to check for an empty iterator
-        handler = self.workspace.URLForApplicationToOpenContentType_(utis[0])
+        return self.get_default_uti(utis[0])
 
-        if not handler:
-            return None
+    def mime_to_utis(self, mime: str) -> list[str]:
+        """
+        Returns all UTI registered for the specified MIME type,
+        as declared by installed bundles.
 
-        return handler.fileSystemRepresentation().decode()
+        :param str mime: MIME type to look up associated UTI for
+        """
+        return self.catalog.mime_utis(mime)
+
+    def get_ext_utis(self, ext: str) -> list[str]:
+        """
+        Returns all UTI registered for the specified file extension.
+        If none are registered, returns the dynamic UTI LaunchServices
+        assigns to it.
+
+        :param str ext: file extension to look up associated UTI for
+        """
+        return [
+            uti if isinstance(uti, str) else _call(uti, "identifier")
+            for uti in self._ext_utis(ext)
+        ]
 
     def get_default_scheme(self, scheme: str) -> str | None:
         """
@@ -162,14 +430,178 @@ class Dooti:
         if "file" == scheme:
             raise ValueError("The file:// scheme cannot be looked up.")
 
-        url = NSURL.URLWithString_(scheme + "://nonexistent")
+        return self._cached_handler("scheme", scheme, self._read_scheme_handler, scheme)
 
-        handler = self.workspace.URLForApplicationToOpenURL_(url)
+    def _cached_handler(self, kind, target, read, *args):
+        """
+        Serves the default handler of a target from memory, calling
+        ``read(*args)`` if it is unknown or older than ``handler_ttl``.
+        """
+        key = (kind, target)
+        entry = self._handlers.get(key)
+        if entry is not None and (
+            self.handler_ttl is None or self.clock() - entry[1] < self.handler_ttl
+        ):
+            return entry[0]
+        with trace.span("read", target=target):
+            handler = read(*args)
+        path = _call(handler, "fileSystemRepresentation").decode() if handler else None
+        self._handlers[key] = (path, self.clock())
+        return path
 
-        if not handler:
-            return None
+    def _read_uti_handler(self, uti):
+        return _call(
+            self.workspace, "URLForApplicationToOpenContentType_", _to_uttype(uti)
+        )
+
+    def _read_scheme_handler(self, scheme):
+        url = _call(NSURL, "URLWithString_", scheme + "://nonexistent")
+        return _call(self.workspace, "URLForApplicationToOpenURL_", url)
+
+    def _confirmed(self, keys, target, path):
+        """
+        Remembers the handler of a write LaunchServices confirmed.
+        """
+        # Keys of URL schemes never share writes with UTI.
+        kind = "scheme" if "scheme" == _split_target(keys[0])[0] else "uti"
+        self._handlers[kind, target] = (
+            _call(path, "fileSystemRepresentation").decode(),
+            self.clock(),
+        )
+
+    def get_candidates(self, targets: list[str]) -> dict[str, list[str]]:
+        """
+        Returns the filesystem paths of all applications that can open
+        the specified UTI or URL schemes. The current default handler comes
+        first, the others are ranked by the ``LSHandlerRank`` and role they
+        declare for the target. Results are cached per target.
+
+        Targets are specified like the keys of ``set_defaults``.
+
+        :param list targets: UTI or URL schemes to look up candidates for
+        """
+        candidates = {}
+        for key in targets:
+            target = _split_target(key)
+            if target not in self._candidates:
+                self._candidates[target] = self._rank_candidates(*target)
+            candidates[key] = self._candidates[target]
+        return candidates
+
+    def _rank_candidates(self, kind, target):
+        if "scheme" == kind:
+            default = self.get_default_scheme(target)
+            url = _call(NSURL, "URLWithString_", target + "://nonexistent")
+            urls = _call(self.workspace, "URLsForApplicationsToOpenURL_", url)
+        else:
+            default = self.get_default_uti(target)
+            urls = _call(
+                self.workspace,
+                "URLsForApplicationsToOpenContentType_",
+                _to_uttype(target),
+            )
+        paths = list(
+            dict.fromkeys(
+                _call(url, "fileSystemRepresentation").decode() for url in urls or ()
+            )
+        )
+
+        def rank(path):
+            if path not in self._infos:
+                self._infos[path] = read_info(path)
+            declared = handler_rank(self._infos[path], kind, target)
+            return (not self.same_handler(path, default), tuple(-x for x in declared))
+
+        # sorting is stable, so LaunchServices' order breaks ties
+        return sorted(paths, key=rank)
+
+    def _ext_utis(self, ext):
+        """
+        Serves the UTI of a file extension from the catalog. Extensions
+        unknown to it are looked up in LaunchServices once, which returns
+        a dynamic UTI if none is registered.
+        """
+        if ext not in self._ext_cache:
+            self._ext_cache[ext] = self.catalog.ext_utis(ext) or self.ext_to_utis(ext)
+        return self._ext_cache[ext]
+
+    def _submit_write(self, writes, key, path, allow_dynamic):
+        scope, target = _split_target(key)
+        if "scheme" == scope:
+            writes.submit(
+                key,
+                self._set_scheme_handler,
+                target,
+                path,
+                priority=0 if target.lower() in PROMPTING_SCHEMES else 1,
+            )
+            return
+        utis = self._ext_utis(target) if "ext" == scope else [target]
+        if "ext" == scope and _is_dynamic(utis[0]) and not allow_dynamic:
+            writes.results[key] = ExtHasNoRegisteredUTI(
+                f"No UTI are registered for file extension '{target}'."
+            )
+            return
+        for uti in utis:
+            writes.submit(
+                key,
+                self._set_uti_handler,
+                uti if isinstance(uti, str) else _call(uti, "identifier"),
+                path,
+            )
+
+    def _set_uti_handler(self, uti, path, completion=None):
+        _call(
+            self.workspace,
+            "setDefaultApplicationAtURL_toOpenContentType_completionHandler_",
+            path,
+            _to_uttype(uti),
+            completion or objc.nil,
+        )
 
-        return handler.fileSystemRepresentation().decode()
+    def _set_scheme_handler(self, scheme, path, completion=None):
+        _call(
+            self.workspace,
+            "setDefaultApplicationAtURL_toOpenURLsWithScheme_completionHandler_",
+            path,
+            scheme,
+            completion or objc.nil,
+        )
+
+    def get_app_identity(self, path: str) -> HandlerIdentity:
+        """
+        Returns the canonical identity of the application at a filesystem path.
+        Identities are computed once per path and cached.
+
+        :param str path: absolute filesystem path of the application
+        """
+        if path not in self._identities:
+            real_path = os.path.realpath(path)
+            try:
+                with open(os.path.join(real_path, "Contents", "Info.plist"), "rb") as f:
+                    bundle_id = plistlib.load(f).get("CFBundleIdentifier")
+            except (OSError, ValueError, AttributeError, plistlib.InvalidFileException):
+                bundle_id = None
+            if not isinstance(bundle_id, str):
+                bundle_id = None
+            self._identities[path] = HandlerIdentity(
+                bundle_id.lower() if bundle_id else None, real_path
+            )
+        return self._identities[path]
+
+    def same_handler(self, first: str | None, second: str | None) -> bool:
+        """
+        Checks whether two filesystem paths refer to the same application,
+        e.g. via symlinks or different installations of the same bundle.
+
+        :param str | None first: filesystem path of the first application
+        :param str | None second: filesystem path of the second application
+        """
+        if first is None or second is None:
+            return first is second
+        if first == second:
+            return True
+        return self.get_app_identity(first).matches(self.get_app_identity(second))
 
     def get_app_path(self, app: str) -> NSURL:
         """
@@ -182,7 +614,7 @@ class Dooti:
             ApplicationNotFound: when no matching application was found
         """
         if app[0] == "/":
-            return NSURL.fileURLWithPath_(app)
+            return _call(NSURL, "fileURLWithPath_", app)
 
         try:
             return self.bundle_to_url(app)
@@ -206,7 +638,9 @@ class Dooti:
         :raises:
             BundleURLNotFound: when no application with specified bundle ID was found
         """
-        path = self.workspace.URLForApplicationWithBundleIdentifier_(bundle_id)
+        path = _call(
+            self.workspace, "URLForApplicationWithBundleIdentifier_", bundle_id
+        )
 
         if path is None:
             raise BundleURLNotFound(
@@ -225,14 +659,14 @@ class Dooti:
         :raises:
             ApplicationNotFound: when no application with specified bundle ID was found
         """
-        path = self.workspace.fullPathForApplication_(app_name)
+        path = _call(self.workspace, "fullPathForApplication_", app_name)
 
         if path is None:
             raise ApplicationNotFound(
                 f"Could not find an application named '{app_name}'."
             )
 
-        return NSURL.fileURLWithPath_(path)
+        return _call(NSURL, "fileURLWithPath_", path)
 
     def path_to_url(self, path: str, skip_check: bool = False) -> NSURL:
         """
@@ -248,4 +682,365 @@ class Dooti:
         if not skip_check and not os.path.isdir(path):
             raise ApplicationNotFound(f"Could not find an application in '{path}'.")
 
-        return NSURL.fileURLWithPath_(path)
+        return _call(NSURL, "fileURLWithPath_", path)
+
+
+class WriteStats(NamedTuple):
+    """
+    Statistics of the writes of a ``WriteScheduler`` run.
+    """
+
+    submitted: int
+    """
+    Number of submitted writes.
+    """
+
+    dispatched: int
+    """
+    Number of writes that were dispatched to LaunchServices.
+    """
+
+    coalesced: int
+    """
+    Number of writes that were superseded by a later one to the same target.
+    """
+
+    max_depth: int
+    """
+    Largest number of writes waiting to be dispatched.
+    """
+
+    max_in_flight: int
+    """
+    Largest number of writes awaiting confirmation.
+    """
+
+    mean_wait: float
+    """
+    Average seconds from submitting to dispatching a write.
+    """
+
+    max_wait: float
+    """
+    Longest seconds from submitting to dispatching a write.
+    """
+
+
+class TokenBucket:  # pylint: disable=too-few-public-methods
+    """
+    Limits how many writes are dispatched per second. Shared by all writes
+    of a ``Dooti`` instance, so the limit holds across ``set_defaults`` calls.
+    """
+
+    def __init__(
+        self,
+        rate: float,
+        burst: int = 1,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        :param float rate: maximum number of writes per second
+        :param int burst: writes that can be dispatched at once before
+                          the rate applies
+        :param clock: monotonic clock in seconds
+        :param sleep: function to sleep for a number of seconds
+        """
+        self.rate = rate
+        self.burst = burst
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = float(burst)
+        self._refilled = None
+
+    def take(self) -> None:
+        """
+        Wait until the bucket allows another write.
+        """
+        while True:
+            now = self.clock()
+            if self._refilled is not None:
+                self._tokens = min(
+                    self.burst, self._tokens + (now - self._refilled) * self.rate
+                )
+            self._refilled = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+            with trace.span("wait for rate limit"):
+                self.sleep((1 - self._tokens) / self.rate)
+
+
+class _Write(NamedTuple):
+    keys: tuple[str, ...]
+    write: Callable
+    target: str
+    path: object
+    priority: int
+    submitted: float
+
+
+class WriteScheduler:  # pylint: disable=too-many-instance-attributes
+    """
+    Dispatches writes of default handlers with a completion handler.
+
+    Writes are queued with ``submit`` and dispatched by ``run``, lowest
+    priority first. A later write to the same target replaces a queued one.
+    A ``TokenBucket`` limits the dispatch rate, and at most ``max_in_flight``
+    writes await confirmation at a time, which protects ``lsd`` during bulk
+    writes.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        *,
+        max_in_flight: int = MAX_IN_FLIGHT,
+        rate: float | None = None,
+        burst: int | None = None,
+        bucket: TokenBucket | None = None,
+        timeout: float = WRITE_TIMEOUT,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+        on_confirm: Callable[[tuple, str, object], None] | None = None,
+    ):
+        """
+        :param int max_in_flight: maximum number of unconfirmed writes
+        :param float rate: maximum number of writes per second (unlimited if unset)
+        :param int burst: writes that can be dispatched at once before
+                          the rate applies, defaults to ``max_in_flight``
+        :param TokenBucket bucket: limits the dispatch rate instead of
+                                   ``rate`` and ``burst``, e.g. shared with
+                                   earlier schedulers
+        :param float timeout: seconds to wait for a confirmation
+        :param clock: monotonic clock in seconds
+        :param sleep: function to sleep for a number of seconds
+        :param on_confirm: called with the keys, target and path
+                           of every write LaunchServices confirmed
+        """
+        self.max_in_flight = max_in_flight
+        if bucket is None and rate is not None:
+            bucket = TokenBucket(rate, burst or max_in_flight, clock=clock, sleep=sleep)
+        self.bucket = bucket
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.on_confirm = on_confirm
+        self.results = {}
+        self._queue = {}
+        self._submitted = 0
+        self._coalesced = 0
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._max_in_flight = 0
+        self._unconfirmed = set()
+        self._waits = []
+        self._max_depth = 0
+
+    # pylint: disable-next=too-many-arguments,too-many-positional-arguments
+    def submit(self, key, write, target, path, priority=1):
+        """
+        Queue ``write(target, path, completion)``.
+
+        :param str key: key to report errors for in ``results``
+        :param write: function that dispatches the write
+        :param str target: UTI or URL scheme to set the handler for
+        :param path: URL of the handler
+        :param int priority: writes with lower values are dispatched first
+        """
+        self.results.setdefault(key, None)
+        self._submitted += 1
+        queued = self._queue.pop((write, target), None)
+        if queued is None:
+            keys = (key,)
+        else:
+            keys = (*queued.keys, key)
+            self._coalesced += 1
+        self._queue[write, target] = _Write(
+            keys, write, target, path, priority, self.clock()
+        )
+
+    def run(self) -> dict[str, ValueError | None]:
+        """
+        Dispatch all queued writes and wait for their confirmation.
+        Returns a dict mapping each key to ``None`` on success or to the
+        error that prevented setting its handler.
+        """
+        queue = sorted(self._queue.values(), key=lambda write: write.priority)
+        self._queue = {}
+        self._max_depth = max(self._max_depth, len(queue))
+        stalled = False
+        for num, write in enumerate(queue):
+            if not stalled:
+                if self.bucket is not None:
+                    self.bucket.take()
+                stalled = not self._acquire()
+            if stalled:
+                # LaunchServices stopped confirming writes, do not pile up more.
+                for key in write.keys:
+                    self.results[key] = HandlerNotSet(
+                        "Timed out waiting for LaunchServices to confirm earlier writes."
+                    )
+                continue
+            self._waits.append(self.clock() - write.submitted)
+            trace.counter("writes", queued=len(queue) - num - 1)
+            self._dispatch(write)
+        confirmed = False
+        if not stalled:
+            with trace.span("wait for confirmations"):
+                confirmed = self._wait()
+        if not confirmed:
+            self._time_out()
+        return self.results
+
+    @property
+    def stats(self) -> WriteStats:
+        """
+        Statistics of the writes dispatched so far.
+        """
+        return WriteStats(
+            submitted=self._submitted,
+            dispatched=len(self._waits),
+            coalesced=self._coalesced,
+            max_depth=self._max_depth,
+            max_in_flight=self._max_in_flight,
+            mean_wait=sum(self._waits) / len(self._waits) if self._waits else 0.0,
+            max_wait=max(self._waits, default=0.0),
+        )
+
+    def _dispatch(self, write):
+        token = trace.begin("write", target=str(write.target))
+        with self._lock:
+            self._in_flight += 1
+            self._max_in_flight = max(self._max_in_flight, self._in_flight)
+            self._unconfirmed.add(write)
+
+        def completion(error):
+            trace.end(token)
+            if error is not None:
+                for key in write.keys:
+                    self.results[key] = HandlerNotSet(
+                        f"Failed setting handler for '{write.target}': "
+                        f"{error.localizedDescription()}"
+                    )
+            elif self.on_confirm is not None:
+                self.on_confirm(write.keys, write.target, write.path)
+            with self._lock:
+                self._in_flight -= 1
+                self._unconfirmed.discard(write)
+            self._slots.release()
+
+        try:
+            write.write(write.target, write.path, completion)
+        except Exception:
+            trace.end(token)
+            with self._lock:
+                self._in_flight -= 1
+                self._unconfirmed.discard(write)
+            self._slots.release()
+            raise
+
+    def _acquire(self):
+        # pylint: disable-next=consider-using-with
+        if self._slots.acquire(blocking=False):
+            return True
+        with trace.span("wait for slot"):
+            # pylint: disable-next=consider-using-with
+            return self._slots.acquire(timeout=self.timeout)
+
+    def _wait(self):
+        """
+        Wait until all dispatched writes were confirmed.
+        Returns whether they were confirmed within the timeout.
+        """
+        acquired = 0
+        for _ in range(self.max_in_flight):
+            # pylint: disable-next=consider-using-with
+            if not self._slots.acquire(timeout=self.timeout):
+                break
+            acquired += 1
+        for _ in range(acquired):
+            self._slots.release()
+        return acquired == self.max_in_flight
+
+    def _time_out(self):
+        """
+        Report the dispatched writes LaunchServices has not confirmed as failed.
+        """
+        with self._lock:
+            unconfirmed = list(self._unconfirmed)
+        for write in unconfirmed:
+            for key in write.keys:
+                self.results[key] = HandlerNotSet(
+                    "Timed out waiting for LaunchServices to confirm "
+                    f"setting the handler for '{write.target}'."
+                )
+
+
+class _BoundedCache(OrderedDict):
+    """
+    Dict that holds at most ``maxsize`` entries. Adding one to a full cache
+    drops the entry that was added or replaced longest ago. Lookups are not
+    tracked, so they are as fast as in a plain dict.
+    """
+
+    def __init__(self, maxsize):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        if len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+def _load_bridge():
+    """
+    Imports the ObjC bridge on first use, since loading AppKit takes a good
+    part of short runs, e.g. of ``dooti apply`` when nothing changed.
+
+    The bridge is only available on macOS. Elsewhere, this module can still
+    be used, e.g. to run the benchmarks against a simulated workspace,
+    but Dooti itself cannot talk to the system.
+    """
+    # pylint: disable-next=global-statement
+    global objc, NSWorkspace, NSURL, NSArray, UTTagClassFilenameExtension, UTType
+    if objc is not None:
+        return
+    # pylint: disable=import-outside-toplevel,redefined-outer-name,no-name-in-module
+    try:
+        import objc
+        from AppKit import NSWorkspace
+        from Foundation import NSURL, NSArray
+        from UniformTypeIdentifiers import UTTagClassFilenameExtension, UTType
+    except ImportError:  # pragma: no cover
+        pass
+
+
+def _split_target(key):
+    scope, sep, target = key.partition(":")
+    if sep and scope in ("ext", "scheme", "uti"):
+        return scope, target
+    return ("uti" if "." in key else "scheme"), key
+
+
+def _call(target, selector, *args):
+    """
+    Calls into the ObjC bridge. All bridge calls go through here,
+    so they can be counted by ``Dooti.count_calls``.
+    """
+    for tally in _TALLIES:
+        tally[selector] += 1
+    return getattr(target, selector)(*args)
+
+
+def _to_uttype(uti):
+    if not isinstance(uti, str):
+        return uti
+    return _call(UTType, "importedTypeWithIdentifier_", uti)
+
+
+def _is_dynamic(uti):
+    return str(uti).startswith("dyn.")
@@ -0,0 +1,152 @@
+"""
+Serialization of concurrent ``dooti apply`` runs of the same user.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import time
+from pathlib import Path
+
+from .paths import cache_dir
+
+log = logging.getLogger(__name__)
+
+
+class LockTimeout(ValueError):
+    """
+    Raised when another run did not release the lock in time.
+    """
+
+
+class ApplyLock:
+    """
+    Advisory lock in the dooti cache directory. Runs that find it taken wait
+    for the holder to finish. The holder records which configuration it
+    applied, which allows waiting runs of the same configuration to be
+    coalesced into a no-op.
+    """
+
+    poll_interval = 0.1
+
+    def __init__(self, directory=None, timeout=300):
+        self.directory = Path(directory or cache_dir())
+        self.timeout = timeout
+        self.queued_at = None
+        self._file = None
+
+    @property
+    def record_file(self) -> Path:
+        """
+        Path to the record of the last completed run.
+        """
+        return self.directory / "last-apply.json"
+
+    def acquire(self) -> None:
+        """
+        Acquire the lock, waiting for the current holder if necessary.
+
+        :raises:
+            LockTimeout: when the lock could not be acquired within ``timeout`` seconds
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # pylint: disable-next=consider-using-with
+        self._file = open(self.directory / "apply.lock", "a", encoding="utf-8")
+        self.queued_at = time.time()
+        waiting = False
+        while True:
+            try:
+                fcntl.flock(self._file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                pass
+            if not waiting:
+                log.info("Waiting for another dooti run to finish.")
+                waiting = True
+            if self.timeout is not None and time.time() - self.queued_at > self.timeout:
+                self.release()
+                raise LockTimeout(
+                    f"Another dooti run did not finish within {self.timeout} seconds."
+                )
+            time.sleep(self.poll_interval)
+
+    def release(self) -> None:
+        """
+        Release the lock.
+        """
+        if self._file is not None:
+            fcntl.flock(self._file, fcntl.LOCK_UN)
+            self._file.close()
+            self._file = None
+
+    def coalesced(self, config_hash: str) -> dict | None:
+        """
+        Returns the record of a run that applied the same configuration
+        and finished after this one started waiting, if any.
+
+        :param str config_hash: hash of the configuration about to be applied
+        """
+        record = self.last_run()
+        if (
+            record is not None
+            and record.get("config") == config_hash
+            and record.get("finished", 0) > self.queued_at
+        ):
+            return record
+        return None
+
+    def fingerprint(self, config_hash: str, max_age: float) -> dict | None:
+        """
+        Returns the fingerprint recorded by the last run if it applied
+        the same configuration without errors within ``max_age`` seconds.
+
+        :param str config_hash: hash of the configuration about to be applied
+        :param float max_age: maximum age of the record in seconds
+        """
+        record = self.last_run()
+        if (
+            record is None
+            or record.get("config") != config_hash
+            or record.get("errors")
+            or time.time() - record.get("finished", 0) > max_age
+        ):
+            return None
+        return record.get("fingerprint")
+
+    def last_run(self) -> dict | None:
+        """
+        Returns the record of the last completed run, if any.
+        """
+        try:
+            with open(self.record_file, encoding="utf-8") as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+        return record if isinstance(record, dict) else None
+
+    def record(self, config_hash: str, errors=(), fingerprint=None) -> None:
+        """
+        Record a completed run.
+
+        :param str config_hash: hash of the applied configuration
+        :param list errors: errors encountered during the run
+        :param dict fingerprint: markers of the system state after the run
+        """
+        record = {
+            "config": config_hash,
+            "finished": time.time(),
+            "errors": list(errors),
+            "fingerprint": fingerprint,
+        }
+        tmp = self.record_file.with_suffix(".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(record, f)
+        os.replace(tmp, self.record_file)
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
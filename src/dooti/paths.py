@@ -0,0 +1,27 @@
+"""
+Filesystem locations used by dooti.
+"""
+
+from pathlib import Path
+
+from xdg import xdg_cache_home
+
+
+def cache_dir() -> Path:
+    """
+    Returns the directory dooti keeps its caches in.
+    """
+    return xdg_cache_home() / "dooti"
+
+
+def launchservices_prefs() -> Path:
+    """
+    Returns the LaunchServices preferences the default handlers are stored in.
+    """
+    return (
+        Path.home()
+        / "Library"
+        / "Preferences"
+        / "com.apple.LaunchServices"
+        / "com.apple.launchservices.secure.plist"
+    )
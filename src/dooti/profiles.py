@@ -0,0 +1,115 @@
+"""
+Storage for named profiles and their precompiled plans.
+
+Profiles are regular configuration files in ``$XDG_CONFIG_HOME/dooti/profiles``.
+Compiled plans map each UTI and URL scheme a profile manages to the resolved
+path of its handler and are kept in the dooti cache directory.
+"""
+
+import json
+import os
+from pathlib import Path
+
+from xdg import xdg_config_home
+
+from .paths import cache_dir
+
+
+class ProfileStore:
+    """
+    Locates profiles and manages their compiled plans and the active profile.
+    """
+
+    def __init__(self, config_dir=None, cache=None):
+        self.config_dir = Path(config_dir or xdg_config_home() / "dooti" / "profiles")
+        self.cache_dir = Path(cache or cache_dir() / "profiles")
+
+    def names(self) -> list[str]:
+        """
+        Returns the names of all defined profiles.
+        """
+        return sorted(
+            {
+                path.stem
+                for pattern in ("*.yaml", "*.yml")
+                for path in self.config_dir.glob(pattern)
+            }
+        )
+
+    def find(self, name: str) -> Path:
+        """
+        Returns the path to the configuration of a profile.
+
+        :param str name: name of the profile
+
+        :raises:
+            ValueError: when the profile does not exist
+        """
+        for suffix in (".yaml", ".yml"):
+            path = self.config_dir / f"{name}{suffix}"
+            if path.exists():
+                return path
+        raise ValueError(f"Profile `{name}` does not exist in `{self.config_dir}`.")
+
+    def compiled(self, name: str, source: str | None = None) -> dict | None:
+        """
+        Returns the compiled plan of a profile, if available.
+        Plans referring to handlers that are no longer installed are discarded.
+
+        :param str name: name of the profile
+        :param str source: hash of the current profile configuration. If set,
+                           plans compiled from a different version are discarded.
+        """
+        try:
+            with open(self.cache_dir / f"{name}.json", encoding="utf-8") as f:
+                compiled = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if not isinstance(compiled, dict) or "targets" not in compiled:
+            return None
+        if source is not None and compiled.get("source") != source:
+            return None
+        handlers = {
+            handler
+            for targets in compiled["targets"].values()
+            for handler in targets.values()
+        }
+        if not all(os.path.exists(handler) for handler in handlers):
+            return None
+        return compiled["targets"]
+
+    def save(self, name: str, source: str, targets: dict) -> None:
+        """
+        Store the compiled plan of a profile.
+
+        :param str name: name of the profile
+        :param str source: hash of the profile configuration it was compiled from
+        :param dict targets: compiled plan, mapping ``utis`` and ``schemes``
+                             to dicts of targets and handler paths
+        """
+        self._write(f"{name}.json", {"source": source, "targets": targets})
+
+    def active(self) -> str | None:
+        """
+        Returns the name of the profile that was applied last, if any.
+        """
+        try:
+            with open(self.cache_dir / "active.json", encoding="utf-8") as f:
+                return json.load(f).get("name")
+        except (OSError, ValueError, AttributeError):
+            return None
+
+    def set_active(self, name: str) -> None:
+        """
+        Record a profile as applied.
+
+        :param str name: name of the profile
+        """
+        self._write("active.json", {"name": name})
+
+    def _write(self, filename, data):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_dir / f"{filename}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp, self.cache_dir / filename)
@@ -0,0 +1,148 @@
+"""
+Compact representation of planned default handler changes.
+"""
+
+import sys
+from collections.abc import Callable, Iterable, Iterator
+from typing import NamedTuple
+
+KINDS = ("extensions", "schemes", "utis")
+
+
+class Change(NamedTuple):
+    """
+    A planned change of the default handler of a single target.
+    """
+
+    old: str | None
+    new: str
+
+    def to_dict(self) -> dict:
+        """
+        Returns the change as ``{"from": ..., "to": ...}``.
+        """
+        return {"from": self.old, "to": self.new}
+
+
+class HandlerState:
+    """
+    Immutable collection of planned changes per kind of target
+    (``extensions``, ``schemes`` or ``utis``).
+
+    Targets that were checked and already have the wanted handler are kept
+    without a change, so merging a later state drops changes an earlier one
+    planned for them. Handler paths are interned, since thousands of targets
+    usually point to a handful of applications.
+    """
+
+    __slots__ = ("_kinds",)
+
+    def __init__(self, kinds: Iterable[str] = ()):
+        self._kinds = {kind: {} for kind in kinds}
+
+    @classmethod
+    def compare(
+        cls,
+        kind: str,
+        targets: Iterable[tuple[str, str | None, str]],
+        same: Callable[[str | None, str], bool],
+    ) -> "HandlerState":
+        """
+        Returns the changes needed to move targets to their wanted handlers.
+
+        :param str kind: ``extensions``, ``schemes`` or ``utis``
+        :param targets: ``(target, current, wanted)`` handler paths
+        :param same: decides whether two handler paths refer to the same app
+        """
+        state = cls((kind,))
+        state._kinds[kind] = {
+            target: (
+                None
+                if same(current, wanted)
+                else Change(_intern(current), _intern(wanted))
+            )
+            for target, current, wanted in targets
+        }
+        return state
+
+    @classmethod
+    def merge(
+        cls, states: Iterable["HandlerState"], kinds: Iterable[str] = ()
+    ) -> "HandlerState":
+        """
+        Combines states in a single pass. Later states take precedence.
+
+        :param states: states to combine, consumed lazily
+        :param kinds: kinds to include even if no state contains them
+        """
+        merged = cls(kinds)
+        for state in states:
+            # pylint: disable-next=protected-access
+            for kind, targets in state._kinds.items():
+                merged._kinds.setdefault(kind, {}).update(targets)
+        return merged
+
+    def without(self, targets: set[tuple[str, str]]) -> "HandlerState":
+        """
+        Returns a copy without some targets.
+
+        :param set targets: ``(kind, target)`` pairs to leave out
+        """
+        state = HandlerState()
+        # pylint: disable-next=protected-access
+        state._kinds = {
+            kind: {
+                target: change
+                for target, change in changes.items()
+                if (kind, target) not in targets
+            }
+            for kind, changes in self._kinds.items()
+        }
+        return state
+
+    def rekey(self, key: Callable[[str, str], tuple[str, str]]) -> "HandlerState":
+        """
+        Returns a copy with the planned changes filed under other targets,
+        e.g. the configuration entries they stem from. When several changes
+        end up under the same target, the first one is kept.
+
+        :param key: maps ``(kind, target)`` to the new ``(kind, target)``
+        """
+        state = HandlerState(self._kinds)
+        for kind, target, change in self:
+            kind, target = key(kind, target)
+            # pylint: disable-next=protected-access
+            state._kinds.setdefault(kind, {}).setdefault(target, change)
+        return state
+
+    def to_dict(self) -> dict:
+        """
+        Returns the changes as ``{kind: {target: {"from": ..., "to": ...}}}``.
+        """
+        return {
+            kind: {
+                target: change.to_dict()
+                for target, change in changes.items()
+                if change is not None
+            }
+            for kind, changes in self._kinds.items()
+        }
+
+    def __iter__(self) -> Iterator[tuple[str, str, Change]]:
+        """
+        Yields ``(kind, target, change)`` for all planned changes.
+        """
+        for kind, changes in self._kinds.items():
+            for target, change in changes.items():
+                if change is not None:
+                    yield kind, target, change
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    def __bool__(self) -> bool:
+        return any(True for _ in self)
+
+
+def _intern(path):
+    return None if path is None else sys.intern(path)
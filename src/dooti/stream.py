@@ -0,0 +1,130 @@
+"""
+Incremental reading of large configurations.
+
+Instead of loading the whole document, definitions are yielded one by one
+as ``(location, scope, target, handler)`` in the order they appear in the file.
+"""
+
+import json
+from collections.abc import Iterator
+
+import yaml
+
+SCOPES = ("conforms", "mime", "ext", "scheme", "uti")
+JSONL_SUFFIXES = (".jsonl", ".ndjson")
+
+_Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+
+def is_jsonl(file) -> bool:
+    """
+    Checks whether a configuration file is in JSON Lines format.
+    """
+    return str(file).endswith(JSONL_SUFFIXES)
+
+
+def iter_entries(file) -> Iterator[tuple[str, str, str, str]]:
+    """
+    Yields ``(location, scope, target, handler)`` for all definitions in a
+    configuration file. ``location`` is the scope for top-level definitions
+    and ``app.<handler>.<scope>`` for those in an ``app`` block.
+
+    YAML files are read as a stream of parser events and must follow
+    the regular configuration format. JSON Lines files contain one
+    definition per line, e.g. ``{"scope": "ext", "target": "py", "handler": "Sublime Text"}``,
+    which counts as a top-level definition.
+
+    :param str file: path to the configuration file
+
+    :raises:
+        ValueError: when the configuration is invalid
+    """
+    with open(file, encoding="utf-8") as f:
+        if is_jsonl(file):
+            yield from _iter_jsonl(f)
+        else:
+            yield from _iter_yaml(f)
+
+
+def _iter_jsonl(f):
+    for num, line in enumerate(f, start=1):
+        if not line.strip():
+            continue
+        try:
+            entry = json.loads(line)
+            scope, target, handler = (
+                entry["scope"],
+                entry["target"],
+                entry["handler"],
+            )
+        except (ValueError, TypeError, KeyError) as err:
+            raise ValueError(f"Invalid definition on line {num}: {err}") from err
+        if scope not in SCOPES:
+            raise ValueError(f"Invalid scope `{scope}` on line {num}.")
+        yield scope, scope, str(target), str(handler)
+
+
+def _iter_yaml(f):
+    events = yaml.parse(f, Loader=_Loader)
+    for expected in (yaml.StreamStartEvent, yaml.DocumentStartEvent):
+        _expect(events, expected)
+    _expect(events, yaml.MappingStartEvent, "must be a dictionary")
+
+    for key in _iter_keys(events):
+        if key in SCOPES:
+            _expect(events, yaml.MappingStartEvent, f"`{key}` must be a dictionary")
+            for target in _iter_keys(events):
+                yield key, key, target, _scalar(next(events, None), "handlers")
+        elif "app" == key:
+            _expect(events, yaml.MappingStartEvent, "`app` must be a dictionary")
+            for handler in _iter_keys(events):
+                yield from _iter_app(events, handler)
+        else:
+            _skip(events)
+
+
+def _iter_app(events, handler):
+    _expect(events, yaml.MappingStartEvent, f"`app.{handler}` must be a dictionary")
+    for scope in _iter_keys(events):
+        if scope not in SCOPES:
+            _skip(events)
+            continue
+        _expect(
+            events, yaml.SequenceStartEvent, f"`app.{handler}.{scope}` must be a list"
+        )
+        while not isinstance(event := next(events, None), yaml.SequenceEndEvent):
+            yield f"app.{handler}.{scope}", scope, _scalar(event, "list items"), handler
+
+
+def _iter_keys(events):
+    """
+    Yields the keys of the current mapping. The caller consumes the values.
+    """
+    while not isinstance(event := next(events, None), yaml.MappingEndEvent):
+        yield _scalar(event, "keys")
+
+
+def _scalar(event, where):
+    if isinstance(event, yaml.AliasEvent):
+        raise ValueError(
+            f"Invalid configuration, aliases are not supported as {where}."
+        )
+    if not isinstance(event, yaml.ScalarEvent):
+        raise ValueError(f"Invalid configuration, {where} must be strings.")
+    return event.value
+
+
+def _expect(events, expected, message="is malformed"):
+    if not isinstance(next(events, None), expected):
+        raise ValueError(f"Invalid configuration, {message}.")
+
+
+def _skip(events):
+    depth = 0
+    for event in events:
+        if isinstance(event, (yaml.MappingStartEvent, yaml.SequenceStartEvent)):
+            depth += 1
+        elif isinstance(event, (yaml.MappingEndEvent, yaml.SequenceEndEvent)):
+            depth -= 1
+        if not depth:
+            return
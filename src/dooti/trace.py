@@ -0,0 +1,147 @@
+"""
+Recording of spans in the Chrome trace event format.
+
+Traces can be viewed in Perfetto (https://ui.perfetto.dev) or ``chrome://tracing``.
+Spans are only recorded while ``recording`` is active, otherwise they are
+close to free.
+"""
+
+import contextlib
+import itertools
+import json
+import os
+import threading
+import time
+from collections.abc import Iterator
+
+# Active recorders, see recording
+_RECORDERS = []
+_NULL = contextlib.nullcontext()
+
+
+class Recorder:
+    """
+    Collects trace events.
+    """
+
+    def __init__(self):
+        self.events = []
+        self.pid = os.getpid()
+        self._ids = itertools.count(1)
+
+    def add(self, name: str, phase: str, **fields) -> None:
+        """
+        Record a single event.
+
+        :param str name: name of the event
+        :param str phase: event type, e.g. ``X`` for complete events
+        """
+        self.events.append(
+            {
+                "name": name,
+                "ph": phase,
+                "pid": self.pid,
+                "tid": threading.get_native_id(),
+                **fields,
+            }
+        )
+
+    def next_id(self) -> int:
+        """
+        Returns a new ID to correlate asynchronous events.
+        """
+        return next(self._ids)
+
+    def save(self, file) -> None:
+        """
+        Write the recorded events to a file.
+
+        :param str file: path to write the trace to
+        """
+        with open(file, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": self.events, "displayTimeUnit": "ms"}, f)
+
+
+@contextlib.contextmanager
+def recording(file=None) -> Iterator[Recorder | None]:
+    """
+    Context manager that records all spans while it is active
+    and writes them to ``file`` on exit. Does nothing if ``file`` is unset.
+
+    :param str file: path to write the trace to
+    """
+    if file is None:
+        yield None
+        return
+    recorder = Recorder()
+    _RECORDERS.append(recorder)
+    try:
+        with span("dooti"):
+            yield recorder
+    finally:
+        _RECORDERS.remove(recorder)
+        recorder.save(file)
+
+
+def span(name: str, **args):
+    """
+    Returns a context manager that records its duration as a span.
+
+    :param str name: name of the span
+    :param args: details shown with the span
+    """
+    if not _RECORDERS:
+        return _NULL
+    return _span(_RECORDERS[-1], name, args)
+
+
+@contextlib.contextmanager
+def _span(recorder, name, args):
+    start = _now()
+    try:
+        yield
+    finally:
+        recorder.add(name, "X", ts=start, dur=_now() - start, args=args)
+
+
+def counter(name: str, **values) -> None:
+    """
+    Records the current values of a counter, e.g. the depth of a queue.
+
+    :param str name: name of the counter
+    :param values: current values by series
+    """
+    if _RECORDERS:
+        _RECORDERS[-1].add(name, "C", ts=_now(), args=values)
+
+
+def begin(name: str, **args) -> tuple | None:
+    """
+    Starts a span that can end on another thread, e.g. a write awaiting
+    its completion handler. Pass the returned token to ``end``.
+
+    :param str name: name of the span
+    :param args: details shown with the span
+    """
+    if not _RECORDERS:
+        return None
+    recorder = _RECORDERS[-1]
+    token = (recorder, name, recorder.next_id())
+    recorder.add(name, "b", cat=name, id=token[2], ts=_now(), args=args)
+    return token
+
+
+def end(token: tuple | None) -> None:
+    """
+    Ends a span started with ``begin``.
+
+    :param tuple token: token returned by ``begin``
+    """
+    if token is None:
+        return
+    recorder, name, span_id = token
+    recorder.add(name, "e", cat=name, id=span_id, ts=_now())
+
+
+def _now():
+    return time.perf_counter_ns() / 1000
@@ -0,0 +1,415 @@
+"""
+Re-enforcement of default handlers when they are changed behind dooti's back.
+
+LaunchServices does not announce changes of default handlers, but it
+persists them to its preferences. ``LaunchServicesEvents`` watches that
+file and the application directories with kqueue and tells which targets
+changed. ``Schedule`` checks all targets periodically instead. Any other
+iterable of ``Event`` can be used as a source as well.
+"""
+
+import contextlib
+import hashlib
+import logging
+import math
+import os
+import plistlib
+import re
+import select
+import socket
+import subprocess
+import time
+from collections.abc import Callable, Iterable, Iterator
+from pathlib import Path
+from typing import NamedTuple
+
+from .catalog import APP_DIRS
+from .paths import launchservices_prefs
+from .state import HandlerState
+
+# kqueue is only available on BSD and macOS.
+# pylint: disable=no-member
+
+log = logging.getLogger(__name__)
+
+HANDLERS = "handlers"
+APPS = "apps"
+
+POLL_INTERVAL = 60
+"""
+Longest a ``Schedule`` sleeps at once, so it notices when the
+system slept through a run.
+"""
+
+
+class Event(NamedTuple):
+    """
+    A change that might affect default handlers.
+    """
+
+    kind: str
+    """
+    ``handlers`` when default handlers changed,
+    ``apps`` when applications were installed or removed.
+    """
+    targets: tuple[str, ...] = ()
+    """
+    Affected targets prefixed with ``uti:``, ``scheme:`` or ``ext:``.
+    Empty if they are unknown, which means all of them are checked.
+    """
+
+
+class Watcher:
+    """
+    Keeps default handlers in line with a compiled configuration
+    by checking the targets named by change events.
+    """
+
+    def __init__(
+        self,
+        dooti,
+        plan: dict,
+        replan: Callable[[], dict] | None = None,
+        lock=None,
+        dry_run: bool = False,
+    ):  # pylint: disable=too-many-arguments,too-many-positional-arguments
+        """
+        :param Dooti dooti: instance to read and set default handlers with
+        :param dict plan: handler path per target as ``{"utis": {}, "schemes": {}}``
+        :param replan: compiles the plan again after applications changed
+        :param lock: context manager held while checking and setting handlers
+        :param bool dry_run: only report drifted targets
+        """
+        self.dooti = dooti
+        self.plan = plan
+        self.replan = replan
+        self.lock = lock
+        self.dry_run = dry_run
+
+    def run(self, events: Iterable[Event]) -> Iterator[tuple[HandlerState, list]]:
+        """
+        Checks the whole plan, then the targets affected by each event.
+        Yields the restored handlers and the errors after each check.
+
+        :param events: source of change events
+        """
+        yield self.check()
+        for event in events:
+            try:
+                yield self.handle(event)
+            except ValueError as err:
+                log.error(str(err))
+                yield HandlerState(), [str(err)]
+
+    def handle(self, event: Event) -> tuple[HandlerState, list]:
+        """
+        Checks the targets affected by an event and restores drifted ones.
+
+        :param Event event: the change to react to
+        """
+        if APPS == event.kind:
+            log.info("Applications changed, checking all targets.")
+            self.dooti.refresh()
+            if self.replan is not None:
+                self.plan = self.replan()
+            return self.check()
+        if not event.targets:
+            return self.check()
+        return self.check(self._affected(event.targets))
+
+    def check(self, targets=None) -> tuple[HandlerState, list]:
+        """
+        Reads the current handlers of planned targets and restores
+        the ones that differ from the plan.
+
+        :param dict targets: ``{"utis": [], "schemes": []}`` to check,
+                             defaults to the whole plan
+        """
+        prefixes = {"utis": "uti", "schemes": "scheme"}
+        with self.lock or contextlib.nullcontext():
+            # The handlers were changed behind our back.
+            self.dooti.refresh_handlers(
+                None
+                if targets is None
+                else [
+                    f"{prefixes[kind]}:{target}"
+                    for kind, kind_targets in targets.items()
+                    for target in kind_targets
+                ]
+            )
+            diff = HandlerState.merge(
+                self._compare(kind, getter, targets)
+                for kind, getter in (
+                    ("utis", self.dooti.get_default_uti),
+                    ("schemes", self.dooti.get_default_scheme),
+                )
+            )
+            if self.dry_run or not diff:
+                return diff, []
+            results = self.dooti.set_defaults(
+                {
+                    f"{prefixes[kind]}:{target}": change.new
+                    for kind, target, change in diff
+                }
+            )
+        errors = []
+        failed = set()
+        for kind, target, change in diff:
+            error = results[f"{prefixes[kind]}:{target}"]
+            if error is None:
+                log.info("Restored %s: %s -> %s", target, change.old, change.new)
+            else:
+                errors.append(str(error))
+                failed.add((kind, target))
+        return diff.without(failed), errors
+
+    def _compare(self, kind, getter, targets=None):
+        planned = self.plan.get(kind, {})
+        if targets is not None:
+            planned = {
+                target: planned[target] for target in targets[kind] if target in planned
+            }
+        return HandlerState.compare(
+            kind,
+            ((target, getter(target), handler) for target, handler in planned.items()),
+            self.dooti.same_handler,
+        )
+
+    def _affected(self, targets):
+        affected = {"utis": [], "schemes": []}
+        for key in targets:
+            scope, _, target = key.partition(":")
+            if "scheme" == scope:
+                affected["schemes"].append(target)
+            elif "ext" == scope:
+                affected["utis"].extend(self.dooti.get_ext_utis(target))
+            else:
+                affected["utis"].append(target)
+        return affected
+
+
+class LaunchServicesEvents:  # pylint: disable=too-few-public-methods
+    """
+    Source of events for changes of the LaunchServices preferences and
+    the application directories. Requires kqueue, i.e. macOS.
+    """
+
+    def __init__(self, prefs=None, app_dirs=APP_DIRS, settle: float = 0.5):
+        """
+        :param str prefs: path to the LaunchServices preferences
+        :param list app_dirs: directories applications are installed to
+        :param float settle: seconds to wait for related changes to arrive
+        """
+        if not hasattr(select, "kqueue"):
+            raise ValueError("Watching for changes is only supported on macOS.")
+        self.prefs = launchservices_prefs() if prefs is None else Path(prefs)
+        self.app_dirs = app_dirs
+        self.settle = settle
+
+    def __iter__(self) -> Iterator[Event]:
+        previous = read_handlers(self.prefs)
+        queue = select.kqueue()
+        try:
+            while True:
+                fds = self._watch(queue)
+                try:
+                    fired = {ev.ident for ev in queue.control(None, 16, None)}
+                    # Installers and cfprefsd touch several files in a row.
+                    time.sleep(self.settle)
+                    fired.update(ev.ident for ev in queue.control(None, 64, 0))
+                finally:
+                    for fd in fds:
+                        os.close(fd)
+                if any(fds[fd] in self.app_dirs for fd in fired):
+                    yield Event(APPS)
+                current = read_handlers(self.prefs)
+                if current is None or previous is None:
+                    yield Event(HANDLERS)
+                elif changed := changed_targets(previous, current):
+                    yield Event(HANDLERS, changed)
+                previous = current
+        finally:
+            queue.close()
+
+    def _watch(self, queue):
+        """
+        Registers the preferences, their directory and the application
+        directories. The preferences are replaced on every change,
+        so they are opened again after each event.
+        """
+        fds = {}
+        for path in (self.prefs, self.prefs.parent, *self.app_dirs):
+            try:
+                fd = os.open(path, getattr(os, "O_EVTONLY", os.O_RDONLY))
+            except OSError:
+                continue
+            fds[fd] = path
+            queue.control(
+                [
+                    select.kevent(
+                        fd,
+                        filter=select.KQ_FILTER_VNODE,
+                        flags=select.KQ_EV_ADD | select.KQ_EV_CLEAR,
+                        fflags=select.KQ_NOTE_WRITE
+                        | select.KQ_NOTE_EXTEND
+                        | select.KQ_NOTE_DELETE
+                        | select.KQ_NOTE_RENAME,
+                    )
+                ],
+                0,
+            )
+        return fds
+
+
+class Schedule:
+    """
+    Source of events for checking all targets periodically.
+
+    The first run is delayed by an offset below ``jitter`` that is stable
+    per host, so hosts started at the same time spread their runs.
+    Later runs keep that phase. After failed runs, as reported by ``record``,
+    the delay doubles up to ``max_backoff``.
+    """
+
+    # pylint: disable-next=too-many-arguments
+    def __init__(
+        self,
+        interval: float,
+        jitter: float = 0,
+        *,
+        host: str | None = None,
+        max_backoff: float | None = None,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        """
+        :param float interval: seconds between runs
+        :param float jitter: upper bound of the offset in seconds
+        :param str host: identifies the host, defaults to ``host_id()``
+        :param float max_backoff: longest delay after failures in seconds,
+                                  defaults to eight times the interval
+        :param clock: wall clock in seconds
+        :param sleep: function to sleep for a number of seconds
+        """
+        if interval <= 0:
+            raise ValueError("The interval must be positive.")
+        self.interval = interval
+        self.offset = host_offset(host or host_id(), jitter)
+        self.max_backoff = 8 * interval if max_backoff is None else max_backoff
+        self.clock = clock
+        self.sleep = sleep
+        self.failures = 0
+
+    def __iter__(self) -> Iterator[Event]:
+        due = self.clock() + self.offset
+        while True:
+            self._sleep_until(due)
+            yield Event(HANDLERS)
+            due = self._next_run(due)
+
+    def record(self, failed: bool) -> None:
+        """
+        Reports the outcome of the last run to schedule the next one.
+
+        :param bool failed: whether the run failed
+        """
+        self.failures = self.failures + 1 if failed else 0
+
+    def _next_run(self, due):
+        backoff = self.interval * 2 ** min(self.failures, 32)
+        due += max(self.interval, min(backoff, self.max_backoff))
+        now = self.clock()
+        if due < now:
+            # Skip the runs that were missed, e.g. while the system slept.
+            due += math.ceil((now - due) / self.interval) * self.interval
+        return due
+
+    def _sleep_until(self, due):
+        while (delay := due - self.clock()) > 0:
+            self.sleep(min(delay, POLL_INTERVAL))
+
+
+def host_id() -> str:
+    """
+    Returns the hardware UUID of the machine, or its host name if it
+    cannot be read.
+    """
+    try:
+        out = subprocess.run(
+            ["ioreg", "-rd1", "-c", "IOPlatformExpertDevice"],
+            capture_output=True,
+            check=True,
+            text=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        out = ""
+    if match := re.search(r'"IOPlatformUUID" = "([^"]+)"', out):
+        return match.group(1)
+    return socket.gethostname()
+
+
+def host_offset(host: str, jitter: float) -> float:
+    """
+    Returns a pseudo-random offset below ``jitter`` that is stable per host.
+
+    :param str host: identifies the host
+    :param float jitter: upper bound of the offset
+    """
+    digest = hashlib.sha256(host.encode()).digest()
+    return int.from_bytes(digest[:8], "big") / 2**64 * jitter
+
+
+def read_handlers(file=None) -> dict[str, tuple] | None:
+    """
+    Returns the handler roles LaunchServices stores per target, keyed by
+    ``uti:``, ``scheme:`` or ``ext:`` prefixed targets, or None if the
+    preferences could not be read.
+
+    :param str file: path to the LaunchServices preferences
+    """
+    try:
+        with open(launchservices_prefs() if file is None else file, "rb") as f:
+            data = plistlib.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError, plistlib.InvalidFileException):
+        return None
+    if not isinstance(data, dict):
+        return None
+    handlers = {}
+    for entry in data.get("LSHandlers", []):
+        if not isinstance(entry, dict):
+            continue
+        if "LSHandlerContentType" in entry:
+            key = f"uti:{entry['LSHandlerContentType']}"
+        elif "LSHandlerURLScheme" in entry:
+            key = f"scheme:{entry['LSHandlerURLScheme']}"
+        elif "public.filename-extension" == entry.get("LSHandlerContentTagClass"):
+            key = f"ext:{entry.get('LSHandlerContentTag')}"
+        else:
+            continue
+        handlers[key] = tuple(
+            sorted(
+                (role, str(value))
+                for role, value in entry.items()
+                if role.startswith("LSHandlerRole")
+            )
+        )
+    return handlers
+
+
+def changed_targets(previous: dict, current: dict) -> tuple[str, ...]:
+    """
+    Returns the targets whose handlers differ between two results
+    of ``read_handlers``.
+
+    :param dict previous: handlers before the change
+    :param dict current: handlers after the change
+    """
+    return tuple(
+        sorted(
+            key
+            for key in previous.keys() | current.keys()
+            if previous.get(key) != current.get(key)
+        )
+    )
@@ -1,6 +1,8 @@
 import subprocess
 import tempfile
 
+from dooti.dooti import ApplicationNotFound, Dooti
+
 
 def get_scheme_handler(scheme):
     return subprocess.check_output(
@@ -26,3 +28,128 @@ def get_ext_handler(ext):
             text=True,
         ).strip()
         return "/" + "/".join(alias.split(":")[1:-1])
+
+
+class FakeWorkspace:
+    """
+    Stands in for NSWorkspace, keeping installed apps and
+    default handlers in memory.
+    """
+
+    def __init__(self, apps, handlers=None, candidates=None):
+        # maps app names and bundle IDs to paths
+        self.apps = apps
+        # maps UTI and schemes to app paths
+        self.handlers = dict(handlers or {})
+        # maps UTI and schemes to lists of app paths able to open them
+        self.candidates = dict(candidates or {})
+
+    @staticmethod
+    def _url(path):
+        from Foundation import NSURL  # pylint: disable=import-outside-toplevel
+
+        if path is None:
+            return None
+        return NSURL.fileURLWithPath_(path)
+
+    def URLForApplicationToOpenContentType_(self, uti):
+        return self._url(self.handlers.get(uti.identifier()))
+
+    def URLForApplicationToOpenURL_(self, url):
+        return self._url(self.handlers.get(url.scheme()))
+
+    def URLsForApplicationsToOpenContentType_(self, uti):
+        return [self._url(path) for path in self.candidates.get(uti.identifier(), [])]
+
+    def URLsForApplicationsToOpenURL_(self, url):
+        return [self._url(path) for path in self.candidates.get(url.scheme(), [])]
+
+    def setDefaultApplicationAtURL_toOpenContentType_completionHandler_(
+        self, app, uti, handler
+    ):
+        self.handlers[uti.identifier()] = app.path()
+        if handler:
+            handler(None)
+
+    def setDefaultApplicationAtURL_toOpenURLsWithScheme_completionHandler_(
+        self, app, scheme, handler
+    ):
+        self.handlers[scheme] = app.path()
+        if handler:
+            handler(None)
+
+    def URLForApplicationWithBundleIdentifier_(self, bundle_id):
+        if "." not in bundle_id:
+            return None
+        return self._url(self.apps.get(bundle_id))
+
+    def fullPathForApplication_(self, name):
+        return self.apps.get(name)
+
+
+class FakeURL:
+    """
+    Stands in for NSURL file URLs where the ObjC bridge is unavailable.
+    """
+
+    def __init__(self, path):
+        self._path = path
+
+    def path(self):
+        return self._path
+
+    def fileSystemRepresentation(self):
+        return self._path.encode()
+
+
+class StubDooti(Dooti):
+    """
+    Dooti that reads and writes the handlers of a FakeWorkspace directly
+    instead of calling into the ObjC bridge, so it runs without pyobjc.
+    Records the handler references it resolved and the targets it read.
+    Also backs the benchmark simulation.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.resolved = []
+        self.reads = []
+
+    @staticmethod
+    def ext_to_utis(ext):
+        return [f"dyn.{ext}"]
+
+    def conforming_utis(self, uti):
+        return self.catalog.conforming(uti)
+
+    def _read_uti_handler(self, uti):
+        return self._read(uti)
+
+    def _read_scheme_handler(self, scheme):
+        return self._read(scheme)
+
+    def _read(self, target):
+        self.reads.append(target)
+        path = self.workspace.handlers.get(target)
+        return None if path is None else FakeURL(path)
+
+    def _set_uti_handler(self, uti, path, completion=None):
+        self._set(uti, path, completion)
+
+    def _set_scheme_handler(self, scheme, path, completion=None):
+        self._set(scheme, path, completion)
+
+    def _set(self, target, path, completion):
+        self.workspace.handlers[target] = path.path()
+        if completion:
+            completion(None)
+
+    def get_app_path(self, app):
+        self.resolved.append(app)
+        if app[0] == "/":
+            return FakeURL(app)
+        if app not in self.workspace.apps:
+            raise ApplicationNotFound(
+                f"Could not find an application matching the description '{app}'."
+            )
+        return FakeURL(self.workspace.apps[app])
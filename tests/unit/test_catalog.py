@@ -0,0 +1,274 @@
+import plistlib
+import subprocess
+import sys
+
+import pytest
+
+from dooti.catalog import Catalog, find_bundles, handler_rank
+
+
+def _bundle(path, info):
+    contents = path / "Contents"
+    contents.mkdir(parents=True)
+    with open(contents / "Info.plist", "wb") as f:
+        plistlib.dump(info, f)
+    return path
+
+
+@pytest.fixture
+def bundles(tmp_path):
+    return [
+        _bundle(
+            tmp_path / "CoreTypes.bundle",
+            {
+                "UTExportedTypeDeclarations": [
+                    {"UTTypeIdentifier": "public.data"},
+                    {
+                        "UTTypeIdentifier": "public.image",
+                        "UTTypeConformsTo": "public.data",
+                    },
+                    {
+                        "UTTypeIdentifier": "public.jpeg",
+                        "UTTypeConformsTo": ["public.image"],
+                        "UTTypeTagSpecification": {
+                            "public.filename-extension": ["jpeg", "JPG"],
+                            "public.mime-type": "image/jpeg",
+                        },
+                    },
+                    {
+                        "UTTypeIdentifier": "public.png",
+                        "UTTypeConformsTo": ["public.image"],
+                        "UTTypeTagSpecification": {
+                            "public.filename-extension": "png",
+                            "public.mime-type": ["image/png", "image/x-png"],
+                        },
+                    },
+                ]
+            },
+        ),
+        _bundle(
+            tmp_path / "Foo.app",
+            {
+                "CFBundleDocumentTypes": [
+                    {
+                        "CFBundleTypeExtensions": ["foo", "*"],
+                        "LSItemContentTypes": ["org.example.foo"],
+                    }
+                ],
+                "UTImportedTypeDeclarations": [
+                    {
+                        "UTTypeIdentifier": "org.example.foo-image",
+                        "UTTypeConformsTo": ["public.png"],
+                        "UTTypeTagSpecification": {
+                            "public.filename-extension": "png",
+                            "public.mime-type": "image/png",
+                        },
+                    }
+                ],
+                "CFBundleURLTypes": [{"CFBundleURLSchemes": ["FOO", "foo-x"]}],
+            },
+        ),
+        tmp_path / "Broken.app",
+    ]
+
+
+def test_scan(bundles):
+    catalog = Catalog.scan(bundles)
+    assert catalog.extensions == {"foo", "jpeg", "jpg", "png"}
+    assert catalog.schemes == {"foo", "foo-x"}
+    assert {"public.jpeg", "org.example.foo", "org.example.foo-image"} <= catalog.utis
+
+
+@pytest.mark.parametrize(
+    "uti,expected",
+    (
+        (
+            "public.image",
+            ["org.example.foo-image", "public.image", "public.jpeg", "public.png"],
+        ),
+        ("public.png", ["org.example.foo-image", "public.png"]),
+        ("public.jpeg", ["public.jpeg"]),
+        ("org.example.unknown", ["org.example.unknown"]),
+    ),
+)
+def test_conforming(bundles, uti, expected):
+    assert Catalog.scan(bundles).conforming(uti) == expected
+
+
+@pytest.mark.parametrize(
+    "ext,expected",
+    (
+        ("PNG", ["public.png", "org.example.foo-image"]),
+        ("jpg", ["public.jpeg"]),
+        ("foo", []),
+    ),
+)
+def test_ext_utis(bundles, ext, expected):
+    assert Catalog.scan(bundles).ext_utis(ext) == expected
+
+
+@pytest.mark.parametrize(
+    "mime,expected",
+    (
+        ("image/png", ["public.png", "org.example.foo-image"]),
+        ("image/x-png", ["public.png"]),
+        ("text/plain", []),
+    ),
+)
+def test_mime_utis(bundles, mime, expected):
+    assert Catalog.scan(bundles).mime_utis(mime) == expected
+
+
+def test_imported_declarations_are_not_preferred(tmp_path):
+    catalog = Catalog.scan(
+        [
+            _bundle(
+                tmp_path / "Importer.app",
+                {
+                    "UTImportedTypeDeclarations": [
+                        {
+                            "UTTypeIdentifier": "org.example.imported",
+                            "UTTypeTagSpecification": {
+                                "public.filename-extension": "x"
+                            },
+                        }
+                    ]
+                },
+            ),
+            _bundle(
+                tmp_path / "Exporter.app",
+                {
+                    "UTExportedTypeDeclarations": [
+                        {
+                            "UTTypeIdentifier": "org.example.exported",
+                            "UTTypeTagSpecification": {
+                                "public.filename-extension": "x"
+                            },
+                        }
+                    ]
+                },
+            ),
+        ]
+    )
+    assert catalog.ext_utis("x") == ["org.example.exported", "org.example.imported"]
+
+
+def test_uti_tags(bundles):
+    catalog = Catalog.scan(bundles)
+    assert catalog.uti_tags("public.jpeg") == {
+        "ext": ["jpeg", "jpg"],
+        "mime": ["image/jpeg"],
+    }
+    assert catalog.uti_tags("public.data") == {"ext": [], "mime": []}
+
+
+def test_load_uses_cache(bundles, tmp_path):
+    cache_file = tmp_path / "cache" / "catalog.json"
+    catalog = Catalog.load(cache_file=cache_file, bundles=bundles)
+    assert cache_file.exists()
+
+    cached = Catalog.load(cache_file=cache_file, bundles=bundles)
+    assert cached.to_dict() == catalog.to_dict()
+    assert cached.conforming("public.image") == catalog.conforming("public.image")
+    assert cached.ext_utis("png") == catalog.ext_utis("png")
+    assert cached.mime_utis("image/png") == catalog.mime_utis("image/png")
+    assert cached.fingerprint == catalog.fingerprint
+
+
+def test_load_rebuilds_on_change(bundles, tmp_path):
+    cache_file = tmp_path / "catalog.json"
+    Catalog.load(cache_file=cache_file, bundles=bundles)
+    _bundle(
+        tmp_path / "Bar.app", {"CFBundleURLTypes": [{"CFBundleURLSchemes": ["bar"]}]}
+    )
+    previous = Catalog.load(cache_file=cache_file, bundles=bundles)
+    catalog = Catalog.load(
+        cache_file=cache_file, bundles=bundles + [tmp_path / "Bar.app"]
+    )
+    assert "bar" in catalog.schemes
+    assert catalog.fingerprint != previous.fingerprint
+
+
+@pytest.mark.parametrize(
+    "pattern,kind,expected",
+    (
+        (
+            "public.*",
+            "uti",
+            ["public.data", "public.image", "public.jpeg", "public.png"],
+        ),
+        ("*.foo*", "uti", ["org.example.foo", "org.example.foo-image"]),
+        ("public.?peg", "uti", ["public.jpeg"]),
+        ("J*", "ext", ["jpeg", "jpg"]),
+        ("/^jp(e)?g$/", "ext", ["jpeg", "jpg"]),
+        ("/^public\\.(png|jpeg)$/", "uti", ["public.jpeg", "public.png"]),
+        ("/png/", "uti", ["public.png"]),
+        ("org.*.bar", "uti", []),
+        ("image/*", "mime", ["image/jpeg", "image/png", "image/x-png"]),
+    ),
+)
+def test_expand(bundles, pattern, kind, expected):
+    assert Catalog.scan(bundles).expand(pattern, kind) == expected
+
+
+def test_expand_invalid_regex(bundles):
+    with pytest.raises(ValueError, match="Invalid regular expression"):
+        Catalog.scan(bundles).expand("/^(c/", "ext")
+
+
+def test_find_bundles_in_subdirectories(tmp_path):
+    apps = tmp_path / "Applications"
+    for app in (
+        "Safari.app",
+        "Setapp/Bartender.app",
+        "Adobe Photoshop/Adobe Photoshop.app",
+        "Xcode.app/Contents/Applications/Simulator.app",
+        "Setapp/Nested/Deep.app",
+    ):
+        (apps / app).mkdir(parents=True)
+    found = [path for path in find_bundles((apps,)) if tmp_path in path.parents]
+    assert found == [
+        apps / "Safari.app",
+        apps / "Xcode.app",
+        apps / "Adobe Photoshop" / "Adobe Photoshop.app",
+        apps / "Setapp" / "Bartender.app",
+    ]
+
+
+def test_handler_rank():
+    info = {
+        "CFBundleDocumentTypes": [
+            {"LSItemContentTypes": ["public.data"], "LSHandlerRank": "Alternate"},
+            {
+                "LSItemContentTypes": ["Public.Plain-Text", "public.html"],
+                "LSHandlerRank": "Owner",
+                "CFBundleTypeRole": "Editor",
+            },
+            {"LSItemContentTypes": ["public.html"], "CFBundleTypeRole": "Viewer"},
+        ],
+        "CFBundleURLTypes": [{"CFBundleURLSchemes": ["http"]}],
+    }
+    assert handler_rank(info, "uti", "public.plain-text") == (3, 3)
+    assert handler_rank(info, "uti", "public.data") == (1, 0)
+    assert handler_rank(info, "uti", "public.image") == (-1, -1)
+    # an undeclared rank is treated as Default
+    assert handler_rank(info, "scheme", "http") == (2, 0)
+    assert handler_rank(None, "scheme", "http") == (-1, -1)
+
+
+def test_does_not_load_bridge():
+    # The catalog must stay usable where pyobjc is not installed.
+    out = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            "import sys; import dooti.catalog; "
+            "print(sorted(m for m in sys.modules "
+            "if m.split('.')[0] in ('objc', 'AppKit', 'Foundation', "
+            "'UniformTypeIdentifiers', 'dooti')))",
+        ],
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    assert out.strip() == "['dooti', 'dooti.catalog', 'dooti.paths']"
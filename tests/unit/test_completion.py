@@ -0,0 +1,135 @@
+# pylint: disable=protected-access
+import argparse
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+
+from dooti import catalog, completion
+from dooti.catalog import Catalog
+from dooti.cli import _parser
+from dooti.completion import complete
+
+SIZE = 10_000
+
+
+@pytest.fixture
+def cache(tmp_path):
+    cache_file = tmp_path / "cache" / "dooti" / "catalog.json"
+    cache_file.parent.mkdir(parents=True)
+    utis = [f"org.example.type{num}" for num in range(SIZE)]
+    Catalog(
+        extensions=(f"ext{num}" for num in range(SIZE)),
+        utis=utis,
+        schemes=("http", "https", "mailto"),
+        tags={
+            uti: {"ext": [f"ext{num}"], "mime": [f"application/x-type{num}"]}
+            for num, uti in enumerate(utis)
+        },
+    ).save(cache_file, "")
+    return cache_file
+
+
+def _subparsers(parser):
+    return next(
+        action.choices
+        for action in parser._actions
+        if isinstance(action, argparse._SubParsersAction)
+    )
+
+
+def _options(parser):
+    options = {opt for action in parser._actions for opt in action.option_strings} - {
+        "-h",
+        "--help",
+    }
+    for action in parser._actions:
+        if isinstance(action, argparse._SubParsersAction):
+            for sub in action.choices.values():
+                options |= _options(sub)
+    return options
+
+
+def test_commands_match_parser():
+    parser = _parser()
+    commands = _subparsers(parser)
+    assert set(completion.COMMANDS) == set(commands)
+    for name, sub in commands.items():
+        assert set(completion.COMMANDS[name]) == _options(sub)
+    assert set(completion.GLOBAL_OPTIONS) == {
+        opt for action in parser._actions for opt in action.option_strings
+    }
+    assert [Path(path).expanduser() for path in completion.APP_DIRS] == list(
+        catalog.APP_DIRS
+    )
+
+
+def test_complete(cache, tmp_path):
+    profiles = tmp_path / "config" / "profiles"
+    profiles.mkdir(parents=True)
+    (profiles / "work.yaml").touch()
+
+    def run(*words):
+        return complete(list(words), cache_file=cache, config_dir=profiles.parent)
+
+    assert run("") == sorted(completion.COMMANDS)
+    assert run("sn") == ["snapshot"]
+    assert run("-y", "ext", "ext999") == ["ext999", *(f"ext999{n}" for n in range(10))]
+    assert run("scheme", "ht") == ["http", "https"]
+    assert run("mime", "application/x-type123") == [
+        "application/x-type123",
+        *(f"application/x-type123{n}" for n in range(10)),
+    ]
+    assert run("uti", "-c", "org.example.type9999") == ["org.example.type9999"]
+    assert run("uti", "--c") == ["--conforming"]
+    assert run("-f", "") == ["json", "yaml"]
+    assert run("profile", "use", "") == ["work"]
+    assert run("completion", "z") == ["zsh"]
+    assert not run("ext", "-x", "NoSuchApp")
+
+
+def test_missing_cache(tmp_path):
+    assert not complete(["ext", ""], cache_file=tmp_path / "missing.json")
+
+
+def test_completer_latency(cache):
+    """
+    The completer runs on every key press. It must not import
+    the ObjC bridge and should add little on top of interpreter startup.
+    """
+
+    def timed(*args):
+        timings = []
+        for _ in range(5):
+            start = time.perf_counter()
+            proc = subprocess.run(
+                [sys.executable, *args],
+                capture_output=True,
+                check=True,
+                text=True,
+                env={**os.environ, "XDG_CACHE_HOME": str(cache.parent.parent)},
+            )
+            timings.append(time.perf_counter() - start)
+        return min(timings), proc.stdout
+
+    startup, _ = timed("-c", "pass")
+    duration, out = timed(
+        "-c",
+        "import sys; from dooti.completion import main; "
+        "sys.argv = ['_dooti_complete', 'uti', 'org.example.type123']; main(); "
+        "print(sorted(m for m in sys.modules "
+        "if m.split('.')[0] in ('objc', 'AppKit', 'Foundation', 'xdg', 'dooti')))",
+    )
+    *candidates, modules = out.splitlines()
+    assert len(candidates) == 11
+    assert modules == "['dooti', 'dooti.completion']"
+    assert duration - startup < 0.05
+
+
+def test_apps_in_subdirectories(tmp_path):
+    for app in ("Safari.app", "Setapp/Bartender.app", "Setapp/Nested/Deep.app"):
+        (tmp_path / app).mkdir(parents=True)
+    assert completion._apps((str(tmp_path),)) == {"Safari", "Bartender"}
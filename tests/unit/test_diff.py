@@ -0,0 +1,130 @@
+import argparse
+import json
+
+import pytest
+import yaml
+
+from dooti.catalog import Catalog
+from dooti.cli import DootiCLI
+from dooti.dooti import Dooti
+
+CATALOG = {
+    "extensions": ["htm", "html", "md", "png"],
+    "schemes": ["http", "https"],
+    "utis": {
+        "public.html": [["public.text"], ["htm", "html"], ["text/html"], True],
+        "public.png": [["public.image"], ["png"], ["image/png"], True],
+        "net.daringfireball.markdown": [["public.text"], ["md"], [], False],
+        "public.text": [[], [], [], True],
+        "public.image": [[], [], [], True],
+    },
+}
+
+
+@pytest.fixture
+def catalog_file(tmp_path):
+    file = tmp_path / "catalog.json"
+    file.write_text(json.dumps(CATALOG), encoding="utf-8")
+    return file
+
+
+@pytest.fixture
+def cli():
+    # Diffing must not touch the workspace, so a bare object will do.
+    return DootiCLI(dooti=Dooti(workspace=object()))
+
+
+def _config(tmp_path, name, text):
+    file = tmp_path / name
+    file.write_text(text, encoding="utf-8")
+    return file
+
+
+def test_diff_compares_effective_targets(tmp_path, cli, catalog_file):
+    old = _config(
+        tmp_path,
+        "old.yaml",
+        "ext:\n  html: Safari\n  png: Preview\nscheme:\n  http: Safari\n",
+    )
+    # Same effect for html and png, written differently.
+    new = _config(
+        tmp_path,
+        "new.yaml",
+        "uti:\n  public.html: Safari\napp:\n  Preview:\n    conforms:\n"
+        "      - public.image\n    ext:\n      - png\n"
+        "  Firefox:\n    scheme:\n      - http\n      - https\n"
+        "    ext:\n      - md\n",
+    )
+    diff, _ = cli.diff(old, new, catalog=catalog_file)
+    assert {
+        "utis": {
+            "net.daringfireball.markdown": {"from": None, "to": "Firefox"},
+            "public.image": {"from": None, "to": "Preview"},
+        },
+        "schemes": {
+            "http": {"from": "Safari", "to": "Firefox"},
+            "https": {"from": None, "to": "Firefox"},
+        },
+    } == diff
+    assert not cli.errors
+    # The reversed diff swaps sides.
+    diff, _ = cli.diff(new, old)
+    assert {"from": "Firefox", "to": None} == diff["schemes"]["https"]
+
+
+def test_diff_unknown_extensions(tmp_path, catalog_file):
+    old = _config(tmp_path, "old.yaml", "ext:\n  html: Safari\n")
+    new = _config(tmp_path, "new.yaml", "ext:\n  html: Safari\n  foo: Vim\n")
+
+    cli = DootiCLI(dooti=Dooti(workspace=object(), catalog=Catalog.read(catalog_file)))
+    diff, _ = cli.diff(old, new, dynamic=True)
+    assert {"foo": {"from": None, "to": "Vim"}} == diff["extensions"]
+    assert not cli.errors
+
+    cli = DootiCLI(dooti=Dooti(workspace=object(), catalog=Catalog.read(catalog_file)))
+    diff, _ = cli.diff(old, new)
+    assert "extensions" not in diff
+    assert ["No UTI are registered for file extension 'foo'."] == [
+        err.split(" To")[0] for err in cli.errors
+    ]
+
+
+def test_read_invalid_catalog(tmp_path):
+    file = _config(tmp_path, "catalog.json", '{"utis": {}}')
+    with pytest.raises(ValueError, match="Invalid catalog"):
+        Catalog.read(file)
+
+
+def test_diff_with_catalog_file_needs_no_bridge(tmp_path, catalog_file):
+    old = _config(tmp_path, "old.yaml", "ext:\n  html: Safari\n")
+    new = _config(tmp_path, "new.yaml", "ext:\n  html: Firefox\n")
+    cli = DootiCLI()
+    diff, _ = cli.diff(old, new, catalog=catalog_file)
+    assert diff["utis"] == {"public.html": {"from": "Safari", "to": "Firefox"}}
+    assert cli._dooti is None  # pylint: disable=protected-access
+
+
+def test_failed_diff_exits_nonzero(tmp_path, catalog_file, monkeypatch, capsys):
+    old = _config(tmp_path, "old.yaml", "ext:\n  html: Safari\n")
+    cli = DootiCLI()
+
+    def broken(_):
+        raise RuntimeError("broken")
+
+    monkeypatch.setattr(Catalog, "read", broken)
+    args = argparse.Namespace(old=old, new=old, dynamic=False, catalog=catalog_file)
+    with pytest.raises(SystemExit) as exc:
+        cli.run("diff", args)
+    assert exc.value.code == 1
+    assert yaml.safe_load(capsys.readouterr().out)["errors"] == ["broken"]
+
+
+def test_unknown_mime(catalog_file, capsys):
+    cli = DootiCLI(dooti=Dooti(workspace=object(), catalog=Catalog.read(catalog_file)))
+    args = argparse.Namespace(mimes=["image/png", "x/unknown"], handler=None)
+    with pytest.raises(SystemExit) as exc:
+        cli.run("mime", args)
+    assert exc.value.code == 1
+    assert yaml.safe_load(capsys.readouterr().out)["errors"] == [
+        "No UTI are registered for MIME type(s) 'x/unknown'."
+    ]
@@ -0,0 +1,784 @@
+import argparse
+import importlib.util
+import plistlib
+import threading
+import time
+
+import pytest
+import yaml
+
+from dooti.catalog import Catalog
+from dooti.cli import DootiCLI
+from dooti.dooti import ApplicationNotFound, Dooti, ExtHasNoRegisteredUTI
+from dooti.profiles import ProfileStore
+from dooti.watch import HANDLERS, Event
+from tests.helpers import FakeWorkspace, StubDooti
+
+bridge = pytest.mark.skipif(
+    importlib.util.find_spec("UniformTypeIdentifiers") is None,
+    reason="requires the ObjC bridge",
+)
+
+PREVIEW = "/System/Applications/Preview.app"
+TEXTEDIT = "/System/Applications/TextEdit.app"
+APPS = {
+    "Preview": PREVIEW,
+    "com.apple.Preview": PREVIEW,
+    "TextEdit": TEXTEDIT,
+    "com.apple.TextEdit": TEXTEDIT,
+}
+SIZE = 20
+
+
+@pytest.fixture
+def catalog():
+    tags = {
+        f"org.example.type{num}": {"ext": [f"ext{num}"], "mime": []}
+        for num in range(SIZE)
+    }
+    # one extension that is claimed by two UTI
+    tags["org.example.multi"] = {"ext": ["ext0"], "mime": []}
+    return Catalog(
+        extensions=(f"ext{num}" for num in range(SIZE)),
+        utis=tags,
+        parents={uti: ["public.data"] for uti in tags},
+        tags=tags,
+        exported=tags,
+    )
+
+
+@pytest.fixture
+def workspace():
+    return FakeWorkspace(
+        APPS, {f"org.example.type{num}": TEXTEDIT for num in range(SIZE)}
+    )
+
+
+@pytest.fixture
+def dooti(workspace, catalog):
+    return Dooti(workspace=workspace, catalog=catalog)
+
+
+@pytest.fixture
+def stub(workspace, catalog):
+    return StubDooti(workspace=workspace, catalog=catalog)
+
+
+@bridge
+def test_count_calls(dooti):
+    with Dooti.count_calls() as outer:
+        dooti.get_default_uti("org.example.type1")
+        with Dooti.count_calls() as inner:
+            dooti.get_default_scheme("fooobaar")
+    dooti.get_default_uti("org.example.type1")
+
+    assert outer == {
+        "importedTypeWithIdentifier_": 1,
+        "URLForApplicationToOpenContentType_": 1,
+        "fileSystemRepresentation": 1,
+        "URLWithString_": 1,
+        "URLForApplicationToOpenURL_": 1,
+    }
+    assert inner == {"URLWithString_": 1, "URLForApplicationToOpenURL_": 1}
+
+
+@bridge
+def test_handler_cache(workspace, catalog):
+    now = [0.0]
+    dooti = Dooti(
+        workspace=workspace, catalog=catalog, handler_ttl=60, clock=lambda: now[0]
+    )
+    with Dooti.count_calls() as tally:
+        assert dooti.get_default_uti("org.example.type1") == TEXTEDIT
+        assert dooti.get_default_ext("ext1") == TEXTEDIT
+        # confirmed writes are served without reading them back
+        dooti.set_default_uti("org.example.type1", PREVIEW)
+        assert dooti.get_default_uti("org.example.type1") == PREVIEW
+    assert tally["URLForApplicationToOpenContentType_"] == 1
+
+    workspace.handlers["org.example.type1"] = TEXTEDIT
+    assert dooti.get_default_ext("ext1") == PREVIEW
+    dooti.refresh_handlers(["ext:ext1"])
+    assert dooti.get_default_ext("ext1") == TEXTEDIT
+
+    workspace.handlers["org.example.type1"] = PREVIEW
+    now[0] = 59
+    assert dooti.get_default_uti("org.example.type1") == TEXTEDIT
+    now[0] = 60
+    assert dooti.get_default_uti("org.example.type1") == PREVIEW
+
+
+def test_cache_size(workspace, catalog):
+    dooti = StubDooti(workspace=workspace, catalog=catalog, cache_size=4)
+    for num in range(4):
+        assert dooti.get_default_ext(f"ext{num}") == TEXTEDIT
+    workspace.handlers.update({f"org.example.type{num}": PREVIEW for num in range(4)})
+    dooti.set_default_uti("org.example.type0", PREVIEW)
+    dooti.get_default_ext("ext4")
+
+    # pylint: disable-next=protected-access
+    assert len(dooti._handlers) == len(dooti._ext_cache) == 4
+    assert dooti.get_default_uti("org.example.type2") == TEXTEDIT
+    # the handler read longest ago was dropped and is read again
+    assert dooti.get_default_uti("org.example.type1") == PREVIEW
+
+
+def test_ext_falls_back_to_launchservices(stub, workspace, monkeypatch):
+    looked_up = []
+
+    def ext_to_utis(ext):
+        looked_up.append(ext)
+        return [f"com.vendor.{ext}"]
+
+    # bundles outside the scanned directories are only known to LaunchServices
+    monkeypatch.setattr(stub, "ext_to_utis", ext_to_utis)
+    stub.set_default_ext("vendor", "Preview")
+    stub.set_default_ext("ext1", "Preview")
+    assert workspace.handlers["com.vendor.vendor"] == PREVIEW
+    assert workspace.handlers["org.example.type1"] == PREVIEW
+    assert looked_up == ["vendor"]
+
+
+def test_write_rate_across_calls(workspace, catalog):
+    dooti = StubDooti(workspace=workspace, catalog=catalog, write_rate=50)
+    start = time.monotonic()
+    for num in range(SIZE):
+        dooti.set_default_uti(f"org.example.type{num}", PREVIEW)
+    # the burst of 16 writes is shared by all calls
+    assert time.monotonic() - start >= (SIZE - 16) / 50 * 0.9
+
+
+@bridge
+def test_set_default_ext_resolves_app_once(dooti, workspace):
+    with Dooti.count_calls() as tally:
+        dooti.set_default_ext("ext0", "Preview")
+    assert workspace.handlers["org.example.type0"] == PREVIEW
+    assert workspace.handlers["org.example.multi"] == PREVIEW
+    assert tally["setDefaultApplicationAtURL_toOpenContentType_completionHandler_"] == 2
+    assert tally["URLForApplicationWithBundleIdentifier_"] == 1
+    assert tally["fullPathForApplication_"] == 1
+
+
+@bridge
+def test_apply_ext_budget(dooti, workspace):
+    extensions = [f"ext{num}" for num in range(SIZE)]
+    cli = DootiCLI(assume_yes=True, dooti=dooti)
+    with Dooti.count_calls() as tally:
+        _, diff = cli.ext(extensions, handler="com.apple.Preview")
+        cli._apply_diff(diff)  # pylint: disable=protected-access
+
+    assert all(
+        workspace.handlers[f"org.example.type{num}"] == PREVIEW for num in range(SIZE)
+    )
+    # extensions are served from the catalog
+    assert tally["typesWithTag_tagClass_conformingToType_"] == 0
+    # one read per extension, the handler is resolved once
+    assert tally["URLForApplicationToOpenContentType_"] == SIZE
+    assert tally["URLForApplicationWithBundleIdentifier_"] == 1
+    # one write per UTI (ext0 has two)
+    assert (
+        tally["setDefaultApplicationAtURL_toOpenContentType_completionHandler_"]
+        == SIZE + 1
+    )
+
+
+@bridge
+def test_unknown_ext_budget(dooti):
+    extensions = [f"unknown{num}" for num in range(SIZE)]
+    cli = DootiCLI(assume_yes=True, dooti=dooti)
+    with Dooti.count_calls() as tally:
+        _, diff = cli.ext(extensions, dynamic=True, handler=PREVIEW)
+        cli._apply_diff(diff)  # pylint: disable=protected-access
+
+    # each unknown extension is looked up in LaunchServices exactly once
+    assert tally["typesWithTag_tagClass_conformingToType_"] == SIZE
+    assert tally["URLForApplicationToOpenContentType_"] == SIZE
+    assert tally["URLForApplicationWithBundleIdentifier_"] == 0
+    assert tally["fullPathForApplication_"] == 0
+
+
+def _app(path, bundle_id=None):
+    (path / "Contents").mkdir(parents=True)
+    info = {"CFBundleIdentifier": bundle_id} if bundle_id else {}
+    with open(path / "Contents" / "Info.plist", "wb") as f:
+        plistlib.dump(info, f)
+    return str(path)
+
+
+def test_same_handler(dooti, tmp_path):
+    first = _app(tmp_path / "Applications" / "Foo.app", "org.example.Foo")
+    copy = _app(tmp_path / "Other" / "Foo.app", "org.example.foo")
+    other = _app(tmp_path / "Applications" / "Bar.app", "org.example.bar")
+    unbundled = _app(tmp_path / "Applications" / "Baz.app")
+    link = tmp_path / "Link.app"
+    link.symlink_to(unbundled)
+
+    assert dooti.same_handler(first, first + "/")
+    assert dooti.same_handler(first, copy)
+    assert dooti.same_handler(unbundled, str(link))
+    assert not dooti.same_handler(first, other)
+    assert not dooti.same_handler(unbundled, other)
+    assert not dooti.same_handler(first, None)
+    assert dooti.same_handler(None, None)
+
+
+@bridge
+def test_steady_state_does_not_write(dooti, workspace, tmp_path):
+    app = _app(tmp_path / "TextEdit.app", "com.apple.TextEdit")
+    link = tmp_path / "Link.app"
+    link.symlink_to(app)
+    workspace.handlers.update({f"org.example.type{num}": app for num in range(SIZE)})
+    cli = DootiCLI(assume_yes=True, dooti=dooti)
+    _, diff = cli.uti(
+        [f"org.example.type{num}" for num in range(SIZE)], handler=str(link) + "/"
+    )
+    assert diff.to_dict() == {"utis": {}}
+
+
+@bridge
+def test_profile_switch_reads_delta(dooti, workspace, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    profiles = tmp_path / "config" / "dooti" / "profiles"
+    profiles.mkdir(parents=True)
+    (profiles / "work.yaml").write_text(
+        "app:\n  Preview:\n    uti: ["
+        + ", ".join(f"org.example.type{num}" for num in range(SIZE))
+        + "]\n",
+        encoding="utf-8",
+    )
+    (profiles / "home.yaml").write_text(
+        "uti:\n  org.example.type0: TextEdit\n"
+        "app:\n  Preview:\n    uti: ["
+        + ", ".join(f"org.example.type{num}" for num in range(1, SIZE))
+        + "]\n",
+        encoding="utf-8",
+    )
+
+    def switch(name):
+        cli = DootiCLI(assume_yes=True, dooti=dooti)
+        with Dooti.count_calls() as tally:
+            # pylint: disable-next=protected-access
+            with cli._serialize("profile", argparse.Namespace(action="use")):
+                _, diff = cli.profile("use", name)
+                cli._apply_diff(diff)  # pylint: disable=protected-access
+        return cli, tally
+
+    cli, tally = switch("work")
+    assert len(cli.changes) == SIZE
+    assert tally["URLForApplicationToOpenContentType_"] == SIZE
+
+    cli, tally = switch("home")
+    assert cli.changes.to_dict()["utis"] == {
+        "org.example.type0": {"from": PREVIEW, "to": TEXTEDIT}
+    }
+    # only the target the profiles disagree on is read
+    assert tally["URLForApplicationToOpenContentType_"] == 1
+    assert workspace.handlers["org.example.type1"] == PREVIEW
+
+    cli, tally = switch("home")
+    # switching to the active profile checks every target
+    assert tally["URLForApplicationToOpenContentType_"] == SIZE
+    assert not cli.changes
+
+
+def test_failed_profile_switch_is_not_active(stub, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    profiles = tmp_path / "config" / "dooti" / "profiles"
+    profiles.mkdir(parents=True)
+    (profiles / "work.yaml").write_text(
+        "uti:\n  org.example.type1: Preview\n  org.example.type2: NoSuchApp\n",
+        encoding="utf-8",
+    )
+    cli = DootiCLI(assume_yes=True, dooti=stub)
+    # pylint: disable-next=protected-access
+    with cli._serialize("profile", argparse.Namespace(action="use")):
+        _, diff = cli.profile("use", "work")
+        cli._apply_diff(diff)  # pylint: disable=protected-access
+    assert stub.workspace.handlers["org.example.type1"] == PREVIEW
+    assert "NoSuchApp" in cli.errors[0]
+    # the next switch must not assume the profile is in place
+    assert ProfileStore().active() is None
+
+
+def test_profile_recompiled_for_catalog(workspace, catalog, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    profiles = tmp_path / "config" / "dooti" / "profiles"
+    profiles.mkdir(parents=True)
+    # compiled plans are discarded when their handlers do not exist
+    app = tmp_path / "Preview.app"
+    app.mkdir()
+    (profiles / "work.yaml").write_text(f"ext:\n  ext1: {app}\n", encoding="utf-8")
+
+    def switch(catalog):
+        cli = DootiCLI(assume_yes=True, dooti=StubDooti(workspace, catalog))
+        cli.profile("use", "work")
+        return set(ProfileStore().compiled("work")["utis"])
+
+    catalog.fingerprint = "before"
+    assert switch(catalog) == {"org.example.type1"}
+    # an update declares another type for the file extension
+    tags = {"org.example.renamed": {"ext": ["ext1"], "mime": []}}
+    updated = Catalog(extensions=["ext1"], utis=tags, tags=tags, exported=tags)
+    updated.fingerprint = "after"
+    assert switch(updated) == {"org.example.renamed"}
+
+
+@bridge
+def test_unchanged_run_skips_reads(dooti, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("HOME", str(tmp_path))
+    file = tmp_path / "config.yaml"
+    file.write_text("app:\n  Preview:\n    ext: [ext1, ext2]\n", encoding="utf-8")
+
+    def apply(**kwargs):
+        cli = DootiCLI(assume_yes=True, dooti=dooti)
+        with Dooti.count_calls() as tally:
+            # pylint: disable-next=protected-access
+            with cli._serialize("apply_", argparse.Namespace()):
+                _, diff = cli.apply_(file=file, **kwargs)
+                cli._apply_diff(diff)  # pylint: disable=protected-access
+        return tally
+
+    assert apply()["URLForApplicationToOpenContentType_"] == 2
+    assert not apply()
+    assert apply(force=True)["URLForApplicationToOpenContentType_"] == 2
+    assert apply(verify_interval=0)["URLForApplicationToOpenContentType_"] == 2
+
+    prefs = tmp_path / "Library" / "Preferences" / "com.apple.LaunchServices"
+    prefs.mkdir(parents=True)
+    (prefs / "com.apple.launchservices.secure.plist").touch()
+    assert apply()["URLForApplicationToOpenContentType_"] == 2
+    assert not apply()
+
+
+def test_unchanged_run_skips_bridge(stub, workspace, catalog, tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    monkeypatch.setenv("HOME", str(tmp_path))
+    file = tmp_path / "config.yaml"
+    file.write_text("app:\n  Preview:\n    ext: [ext1, ext2]\n", encoding="utf-8")
+
+    class Denied:
+        @staticmethod
+        def localizedDescription():  # pylint: disable=invalid-name
+            return "denied"
+
+    class Unconfirmed(StubDooti):
+        def _set_uti_handler(self, uti, path, completion=None):
+            completion(Denied())
+
+    def apply(dooti=None):
+        cli = DootiCLI(assume_yes=True, dooti=dooti)
+        # pylint: disable-next=protected-access
+        with cli._serialize("apply_", argparse.Namespace()):
+            _, diff = cli.apply_(file=file)
+            cli._apply_diff(diff)  # pylint: disable=protected-access
+        return cli
+
+    assert apply(Unconfirmed(workspace=workspace, catalog=catalog)).errors
+    # the failed run did not record the state, so the next one checks again
+    cli = apply(stub)
+    assert not cli.skipped
+    assert workspace.handlers["org.example.type1"] == PREVIEW
+
+    def unexpected(*args, **kwargs):
+        raise AssertionError("Dooti was created")
+
+    monkeypatch.setattr("dooti.cli.Dooti", unexpected)
+    assert apply().skipped
+
+
+@bridge
+def test_apply_selection(dooti, workspace, tmp_path):
+    file = tmp_path / "config.yaml"
+    file.write_text(
+        "uti:\n  org.example.type3: Preview\n"
+        "app:\n  Preview:\n    ext: [ext1, ext2]\n"
+        "  TextEdit:\n    uti: [org.example.type3, org.example.type4]\n",
+        encoding="utf-8",
+    )
+
+    def apply(**kwargs):
+        cli = DootiCLI(assume_yes=True, dooti=dooti)
+        dooti.refresh_handlers()
+        with Dooti.count_calls() as tally:
+            _, diff = cli.apply_(file=file, **kwargs)
+        return diff.to_dict()["utis"], tally
+
+    changes, tally = apply(only=["ext:ext1,uti:org.example.type3"])
+    # type3 is already handled by TextEdit, whose entry takes effect
+    assert set(changes) == {"org.example.type1"}
+    assert tally["URLForApplicationToOpenContentType_"] == 2
+
+    changes, tally = apply(app=["com.apple.Preview"])
+    assert set(changes) == {"org.example.type1", "org.example.type2"}
+    assert tally["URLForApplicationToOpenContentType_"] == 2
+
+    changes, tally = apply(only=["org.example.type4"], app=["Preview"])
+    assert not changes
+    assert not tally["URLForApplicationToOpenContentType_"]
+
+
+def test_apply_selection_errors(stub, tmp_path, monkeypatch):
+    file = tmp_path / "config.yaml"
+    file.write_text(
+        "ext:\n  ext1: Preview\n  ext99: TextEdit\n  ext98: Preview\n",
+        encoding="utf-8",
+    )
+    looked_up = []
+    monkeypatch.setattr(
+        stub, "ext_to_utis", lambda ext: looked_up.append(ext) or [f"dyn.{ext}"]
+    )
+
+    def apply(**kwargs):
+        cli = DootiCLI(assume_yes=True, dooti=stub)
+        _, diff = cli.apply_(file=file, **kwargs)
+        return set(diff.to_dict()["utis"]), cli.errors
+
+    # unrelated unregistered extensions are neither looked up nor reported
+    assert apply(only=["ext1"]) == ({"org.example.type1"}, [])
+    assert not looked_up
+    changes, errors = apply(only=["ext:ext99"])
+    assert not changes
+    assert ["ext99"] == [err.split("'")[1] for err in errors]
+    assert apply(app=["TextEdit"])[1] == errors
+    changes, errors = apply(app=["Preview"])
+    assert changes == {"org.example.type1"}
+    assert ["ext98"] == [err.split("'")[1] for err in errors]
+
+
+def test_snapshot_round_trip(stub, workspace, catalog, tmp_path):
+    catalog.schemes.update(("mailto", "file"))
+    workspace.handlers.update(
+        {
+            "org.example.type1": PREVIEW,
+            # differs from the handler of ext0, which is that of type0
+            "org.example.multi": PREVIEW,
+            "mailto": TEXTEDIT,
+        }
+    )
+    before = dict(workspace.handlers)
+    snapshot = tmp_path / "snapshot.yaml"
+    counts, _ = DootiCLI(dooti=stub).snapshot(snapshot)
+    assert counts == {"ext": SIZE, "scheme": 1, "uti": SIZE + 1}
+
+    cli = DootiCLI(assume_yes=True, dooti=StubDooti(workspace, catalog))
+    _, diff = cli.apply_(file=snapshot)
+    assert not diff
+    cli._apply_diff(diff)  # pylint: disable=protected-access
+    assert not cli.errors
+    assert workspace.handlers == before
+
+    again = tmp_path / "again.yaml"
+    DootiCLI(dooti=StubDooti(workspace, catalog)).snapshot(again)
+    diff, _ = DootiCLI(dooti=stub).diff(snapshot, again)
+    assert diff == {"utis": {}, "schemes": {}}
+
+
+def test_apply_follows_precedence(stub, workspace, tmp_path):
+    workspace.handlers.update(
+        {f"org.example.type{num}": PREVIEW for num in range(SIZE)}
+    )
+    file = tmp_path / "config.yaml"
+    file.write_text(
+        "conforms:\n  public.data: TextEdit\n"
+        "ext:\n  ext1: Preview\n"
+        "app:\n  Preview:\n    ext: [ext2]\n",
+        encoding="utf-8",
+    )
+    cli = DootiCLI(assume_yes=True, dooti=stub)
+    _, diff = cli.apply_(file=file)
+    cli._apply_diff(diff)  # pylint: disable=protected-access
+
+    assert not cli.errors
+    # file extensions are applied after the conforming types they override
+    assert "org.example.type1" not in diff.to_dict()["utis"]
+    assert workspace.handlers["org.example.type1"] == PREVIEW
+    assert workspace.handlers["org.example.type2"] == PREVIEW
+    assert workspace.handlers["org.example.type3"] == TEXTEDIT
+    explained, _ = cli.explain(["ext1", "ext2", "ext3"], file=file)
+    assert all(target["in_effect"] for target in explained.values())
+
+
+def test_apply_scope_precedence(stub, workspace, tmp_path):
+    workspace.handlers.clear()
+    file = tmp_path / "config.yaml"
+    # sections are applied by scope, not in the order they are written
+    file.write_text(
+        "uti:\n  org.example.type1: TextEdit\n"
+        "ext:\n  ext1: Preview\n  ext2: Preview\n  ext3: Preview\n"
+        "conforms:\n  public.data: TextEdit\n"
+        "app:\n  TextEdit:\n    ext: [ext2]\n",
+        encoding="utf-8",
+    )
+    cli = DootiCLI(assume_yes=True, dooti=stub)
+    _, diff = cli.apply_(file=file)
+    cli._apply_diff(diff)  # pylint: disable=protected-access
+
+    assert not cli.errors
+    assert workspace.handlers["org.example.type0"] == TEXTEDIT
+    assert workspace.handlers["org.example.type1"] == TEXTEDIT
+    assert workspace.handlers["org.example.type2"] == TEXTEDIT
+    assert workspace.handlers["org.example.type3"] == PREVIEW
+
+
+def test_apply_reports_entries(stub, tmp_path, monkeypatch, capsys):
+    file = tmp_path / "config.yaml"
+    file.write_text(
+        "ext:\n  ext0: Preview\n  /^ext[12]$/: Preview\n"
+        "uti:\n  org.example.type2: TextEdit\n  org.example.type3: Preview\n",
+        encoding="utf-8",
+    )
+    monkeypatch.setattr("builtins.input", lambda _: "n")
+    cli = DootiCLI(dooti=stub)
+    _, diff = cli.apply_(file=file)
+    cli._apply_diff(diff)  # pylint: disable=protected-access
+    # both UTI of ext0 are reported once, type2 is not changed
+    assert "ext0: /System/Applications/TextEdit.app" in capsys.readouterr().out
+
+    cli = DootiCLI(assume_yes=True, dooti=stub)
+    _, diff = cli.apply_(file=file)
+    cli._apply_diff(diff)  # pylint: disable=protected-access
+    assert cli.changes.to_dict() == {
+        "extensions": {
+            "ext0": {"from": TEXTEDIT, "to": PREVIEW},
+            "ext1": {"from": TEXTEDIT, "to": PREVIEW},
+        },
+        "schemes": {},
+        "utis": {"org.example.type3": {"from": TEXTEDIT, "to": PREVIEW}},
+    }
+    assert stub.workspace.handlers["org.example.multi"] == PREVIEW
+    assert stub.workspace.handlers["org.example.type2"] == TEXTEDIT
+
+
+def test_explain_matches_apply(stub, workspace, tmp_path):
+    file = tmp_path / "config.yaml"
+    file.write_text(
+        "conforms:\n  public.data: TextEdit\n"
+        "ext:\n  ext1: TextEdit\n  /^ext[12]$/: Preview\n"
+        "app:\n  TextEdit:\n    uti: [org.example.type2]\n",
+        encoding="utf-8",
+    )
+    cli = DootiCLI(assume_yes=True, dooti=stub)
+    explained, _ = cli.explain(["ext1", "uti:org.example.type2"], file=file)
+
+    assert explained["org.example.type1"]["effective"]["location"] == "ext"
+    assert explained["org.example.type1"]["effective"]["entry"] == "/^ext[12]$/"
+    assert [
+        claim["entry"] for claim in explained["org.example.type1"]["overridden"]
+    ] == [
+        "ext1",
+        "public.data",
+    ]
+    assert explained["org.example.type2"]["effective"]["location"] == "app.TextEdit.uti"
+    assert not explained["org.example.type1"]["in_effect"]
+
+    _, diff = cli.apply_(file=file)
+    cli._apply_diff(diff)  # pylint: disable=protected-access
+    explained, _ = cli.explain(["org.example.type1", "org.example.type2"], file=file)
+    assert workspace.handlers["org.example.type1"] == PREVIEW
+    assert workspace.handlers["org.example.type2"] == TEXTEDIT
+    assert all(target["in_effect"] for target in explained.values())
+
+
+def test_explain_missing_handler(stub, tmp_path):
+    file = tmp_path / "config.yaml"
+    file.write_text("uti:\n  org.example.multi: NoSuchApp\n", encoding="utf-8")
+    cli = DootiCLI(dooti=stub)
+    explained, _ = cli.explain(["uti:org.example.multi"], file=file)
+    # neither the claim nor the current handler resolve to an application
+    assert explained["org.example.multi"]["current"] is None
+    assert explained["org.example.multi"]["effective"]["path"] is None
+    assert not explained["org.example.multi"]["in_effect"]
+
+
+def test_enforce(stub, workspace, tmp_path, monkeypatch, capsys):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    file = tmp_path / "config.yaml"
+    file.write_text("app:\n  Preview:\n    ext: [ext1, ext2]\n", encoding="utf-8")
+    recorded = []
+
+    class Runs:
+        """
+        Replaces the schedule with four runs, changing the system in between.
+        """
+
+        offset = 0
+
+        def __init__(self, interval, jitter):
+            assert (interval, jitter) == (900, 300)
+            self.failures = 0
+
+        def __iter__(self):
+            yield Event(HANDLERS)
+            workspace.handlers["org.example.type1"] = TEXTEDIT
+            yield Event(HANDLERS)
+            file.write_text("app:\n  NoSuchApp:\n    ext: [ext1]\n", encoding="utf-8")
+            yield Event(HANDLERS)
+            yield Event(HANDLERS)
+
+        def record(self, failed):
+            recorded.append(failed)
+            self.failures = self.failures + 1 if failed else 0
+
+    monkeypatch.setattr("dooti.cli.Schedule", Runs)
+    monkeypatch.setattr(stub, "refresh", lambda: recorded.append("refresh"))
+    cli = DootiCLI(dooti=stub)
+    cli.enforce(file=file, interval=900, jitter=300)
+
+    # a missing application is not retried sooner and keeps the caches
+    assert recorded == [False, False, False, False]
+    # handlers are resolved once and kept until the configuration changes,
+    # writes only pass the paths they were resolved to
+    assert [app for app in stub.resolved if not app.startswith("/")] == [
+        "Preview",
+        "NoSuchApp",
+    ]
+    runs = list(yaml.safe_load_all(capsys.readouterr().out))
+    assert set(runs[0]["changes"]["utis"]) == {"org.example.type1", "org.example.type2"}
+    assert runs[1]["changes"]["utis"] == {
+        "org.example.type1": {"from": TEXTEDIT, "to": PREVIEW}
+    }
+    assert len(runs) == 3
+    assert "NoSuchApp" in runs[2]["errors"][0]
+    assert cli.errors == runs[2]["errors"]
+
+
+def test_enforce_unreadable_config(stub, tmp_path, monkeypatch):
+    file = tmp_path / "config.yaml"
+    file.write_text("app:\n  Preview:\n    ext: [ext1]\n", encoding="utf-8")
+    recorded = []
+
+    class Runs:
+        """
+        Replaces the schedule with two runs, removing the configuration in between.
+        """
+
+        offset = 0
+        failures = 0
+
+        def __init__(self, interval, jitter):
+            pass
+
+        def __iter__(self):
+            yield Event(HANDLERS)
+            file.unlink()
+            yield Event(HANDLERS)
+
+        def record(self, failed):
+            recorded.append(failed)
+
+    monkeypatch.setattr("dooti.cli.Schedule", Runs)
+    cli = DootiCLI(dooti=stub)
+    cli.enforce(file=file)
+
+    assert recorded == [False, True]
+    assert "No such file" in cli.errors[0]
+
+
+class DeferredWorkspace(FakeWorkspace):
+    """
+    Confirms writes from another thread after a delay
+    and records the maximum number of unconfirmed writes.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.pending = 0
+        self.max_pending = 0
+        self.lock = threading.Lock()
+
+    def setDefaultApplicationAtURL_toOpenContentType_completionHandler_(
+        self, app, uti, handler
+    ):
+        with self.lock:
+            self.pending += 1
+            self.max_pending = max(self.max_pending, self.pending)
+
+        def confirm():
+            with self.lock:
+                self.pending -= 1
+            super(  # pylint: disable=super-with-arguments
+                DeferredWorkspace, self
+            ).setDefaultApplicationAtURL_toOpenContentType_completionHandler_(
+                app, uti, handler
+            )
+
+        threading.Timer(0.01, confirm).start()
+
+
+@bridge
+def test_set_defaults(catalog):
+    workspace = DeferredWorkspace(APPS)
+    dooti = Dooti(workspace=workspace, catalog=catalog)
+    handlers = {f"uti:org.example.type{num}": "Preview" for num in range(SIZE)}
+    handlers.update(
+        {
+            "ext:ext0": "com.apple.TextEdit",
+            "ext:unknown": "Preview",
+            "scheme:foo": "TextEdit",
+            "public.missing": "NoSuchApp",
+        }
+    )
+    with Dooti.count_calls() as tally:
+        results = dooti.set_defaults(handlers, max_in_flight=4)
+
+    assert workspace.max_pending <= 4
+    assert workspace.pending == 0
+    # each of the four distinct handlers is resolved once
+    assert tally["URLForApplicationWithBundleIdentifier_"] == 4
+    assert isinstance(results.pop("ext:unknown"), ExtHasNoRegisteredUTI)
+    assert isinstance(results.pop("public.missing"), ApplicationNotFound)
+    assert set(results.values()) == {None}
+    assert workspace.handlers["org.example.type0"] == TEXTEDIT
+    assert workspace.handlers["org.example.multi"] == TEXTEDIT
+    assert workspace.handlers["org.example.type1"] == PREVIEW
+    assert workspace.handlers["foo"] == TEXTEDIT
+
+
+@bridge
+def test_candidates(catalog, tmp_path):
+    def app(name, rank, role="Viewer"):
+        path = tmp_path / f"{name}.app"
+        (path / "Contents").mkdir(parents=True)
+        info = {
+            "CFBundleIdentifier": f"org.example.{name}",
+            "CFBundleDocumentTypes": [
+                {
+                    "LSItemContentTypes": ["org.example.type0"],
+                    "LSHandlerRank": rank,
+                    "CFBundleTypeRole": role,
+                }
+            ],
+        }
+        with open(path / "Contents" / "Info.plist", "wb") as f:
+            plistlib.dump(info, f)
+        return str(path)
+
+    alternate = app("Alternate", "Alternate", "Editor")
+    viewer = app("Viewer", "Owner")
+    editor = app("Editor", "Owner", "Editor")
+    current = app("Current", "Alternate")
+    workspace = FakeWorkspace(
+        APPS,
+        {"org.example.type0": current},
+        {"org.example.type0": [alternate, viewer, current, editor]},
+    )
+    dooti = Dooti(workspace=workspace, catalog=catalog)
+
+    ranked = [current, editor, viewer, alternate]
+    assert dooti.get_candidates(["org.example.type0", "uti:org.example.type1"]) == {
+        "org.example.type0": ranked,
+        "uti:org.example.type1": [],
+    }
+    with Dooti.count_calls() as tally:
+        assert dooti.get_candidates(["uti:org.example.type0"]) == {
+            "uti:org.example.type0": ranked
+        }
+    assert not tally
+
+    cli = DootiCLI(dooti=dooti)
+    candidates, _ = cli.candidates(["ext0"])
+    assert candidates["org.example.type0"] == ranked
@@ -0,0 +1,51 @@
+import threading
+
+import pytest
+
+from dooti.lock import ApplyLock, LockTimeout
+
+
+def test_lock_times_out(tmp_path):
+    with ApplyLock(tmp_path):
+        with pytest.raises(LockTimeout):
+            ApplyLock(tmp_path, timeout=0.2).acquire()
+
+
+def test_waiting_run_is_coalesced(tmp_path):
+    result = {}
+    holder = ApplyLock(tmp_path)
+    holder.acquire()
+
+    def wait():
+        with ApplyLock(tmp_path) as waiter:
+            result["same"] = waiter.coalesced("abc")
+            result["other"] = waiter.coalesced("def")
+
+    thread = threading.Thread(target=wait)
+    thread.start()
+    thread.join(0.3)
+    assert thread.is_alive()
+    holder.record("abc", ["some error"])
+    holder.release()
+    thread.join(5)
+
+    assert result["same"]["errors"] == ["some error"]
+    assert result["other"] is None
+
+
+def test_earlier_run_is_not_coalesced(tmp_path):
+    with ApplyLock(tmp_path) as lock:
+        lock.record("abc")
+    with ApplyLock(tmp_path) as lock:
+        assert lock.coalesced("abc") is None
+        assert lock.last_run()["config"] == "abc"
+
+
+def test_fingerprint(tmp_path):
+    with ApplyLock(tmp_path) as lock:
+        lock.record("abc", fingerprint={"launchservices": 1})
+        assert lock.fingerprint("abc", 60) == {"launchservices": 1}
+        assert lock.fingerprint("def", 60) is None
+        assert lock.fingerprint("abc", -1) is None
+        lock.record("abc", ["some error"], {"launchservices": 1})
+        assert lock.fingerprint("abc", 60) is None
@@ -0,0 +1,30 @@
+from dooti.profiles import ProfileStore
+
+
+def test_names_and_active(tmp_path):
+    store = ProfileStore(tmp_path / "profiles", tmp_path / "cache")
+    assert store.names() == []
+    assert store.active() is None
+    (tmp_path / "profiles").mkdir()
+    (tmp_path / "profiles" / "work.yaml").touch()
+    (tmp_path / "profiles" / "home.yml").touch()
+    store.set_active("work")
+    assert store.names() == ["home", "work"]
+    assert store.find("home") == tmp_path / "profiles" / "home.yml"
+    assert store.active() == "work"
+
+
+def test_compiled_is_invalidated(tmp_path):
+    store = ProfileStore(tmp_path / "profiles", tmp_path / "cache")
+    app = tmp_path / "Foo.app"
+    app.mkdir()
+    targets = {"utis": {"public.plain-text": str(app)}, "schemes": {}}
+    store.save("work", "abc", targets)
+
+    assert store.compiled("work", "abc") == targets
+    assert store.compiled("work") == targets
+    # the profile was changed
+    assert store.compiled("work", "def") is None
+    # a handler was uninstalled
+    app.rmdir()
+    assert store.compiled("work", "abc") is None
@@ -0,0 +1,143 @@
+import threading
+
+import pytest
+
+from dooti.dooti import HandlerNotSet, WriteScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeError:
+    @staticmethod
+    def localizedDescription():  # pylint: disable=invalid-name
+        return "denied"
+
+
+class Recorder:
+    """
+    Records writes and confirms them immediately, failing some targets.
+    """
+
+    def __init__(self, clock=None, fail=()):
+        self.clock = clock
+        self.fail = fail
+        self.writes = []
+
+    def __call__(self, target, path, completion):
+        self.writes.append((target, path, self.clock() if self.clock else None))
+        completion(FakeError() if target in self.fail else None)
+
+
+def test_rate_limit():
+    clock = FakeClock()
+    write = Recorder(clock)
+    scheduler = WriteScheduler(rate=2, burst=2, clock=clock, sleep=clock.sleep)
+    for num in range(6):
+        scheduler.submit(f"uti:type{num}", write, f"type{num}", "/App.app")
+    assert set(scheduler.run().values()) == {None}
+    assert [time for *_, time in write.writes] == pytest.approx([0, 0, 0.5, 1, 1.5, 2])
+    stats = scheduler.stats
+    assert stats.submitted == 6
+    assert stats.dispatched == 6
+    assert stats.max_depth == 6
+    assert stats.max_wait == pytest.approx(2)
+    assert stats.mean_wait == pytest.approx(5 / 6)
+
+
+def test_prompting_schemes_first_and_coalesced():
+    write = Recorder(fail=("public.html",))
+    scheduler = WriteScheduler()
+    scheduler.submit("uti:public.html", write, "public.html", "/Safari.app")
+    scheduler.submit("scheme:mailto", write, "mailto", "/Mail.app")
+    scheduler.submit("scheme:http", write, "http", "/Firefox.app", priority=0)
+    # supersedes the first write
+    scheduler.submit("ext:html", write, "public.html", "/Firefox.app")
+    results = scheduler.run()
+
+    assert write.writes == [
+        ("http", "/Firefox.app", None),
+        ("mailto", "/Mail.app", None),
+        ("public.html", "/Firefox.app", None),
+    ]
+    assert results["scheme:http"] is None
+    assert isinstance(results["uti:public.html"], HandlerNotSet)
+    assert isinstance(results["ext:html"], HandlerNotSet)
+    assert scheduler.stats.coalesced == 1
+
+
+def test_concurrency_cap():
+    lock = threading.Lock()
+    pending = []
+    timers = []
+
+    def write(target, path, completion):  # pylint: disable=unused-argument
+        with lock:
+            pending.append(target)
+
+        def confirm():
+            with lock:
+                pending.remove(target)
+            completion(None)
+
+        timer = threading.Timer(0.005, confirm)
+        timers.append(timer)
+        timer.start()
+
+    scheduler = WriteScheduler(max_in_flight=3)
+    for num in range(20):
+        scheduler.submit(f"uti:type{num}", write, f"type{num}", "/App.app")
+    assert set(scheduler.run().values()) == {None}
+    assert not pending
+    assert 1 <= scheduler.stats.max_in_flight <= 3
+
+
+def test_on_confirm():
+    write = Recorder(fail=("public.html",))
+    confirmed = []
+    scheduler = WriteScheduler(
+        on_confirm=lambda *args: confirmed.append(args),
+    )
+    scheduler.submit("uti:public.html", write, "public.html", "/Safari.app")
+    scheduler.submit("scheme:http", write, "http", "/Firefox.app")
+    scheduler.run()
+    # only confirmed writes are reported
+    assert confirmed == [(("scheme:http",), "http", "/Firefox.app")]
+
+
+def test_unconfirmed_writes_time_out():
+    written = []
+
+    def write(target, path, completion):  # pylint: disable=unused-argument
+        written.append(target)
+        # LaunchServices never confirms type1
+        if "type1" != target:
+            completion(None)
+
+    scheduler = WriteScheduler(max_in_flight=1, timeout=0.01)
+    for num in range(3):
+        scheduler.submit(f"uti:type{num}", write, f"type{num}", "/App.app")
+    results = scheduler.run()
+
+    assert results["uti:type0"] is None
+    assert isinstance(results["uti:type1"], HandlerNotSet)
+    # not dispatched since the slot of type1 was never released
+    assert isinstance(results["uti:type2"], HandlerNotSet)
+    assert written == ["type0", "type1"]
+    # writes that were not dispatched were not superseded either
+    assert scheduler.stats.dispatched == 2
+    assert scheduler.stats.coalesced == 0
+
+    scheduler = WriteScheduler(timeout=0.01)
+    for num in range(3):
+        scheduler.submit(f"uti:type{num}", write, f"type{num}", "/App.app")
+    results = scheduler.run()
+    assert [key for key, error in results.items() if error] == ["uti:type1"]
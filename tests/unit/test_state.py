@@ -0,0 +1,96 @@
+from dooti.state import Change, HandlerState
+
+PREVIEW = "/System/Applications/Preview.app"
+TEXTEDIT = "/System/Applications/TextEdit.app"
+
+
+def _same(current, wanted):
+    return current == wanted
+
+
+def test_compare():
+    state = HandlerState.compare(
+        "utis",
+        (
+            ("public.png", PREVIEW, TEXTEDIT),
+            ("public.jpeg", TEXTEDIT, TEXTEDIT),
+            ("public.heic", None, TEXTEDIT),
+        ),
+        _same,
+    )
+    assert list(state) == [
+        ("utis", "public.png", Change(PREVIEW, TEXTEDIT)),
+        ("utis", "public.heic", Change(None, TEXTEDIT)),
+    ]
+    assert len(state) == 2
+    assert state.to_dict() == {
+        "utis": {
+            "public.png": {"from": PREVIEW, "to": TEXTEDIT},
+            "public.heic": {"from": None, "to": TEXTEDIT},
+        }
+    }
+
+
+def test_paths_are_interned():
+    state = HandlerState.compare(
+        "utis",
+        ((f"org.example.type{num}", "".join(PREVIEW), TEXTEDIT) for num in range(3)),
+        _same,
+    )
+    olds = {id(change.old) for _, _, change in state}
+    assert len(olds) == 1
+
+
+def test_merge_later_takes_precedence():
+    first = HandlerState.compare(
+        "utis",
+        (("public.png", PREVIEW, TEXTEDIT), ("public.jpeg", PREVIEW, TEXTEDIT)),
+        _same,
+    )
+    # a later definition that matches the current state drops the change
+    second = HandlerState.compare("utis", (("public.png", PREVIEW, PREVIEW),), _same)
+    schemes = HandlerState.compare("schemes", (("http", None, PREVIEW),), _same)
+
+    merged = HandlerState.merge(
+        iter((first, second, schemes)), kinds=("extensions", "utis")
+    )
+    assert merged.to_dict() == {
+        "extensions": {},
+        "utis": {"public.jpeg": {"from": PREVIEW, "to": TEXTEDIT}},
+        "schemes": {"http": {"from": None, "to": PREVIEW}},
+    }
+    # merging does not modify its inputs
+    assert len(first) == 2
+
+
+def test_without():
+    state = HandlerState.compare(
+        "schemes", (("http", None, PREVIEW), ("https", None, PREVIEW)), _same
+    )
+    assert state.without({("schemes", "http")}).to_dict() == {
+        "schemes": {"https": {"from": None, "to": PREVIEW}}
+    }
+    assert not state.without({("schemes", "http"), ("schemes", "https")})
+    assert not HandlerState()
+
+
+def test_rekey():
+    state = HandlerState.compare(
+        "utis",
+        (
+            ("public.jpeg", PREVIEW, TEXTEDIT),
+            ("public.jpeg-2000", None, TEXTEDIT),
+            ("public.png", PREVIEW, TEXTEDIT),
+        ),
+        _same,
+    )
+    sources = {"public.jpeg": "jpg", "public.jpeg-2000": "jpg"}
+    rekeyed = state.rekey(
+        lambda kind, target: (
+            ("extensions", sources[target]) if target in sources else (kind, target)
+        )
+    )
+    assert rekeyed.to_dict() == {
+        "utis": {"public.png": {"from": PREVIEW, "to": TEXTEDIT}},
+        "extensions": {"jpg": {"from": PREVIEW, "to": TEXTEDIT}},
+    }
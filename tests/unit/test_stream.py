@@ -0,0 +1,205 @@
+import json
+import logging
+
+import pytest
+import yaml
+
+from dooti.catalog import Catalog
+from dooti.cli import DootiCLI
+from dooti.stream import iter_entries
+from tests.helpers import FakeWorkspace, StubDooti
+
+PREVIEW = "/System/Applications/Preview.app"
+TEXTEDIT = "/System/Applications/TextEdit.app"
+
+CONFIG = """
+ext:
+  py: Sublime Text
+  "7z": Archive Utility
+unknown:
+  nested: [1, 2]
+scheme:
+  http: Firefox
+app:
+  Preview:
+    ext:
+      - pdf
+      - png
+    other: ignored
+    uti:
+      - public.image
+"""
+
+
+def test_yaml_entries_in_document_order(tmp_path):
+    file = tmp_path / "config.yaml"
+    file.write_text(CONFIG, encoding="utf-8")
+    assert list(iter_entries(file)) == [
+        ("ext", "ext", "py", "Sublime Text"),
+        ("ext", "ext", "7z", "Archive Utility"),
+        ("scheme", "scheme", "http", "Firefox"),
+        ("app.Preview.ext", "ext", "pdf", "Preview"),
+        ("app.Preview.ext", "ext", "png", "Preview"),
+        ("app.Preview.uti", "uti", "public.image", "Preview"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "config",
+    (
+        "- ext",
+        "ext:\n  - py",
+        "ext:\n  py:\n    - Preview",
+        "app:\n  Preview:\n    ext: pdf",
+        "ext:\n  py: &app Preview\n  rst: *app",
+    ),
+)
+def test_invalid_yaml(tmp_path, config):
+    file = tmp_path / "config.yaml"
+    file.write_text(config, encoding="utf-8")
+    with pytest.raises(ValueError, match="Invalid configuration"):
+        list(iter_entries(file))
+
+
+def test_jsonl_entries(tmp_path):
+    file = tmp_path / "config.jsonl"
+    file.write_text(
+        json.dumps({"scope": "ext", "target": "py", "handler": "Sublime Text"})
+        + "\n\n"
+        + json.dumps({"scope": "scheme", "target": "http", "handler": "Firefox"})
+        + "\n",
+        encoding="utf-8",
+    )
+    assert list(iter_entries(file)) == [
+        ("ext", "ext", "py", "Sublime Text"),
+        ("scheme", "scheme", "http", "Firefox"),
+    ]
+
+
+@pytest.mark.parametrize(
+    "line",
+    (
+        "not json",
+        '{"scope": "ext", "target": "py"}',
+        '{"scope": "app", "target": "py", "handler": "Preview"}',
+    ),
+)
+def test_invalid_jsonl(tmp_path, line):
+    file = tmp_path / "config.ndjson"
+    file.write_text(line + "\n", encoding="utf-8")
+    with pytest.raises(ValueError, match="line 1"):
+        list(iter_entries(file))
+
+
+@pytest.fixture
+def stub():
+    tags = {
+        "public.python-script": {"ext": ["py"], "mime": []},
+        "net.daringfireball.markdown": {"ext": ["md"], "mime": []},
+    }
+    catalog = Catalog(extensions=("py", "md"), utis=tags, tags=tags, exported=tags)
+    workspace = FakeWorkspace(
+        {"Preview": PREVIEW, "TextEdit": TEXTEDIT},
+        {"public.python-script": TEXTEDIT},
+    )
+    return StubDooti(workspace=workspace, catalog=catalog)
+
+
+def _jsonl(tmp_path, *entries):
+    file = tmp_path / "config.jsonl"
+    file.write_text(
+        "".join(
+            json.dumps({"scope": scope, "target": target, "handler": handler}) + "\n"
+            for scope, target, handler in entries
+        ),
+        encoding="utf-8",
+    )
+    return file
+
+
+def test_apply_in_chunks(tmp_path, stub, capsys, caplog):
+    file = _jsonl(
+        tmp_path,
+        ("ext", "py", "Preview"),
+        ("ext", "md", "TextEdit"),
+        ("uti", "public.python-script", "Preview"),
+        ("scheme", "http", "Preview"),
+        ("ext", "py", "TextEdit"),
+    )
+    cli = DootiCLI(assume_yes=True, dooti=stub)
+    with caplog.at_level(logging.INFO, logger="dooti.cli"):
+        cli.apply_(file=file, chunk_size=2)
+
+    # UTI take precedence over file extensions, also across chunks
+    assert stub.workspace.handlers == {
+        "public.python-script": PREVIEW,
+        "net.daringfireball.markdown": TEXTEDIT,
+        "http": PREVIEW,
+    }
+    assert [
+        record.getMessage()
+        for record in caplog.records
+        if record.getMessage().startswith(("Read", "Chunk"))
+    ] == [
+        "Read 2 definitions.",
+        "Read 4 definitions.",
+        "Read 5 definitions.",
+        "Chunk 1: planned 2 of 3 targets, 2 changes.",
+        "Chunk 2: planned 3 of 3 targets, 1 changes.",
+    ]
+    chunks = list(yaml.safe_load_all(capsys.readouterr().out))
+    # changes are reported as the entries that took effect
+    assert [set(chunk["changes"]["utis"]) for chunk in chunks[:2]] == [
+        {"public.python-script"},
+        set(),
+    ]
+    assert chunks[0]["changes"]["extensions"] == {"md": {"from": None, "to": TEXTEDIT}}
+    assert chunks[1]["changes"]["schemes"] == {"http": {"from": None, "to": PREVIEW}}
+    assert not cli.errors
+
+
+def test_stream_follows_precedence(tmp_path, stub, monkeypatch):
+    file = tmp_path / "config.yaml"
+    file.write_text(
+        "app:\n  Preview:\n    uti:\n      - public.python-script\n"
+        "    scheme:\n      - http\n"
+        "ext:\n  py: TextEdit\n  md: Preview\n"
+        "scheme:\n  http: TextEdit\n",
+        encoding="utf-8",
+    )
+    initial = dict(stub.workspace.handlers)
+    cli = DootiCLI(assume_yes=True, dooti=stub)
+    cli._apply_diff(cli.apply_(file=file)[1])  # pylint: disable=protected-access
+    expected = stub.workspace.handlers
+
+    assert expected == {
+        "public.python-script": PREVIEW,
+        "net.daringfireball.markdown": PREVIEW,
+        "http": PREVIEW,
+    }
+
+    writes = []
+    write = StubDooti._set
+
+    def record(self, target, path, completion):
+        writes.append(target)
+        write(self, target, path, completion)
+
+    monkeypatch.setattr(StubDooti, "_set", record)
+    stub.workspace.handlers = initial
+    stub.refresh_handlers()
+    DootiCLI(assume_yes=True, dooti=stub).apply_(file=file, stream=True, chunk_size=1)
+    assert stub.workspace.handlers == expected
+    # each target is written once, after its last claim was read
+    assert sorted(writes) == sorted(expected)
+
+
+def test_stream_dry_run(tmp_path, stub, capsys):
+    file = _jsonl(tmp_path, ("ext", "py", "Preview"), ("ext", "md", "TextEdit"))
+    with pytest.raises(ValueError, match="Pass `-y`"):
+        DootiCLI(dooti=stub).apply_(file=file)
+
+    DootiCLI(dry_run=True, dooti=stub).apply_(file=file, chunk_size=1)
+    assert stub.workspace.handlers == {"public.python-script": TEXTEDIT}
+    chunks = list(yaml.safe_load_all(capsys.readouterr().out))
+    assert len(chunks) == 2
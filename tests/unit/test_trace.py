@@ -0,0 +1,68 @@
+import argparse
+import json
+import threading
+
+from dooti import trace
+from dooti.cli import DootiCLI
+
+
+def test_not_recording():
+    with trace.span("read"):
+        pass
+    trace.end(trace.begin("write"))
+    assert not trace._RECORDERS  # pylint: disable=protected-access
+
+
+def test_recording(tmp_path):
+    out = tmp_path / "trace.json"
+    with trace.recording(out):
+        with trace.span("plan", command="apply_"):
+            token = trace.begin("write", target="public.html")
+        thread = threading.Thread(target=trace.end, args=(token,))
+        thread.start()
+        thread.join()
+
+    data = json.loads(out.read_text(encoding="utf-8"))
+    events = {(event["name"], event["ph"]): event for event in data["traceEvents"]}
+    assert set(events) == {
+        ("dooti", "X"),
+        ("plan", "X"),
+        ("write", "b"),
+        ("write", "e"),
+    }
+    root, plan = events["dooti", "X"], events["plan", "X"]
+    assert plan["args"] == {"command": "apply_"}
+    assert root["ts"] <= plan["ts"]
+    assert plan["ts"] + plan["dur"] <= root["ts"] + root["dur"]
+
+    begin, end = events["write", "b"], events["write", "e"]
+    assert begin["id"] == end["id"]
+    assert begin["args"] == {"target": "public.html"}
+    assert begin["tid"] != end["tid"]
+    assert begin["ts"] <= end["ts"]
+
+
+def test_saved_on_error(tmp_path):
+    out = tmp_path / "trace.json"
+    try:
+        with trace.recording(out):
+            with trace.span("parse config"):
+                raise ValueError("invalid")
+    except ValueError:
+        pass
+    names = [event["name"] for event in json.loads(out.read_text())["traceEvents"]]
+    assert names == ["parse config", "dooti"]
+
+
+def test_apply_spans(tmp_path, monkeypatch):
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    file = tmp_path / "config.yaml"
+    file.write_text("scheme:\n  http: Firefox\n", encoding="utf-8")
+    out = tmp_path / "trace.json"
+    cli = DootiCLI()
+    with trace.recording(out):
+        # pylint: disable-next=protected-access
+        with cli._serialize("apply_", argparse.Namespace()):
+            cli._find_config(file)  # pylint: disable=protected-access
+    names = [event["name"] for event in json.loads(out.read_text())["traceEvents"]]
+    assert names == ["apply lock", "find config", "dooti"]
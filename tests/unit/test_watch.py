@@ -0,0 +1,201 @@
+import plistlib
+import socket
+import subprocess
+
+from dooti.catalog import Catalog
+from dooti.watch import (
+    APPS,
+    HANDLERS,
+    Event,
+    Schedule,
+    Watcher,
+    changed_targets,
+    host_id,
+    read_handlers,
+)
+from tests.helpers import FakeWorkspace, StubDooti
+
+FIREFOX = "/Applications/Firefox.app"
+SAFARI = "/Applications/Safari.app"
+
+
+def _stub(handlers, ext_utis):
+    tags = {
+        uti: {"ext": [ext], "mime": []}
+        for ext, utis in ext_utis.items()
+        for uti in utis
+    }
+    catalog = Catalog(extensions=ext_utis, utis=tags, tags=tags, exported=tags)
+    return StubDooti(workspace=FakeWorkspace({}, handlers), catalog=catalog)
+
+
+def test_watcher_checks_affected_targets():
+    plan = {
+        "utis": {"public.html": FIREFOX, "public.png": FIREFOX},
+        "schemes": {"http": FIREFOX},
+    }
+    dooti = _stub(
+        {"public.html": FIREFOX, "public.png": FIREFOX, "http": SAFARI},
+        {"png": ["public.png"]},
+    )
+    refreshed = []
+    dooti.refresh = lambda: refreshed.append(True)
+    replans = []
+
+    def replan():
+        replans.append(True)
+        return plan
+
+    def events():
+        dooti.reads.clear()
+        dooti.workspace.handlers["public.html"] = SAFARI
+        yield Event(HANDLERS, ("uti:public.html", "uti:public.jpeg"))
+        dooti.reads.clear()
+        dooti.workspace.handlers["public.png"] = SAFARI
+        yield Event(HANDLERS, ("ext:png",))
+        dooti.reads.clear()
+        yield Event(APPS)
+
+    results = Watcher(dooti, plan, replan=replan).run(events())
+
+    # the whole plan is checked first
+    changes, errors = next(results)
+    assert changes.to_dict() == {
+        "utis": {},
+        "schemes": {"http": {"from": SAFARI, "to": FIREFOX}},
+    }
+    assert not errors
+
+    # only affected targets that are managed are read
+    changes, _ = next(results)
+    assert dooti.reads == ["public.html"]
+    assert changes.to_dict()["utis"] == {"public.html": {"from": SAFARI, "to": FIREFOX}}
+
+    changes, _ = next(results)
+    assert dooti.reads == ["public.png"]
+    assert len(changes) == 1
+
+    # installed or removed apps trigger a full check with a fresh plan
+    changes, _ = next(results)
+    assert sorted(dooti.reads) == ["http", "public.html", "public.png"]
+    assert not changes
+    assert refreshed == [True]
+    assert replans == [True]
+    assert dooti.workspace.handlers == {
+        "public.html": FIREFOX,
+        "public.png": FIREFOX,
+        "http": FIREFOX,
+    }
+
+
+def test_dry_run_does_not_write():
+    dooti = _stub({"http": SAFARI}, {})
+    watcher = Watcher(dooti, {"schemes": {"http": FIREFOX}}, dry_run=True)
+    changes, _ = watcher.handle(Event(HANDLERS, ("scheme:http",)))
+    assert len(changes) == 1
+    assert dooti.workspace.handlers["http"] == SAFARI
+
+
+def test_read_handlers(tmp_path):
+    prefs = tmp_path / "com.apple.launchservices.secure.plist"
+    handlers = [
+        {
+            "LSHandlerContentType": "public.html",
+            "LSHandlerRoleAll": "org.mozilla.firefox",
+        },
+        {"LSHandlerURLScheme": "http", "LSHandlerRoleAll": "com.apple.safari"},
+        {
+            "LSHandlerContentTag": "md",
+            "LSHandlerContentTagClass": "public.filename-extension",
+            "LSHandlerRoleViewer": "com.apple.TextEdit",
+        },
+        {"LSHandlerPreferredVersions": {}},
+    ]
+    with open(prefs, "wb") as f:
+        plistlib.dump({"LSHandlers": handlers}, f, fmt=plistlib.FMT_BINARY)
+    previous = read_handlers(prefs)
+    assert previous == {
+        "uti:public.html": (("LSHandlerRoleAll", "org.mozilla.firefox"),),
+        "scheme:http": (("LSHandlerRoleAll", "com.apple.safari"),),
+        "ext:md": (("LSHandlerRoleViewer", "com.apple.TextEdit"),),
+    }
+
+    handlers[0]["LSHandlerRoleAll"] = "com.apple.safari"
+    handlers[1]["LSHandlerRoleAll"] = "com.apple.safari"
+    handlers.append({"LSHandlerURLScheme": "mailto", "LSHandlerRoleAll": "x"})
+    with open(prefs, "wb") as f:
+        plistlib.dump({"LSHandlers": handlers}, f, fmt=plistlib.FMT_BINARY)
+    assert changed_targets(previous, read_handlers(prefs)) == (
+        "scheme:mailto",
+        "uti:public.html",
+    )
+
+    assert read_handlers(tmp_path / "missing.plist") == {}
+    prefs.write_text("garbage", encoding="utf-8")
+    assert read_handlers(prefs) is None
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+def test_schedule_offset_and_backoff():
+    clock = FakeClock()
+    schedule = Schedule(900, 300, host="host-1", clock=clock, sleep=clock.sleep)
+    assert 0 <= schedule.offset < 300
+    assert schedule.offset == Schedule(900, 300, host="host-1").offset
+    assert schedule.offset != Schedule(900, 300, host="host-2").offset
+
+    start = clock.now + schedule.offset
+    outcomes = [False, True, True, False]
+    runs = []
+    for event in schedule:
+        assert HANDLERS == event.kind
+        runs.append(clock.now - start)
+        if not outcomes:
+            break
+        schedule.record(failed=outcomes.pop(0))
+    # failures double the delay, success restores the interval
+    assert runs == [0, 900, 2700, 6300, 7200]
+    assert max(clock.sleeps) <= 60
+
+
+def test_host_id(monkeypatch):
+    ioreg = '  "IOPlatformUUID" = "0F1E2D3C-0000-1111-2222-333344445555"\n'
+
+    def run(*_, **__):
+        return subprocess.CompletedProcess([], 0, stdout=ioreg)
+
+    monkeypatch.setattr(subprocess, "run", run)
+    assert host_id() == "0F1E2D3C-0000-1111-2222-333344445555"
+    assert Schedule(900, 300).offset == Schedule(900, 300, host=host_id()).offset
+
+    def missing(*_, **__):
+        raise FileNotFoundError("ioreg")
+
+    monkeypatch.setattr(subprocess, "run", missing)
+    assert host_id() == socket.gethostname()
+
+
+def test_schedule_skips_missed_runs():
+    clock = FakeClock()
+    schedule = Schedule(900, clock=clock, sleep=clock.sleep)
+    assert not schedule.offset
+    start = clock.now
+    runs = []
+    for _ in schedule:
+        runs.append(clock.now - start)
+        if len(runs) == 2:
+            break
+        # the system slept through the next run
+        clock.now += 2000
+    assert runs == [0, 2700]